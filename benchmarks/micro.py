@@ -0,0 +1,280 @@
+"""
+Times the hot paths behind the menus on synthetic data: rendering tables, building
+models from procedure results, looking up IDs and turning results into table rows.
+
+    python -m benchmarks.micro run [--sizes 1000 100000] [--save results.json]
+    python -m benchmarks.micro compare baseline.json [results.json] [--threshold 0.1]
+
+compare runs the benchmarks itself when no results file is given, and exits with an
+error if any benchmark got slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+from helpers import print_table
+from identity_map import IdentityMap
+from recipe import Recipe
+
+# Row counts every benchmark runs at by default
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+# PrettyTable only formats some thousands of rows a second once tables are paged, so
+# larger tables are left out of the table rendering benchmark
+TABLE_MAX_ROWS = 10_000
+
+# Seconds each benchmark is repeated for (at least MIN_REPEAT times), the fastest
+# run being the one reported
+TIME_BUDGET = 0.5
+MIN_REPEAT = 3
+
+# How much slower than the baseline a benchmark may get before compare flags it
+REGRESSION_THRESHOLD = 0.10
+
+RECIPE_COLUMNS = ["recipe_id", "name", "instructions", "cooking_time", "category_names"]
+
+
+def recipe_tuples(n: int) -> tuple[dict[str, int], list[tuple]]:
+    """
+    Returns n rows shaped like get_all_recipes_for_user's, as call_proc_tuples returns
+    them
+    """
+    rng = random.Random(n)
+    rows = [
+        (
+            i,
+            f"Recipe {i}",
+            "Mix everything together and bake until golden. " * rng.randint(1, 5),
+            rng.randint(60, 7200),
+            ",".join(rng.sample(["Baking", "Dinner", "Quick", "Vegan", "Soup"], 2)),
+        )
+        for i in range(1, n + 1)
+    ]
+    return {column: i for i, column in enumerate(RECIPE_COLUMNS)}, rows
+
+
+def recipe_dicts(n: int) -> list[dict[str,]]:
+    """
+    Returns the same rows as recipe_tuples as call_proc returns them
+    """
+    _, rows = recipe_tuples(n)
+    return [dict(zip(RECIPE_COLUMNS, row)) for row in rows]
+
+
+def list_item_dicts(n: int) -> list[dict[str,]]:
+    """
+    Returns n rows shaped like get_ingredients_for_list's
+    """
+    rng = random.Random(n)
+    return [
+        {"item_id": i, "name": f"Ingredient {i}", "completed": rng.randint(0, 1)}
+        for i in range(1, n + 1)
+    ]
+
+
+def bench_print_table(n: int):
+    if n > TABLE_MAX_ROWS:
+        return None
+    rows = [(i, f"Recipe {i}") for i in range(1, n + 1)]
+
+    def run():
+        # answer no prompts, and throw the output away
+        with contextlib.redirect_stdout(io.StringIO()):
+            stdin, sys.stdin = sys.stdin, io.StringIO()
+            try:
+                print_table(["ID", "Name"], rows)
+            finally:
+                sys.stdin = stdin
+
+    return run
+
+
+def bench_models_from_dicts(n: int):
+    rows = recipe_dicts(n)
+    return lambda: [Recipe(row) for row in rows]
+
+
+def bench_models_from_rows(n: int):
+    columns, rows = recipe_tuples(n)
+    return lambda: Recipe.from_rows(columns, rows)
+
+
+def bench_identity_map_load(n: int):
+    columns, rows = recipe_tuples(n)
+    return lambda: IdentityMap().load(Recipe, columns, rows)
+
+
+def bench_id_lookup(n: int):
+    columns, rows = recipe_tuples(n)
+    recipes = IdentityMap().load(Recipe, columns, rows)
+    # half of the IDs entered exist
+    probes = random.Random(n).choices(range(1, 2 * n + 1), k=n)
+    return lambda: sum(1 for probe in probes if probe in recipes)
+
+
+def bench_recipe_table_rows(n: int):
+    columns, rows = recipe_tuples(n)
+    recipes = IdentityMap().load(Recipe, columns, rows)
+    return lambda: list((recipe.id, recipe.name) for recipe in recipes.values())
+
+
+def bench_list_item_rows(n: int):
+    items = list_item_dicts(n)
+    return lambda: list(
+        (row.get("item_id"), row.get("name"), "x" if row.get("completed") == 1 else "")
+        for row in items
+    )
+
+
+# name -> function taking a row count and returning the function to time, or None if
+# the benchmark does not run at that size
+BENCHMARKS = {
+    "print_table": bench_print_table,
+    "models_from_dicts": bench_models_from_dicts,
+    "models_from_rows": bench_models_from_rows,
+    "identity_map_load": bench_identity_map_load,
+    "id_lookup": bench_id_lookup,
+    "recipe_table_rows": bench_recipe_table_rows,
+    "list_item_rows": bench_list_item_rows,
+}
+
+
+def measure(run) -> float:
+    """
+    Returns the fastest time in seconds of repeated calls to run
+    """
+    started = time.perf_counter()
+    run()
+    best = time.perf_counter() - started
+
+    repeat = max(MIN_REPEAT, int(TIME_BUDGET / best) if best else MIN_REPEAT)
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+def run_benchmarks(sizes: list[int], only: list[str] = None) -> dict[str, float]:
+    """
+    Runs every benchmark (or the ones named in only) at every size, printing each
+    result as it comes. Returns the seconds each took keyed by "name[size]"
+    """
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+
+        for n in sizes:
+            run = bench(n)
+            if run is None:
+                continue
+
+            key = f"{name}[{n}]"
+            results[key] = measure(run)
+            rate = n / results[key] if results[key] else float("inf")
+            print(f"{key:<28} {results[key] * 1000:10.3f} ms  {rate:14,.0f} rows/s")
+
+    return results
+
+
+def save_results(path: str, results: dict[str, float]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+
+def load_results(path: str) -> dict[str, float]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(
+    baseline: dict[str, float], results: dict[str, float], threshold: float
+) -> list[str]:
+    """
+    Prints how every benchmark in both sets of results changed and returns the names of
+    the ones that got slower by more than threshold
+    """
+    regressions = []
+    rows = []
+    for key in baseline.keys() & results.keys():
+        change = results[key] / baseline[key] - 1 if baseline[key] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "REGRESSION"
+        elif change < -threshold:
+            flag = "faster"
+        rows.append(
+            (
+                key,
+                f"{baseline[key] * 1000:.3f}",
+                f"{results[key] * 1000:.3f}",
+                f"{change:+.1%}",
+                flag,
+            )
+        )
+
+    print_table(
+        ["Benchmark", "Baseline ms", "Now ms", "Change", ""],
+        sorted(rows),
+        page_size=len(rows) or 1,
+    )
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks")
+    cmp = commands.add_parser("compare", help="Compare results against a baseline")
+    cmp.add_argument("baseline", help="Results saved by run --save")
+    cmp.add_argument("results", nargs="?", help="Defaults to running the benchmarks")
+    cmp.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+
+    for command in (run, cmp):
+        command.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+        command.add_argument(
+            "--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run"
+        )
+        command.add_argument("--save", metavar="FILE", help="Save the results as JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare" and args.results:
+        results = load_results(args.results)
+    else:
+        results = run_benchmarks(args.sizes, args.only)
+
+    if args.save:
+        save_results(args.save, results)
+
+    if args.command == "compare":
+        regressions = compare(load_results(args.baseline), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Measures how long RecipeMaster takes to start: the time to import the interactive app
+and the command line (from python -X importtime, slowest modules listed), and the
+wall-clock time from launching the app to its first prompt. Fails if any of them is
+over its budget.
+
+    python -m benchmarks.startup [--runs N]
+"""
+
+import argparse
+import os
+import select
+import subprocess
+import sys
+import time
+
+# Directory the app's modules are in
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds each measurement may take before the benchmark fails
+STARTUP_BUDGET = {
+    "import source": 50,
+    "import cli": 120,
+    "first prompt": 250,
+}
+
+# Text the app prints as its first prompt
+FIRST_PROMPT = "Go to:"
+
+# Seconds to wait for the first prompt before giving up
+PROMPT_TIMEOUT = 10
+
+
+def import_times(module: str) -> list[tuple[str, int]]:
+    """
+    Imports module in a fresh interpreter and returns (module name, cumulative
+    microseconds) for every module imported, the module itself last
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(cumulative)))
+    return times
+
+
+def time_to_prompt() -> float:
+    """
+    Launches the app and returns the seconds until it shows its first prompt. Database
+    settings are given through the environment so the app goes straight to its own
+    login, and nothing needs to be listening on the database port
+    """
+    env = dict(
+        os.environ,
+        RECIPEMASTER_DB_HOST="127.0.0.1",
+        RECIPEMASTER_DB_USER="benchmark",
+        RECIPEMASTER_DB_PASSWORD="benchmark",
+    )
+
+    started = time.perf_counter()
+    app = subprocess.Popen(
+        [sys.executable, "-u", "source.py"],
+        cwd=ROOT,
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        output = b""
+        deadline = started + PROMPT_TIMEOUT
+        while FIRST_PROMPT.encode() not in output:
+            remaining = deadline - time.perf_counter()
+            ready, _, _ = select.select([app.stdout], [], [], max(0, remaining))
+            chunk = os.read(app.stdout.fileno(), 4096) if ready else b""
+            if not chunk:
+                raise RuntimeError("The app exited or stalled before its first prompt")
+            output += chunk
+        return time.perf_counter() - started
+    finally:
+        app.kill()
+        app.wait()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Best of this many runs is reported"
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports listed"
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+
+    for module in ("source", "cli"):
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(runs, key=lambda times: times[-1][1])
+        results[f"import {module}"] = best[-1][1] / 1000
+
+        print(f"Slowest imports for {module}:")
+        for name, cumulative in sorted(best, key=lambda t: t[1], reverse=True)[
+            : args.top
+        ]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+        print()
+
+    results["first prompt"] = min(time_to_prompt() for _ in range(args.runs)) * 1000
+
+    over_budget = False
+    for name, ms in results.items():
+        budget = STARTUP_BUDGET[name]
+        status = "ok" if ms <= budget else "OVER BUDGET"
+        over_budget |= ms > budget
+        print(f"{name:<14} {ms:7.1f} ms  (budget {budget} ms)  {status}")
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
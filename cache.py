@@ -0,0 +1,286 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Iterable
+
+# Procedures whose names start with one of these change data, so calling one
+# invalidates the cached results it could have made stale
+MUTATING_PREFIXES = ("create_", "update_", "delete_", "add_", "remove_", "toggle_")
+
+# Read procedures that return data across every user rather than data owned by the
+# calling user, so any user's write has to invalidate them
+SHARED_PROCS = {"get_all_reviews", "get_reviews_after"}
+
+# Scope used for the results of shared procedures
+SHARED_SCOPE = None
+
+# The parts of a user's data that are kept apart from the database, such as in the
+# search index or the offline copy, and read again when a write changes them
+DATA_SECTIONS = ("recipes", "ingredients", "categories", "lists")
+
+# The sections each write can change. Any write not listed here could change every
+# section
+WRITE_SECTIONS = {
+    "create_recipe": ("recipes",),
+    "update_recipe": ("recipes",),
+    "delete_recipe": ("recipes", "categories"),
+    "add_ingredient_to_recipe": ("recipes",),
+    "update_recipe_ingredient": ("recipes",),
+    "remove_ingredient_from_recipe": ("recipes",),
+    "add_recipe_to_category": ("recipes", "categories"),
+    "remove_recipe_from_category": ("recipes", "categories"),
+    "create_category": ("categories",),
+    "update_category_name": ("categories", "recipes"),
+    "delete_category": ("categories", "recipes"),
+    "create_ingredient": ("ingredients",),
+    "update_ingredient_name": ("ingredients", "recipes", "lists"),
+    "delete_ingredient": ("ingredients", "recipes", "lists"),
+    "create_list": ("lists",),
+    "update_list_name": ("lists",),
+    "delete_list": ("lists",),
+    "create_list_item": ("lists",),
+    "toggle_item_status_in_list": ("lists",),
+    "remove_item_from_list": ("lists",),
+    # reviews and users are in none of them
+    "create_review": (),
+    "update_review_rating": (),
+    "update_review_text": (),
+    "delete_review": (),
+    "create_user": (),
+}
+
+
+def is_mutating(proc_name: str) -> bool:
+    """
+    Returns whether the stored procedure with the given name writes to the database
+    """
+    return proc_name.startswith(MUTATING_PREFIXES)
+
+
+def changed_sections(written: Iterable[str]) -> set[str]:
+    """
+    Returns the sections of a user's data that the writes made with the given
+    procedures (or raw queries) could have changed
+    """
+    return {
+        section
+        for proc_name in written
+        for section in WRITE_SECTIONS.get(proc_name, DATA_SECTIONS)
+    }
+
+
+class ResultCache:
+    """
+    A bounded least recently used cache of stored procedure results. Entries expire
+    after ttl seconds and are grouped by scope (the user they belong to) so that a
+    user's writes only invalidate that user's results and the shared ones
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # bumped on every invalidation, so a read that started before one can tell its
+        # rows may be stale
+        self.generation = 0
+
+        # (scope, proc name, args, kind) -> (time stored, rows), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope, proc_name: str, args: list, kind: str = "dict"):
+        """
+        Returns the cached rows for a call or None if there are none or they expired.
+        kind tells apart the different shapes the same call's results can be fetched in
+        """
+        key = (scope, proc_name, tuple(args), kind)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, scope, proc_name: str, args: list, kind: str = "dict") -> bool:
+        """
+        Returns whether a call's rows are cached, without counting it as a hit or miss
+        """
+        key = (scope, proc_name, tuple(args), kind)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    def put(
+        self,
+        scope,
+        proc_name: str,
+        args: list,
+        rows: tuple,
+        kind: str = "dict",
+        generation: int = None,
+    ):
+        """
+        Stores the rows returned by a call, evicting the least recently used entries
+        if the cache is full. If the generation the read started in is given and
+        something has been invalidated since, the rows are dropped instead
+        """
+        key = (scope, proc_name, tuple(args), kind)
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic(), rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, scope):
+        """
+        Drops every entry belonging to scope along with every shared entry
+        """
+        with self._lock:
+            stale = [
+                key
+                for key in self._entries
+                if key[0] == scope or key[0] is SHARED_SCOPE
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the hit, miss and invalidation counters along with the current size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+def copy_rows(result, kind: str = "dict"):
+    """
+    Returns a copy of a call's cached rows that the caller can change without changing
+    the cache. Rows fetched as tuples cannot be changed, only the column positions
+    """
+    if kind == "tuples":
+        columns, rows = result
+        return dict(columns), rows
+    return tuple(dict(row) for row in result)
+
+
+class RecordedTransaction:
+    """
+    A transaction that notes the name of every procedure called in it
+    """
+
+    def __init__(self, tx, written: Counter):
+        self.tx = tx
+        self.written = written
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        self.written[proc_name] += 1
+        return self.tx.callproc(proc_name, args)
+
+    def callproc_many(self, proc_name: str, arg_rows: list[list]):
+        self.written[proc_name] += 1
+        return self.tx.callproc_many(proc_name, arg_rows)
+
+
+class CachedDatabase:
+    """
+    Wraps a database (such as a ConnectionPool) for a single user so stored procedure
+    reads are served from a ResultCache and writes invalidate that user's entries
+    """
+
+    def __init__(self, db, cache: ResultCache, user_id: int):
+        self.db = db
+        self.cache = cache
+        self.user_id = user_id
+        # number of calls to each procedure that wrote to the database this session,
+        # along with any raw queries run, so what they changed can be read again
+        # elsewhere
+        self.written = Counter()
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        return self._call(self.db.callproc, proc_name, args, "dict")
+
+    def callproc_tuples(
+        self, proc_name: str, args: list = []
+    ) -> tuple[dict[str, int], tuple[tuple, ...]]:
+        return self._call(self.db.callproc_tuples, proc_name, args, "tuples")
+
+    def _call(self, fetch, proc_name: str, args: list, kind: str):
+        if is_mutating(proc_name):
+            self.written[proc_name] += 1
+            try:
+                return fetch(proc_name, args)
+            finally:
+                # invalidate even when the call fails, it may have partly gone through
+                self.cache.invalidate(self.user_id)
+
+        scope = SHARED_SCOPE if proc_name in SHARED_PROCS else self.user_id
+
+        result = self.cache.get(scope, proc_name, args, kind)
+        if result is None:
+            # rows read while a write invalidated the cache are not cached stale
+            generation = self.cache.generation
+            result = fetch(proc_name, args)
+            self.cache.put(scope, proc_name, args, result, kind, generation)
+
+        return copy_rows(result, kind)
+
+    def warm(self, proc_name: str, args: list = [], kind: str = "dict"):
+        """
+        Reads a call's rows into the cache ahead of time if they are not there already,
+        as dicts or as tuples depending on kind. Safe to call from another thread: rows
+        read while a write invalidated the cache are thrown away rather than cached stale
+        """
+        scope = SHARED_SCOPE if proc_name in SHARED_PROCS else self.user_id
+        if self.cache.contains(scope, proc_name, args, kind):
+            return
+
+        fetch = self.db.callproc_tuples if kind == "tuples" else self.db.callproc
+        generation = self.cache.generation
+        rows = fetch(proc_name, args)
+        self.cache.put(scope, proc_name, args, rows, kind, generation)
+
+    def stream(self, proc_name: str, args: list = []):
+        # streamed results are too large to be worth caching
+        return self.db.stream(proc_name, args)
+
+    @contextmanager
+    def transaction(self):
+        try:
+            with self.db.transaction() as tx:
+                yield RecordedTransaction(tx, self.written)
+        finally:
+            self.cache.invalidate(self.user_id)
+
+    def execute(self, query: str, args: list = []) -> tuple[dict[str,], ...]:
+        # raw queries are not cached, they could do anything
+        self.written[query] += 1
+        self.cache.invalidate(self.user_id)
+        return self.db.execute(query, args)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,733 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import shlex
+import sys
+from collections import Counter
+from getpass import getpass
+from typing import TYPE_CHECKING
+
+from cache import RecordedTransaction
+from config import BACKENDS, database_key, db_settings, is_embedded, open_database
+from helpers import DUPLICATE_CODE, NOT_FOUND_CODE, print_table
+from metrics import instrument
+
+# only the parser's defaults and the errors main reports are imported up front. The
+# modules doing the work of a command (and pymysql, which only MySQL needs) are
+# imported when it runs
+from exporter import EXPORT_FORMATS
+from importer import IMPORT_CHUNK_SIZE, RecipeImportError
+from leaderboard import LEADERBOARD_SIZE
+
+if TYPE_CHECKING:
+    from pool import ConnectionPool, Transaction
+
+# Number of commands from a batch file that are committed together by default
+BATCH_GROUP_SIZE = 100
+
+
+class CommandError(Exception):
+    """
+    Raised when a command cannot be carried out because of what it was given
+    """
+
+
+class Session:
+    """
+    What the commands of one run share, like the app's State: the user, the key of the
+    database naming the files saved for them, the number of calls to each procedure
+    that wrote so far and the pantry index once it is loaded
+    """
+
+    def __init__(self, user_id: int, db_key: str):
+        self.user_id = user_id
+        self.db_key = db_key
+        self.written = Counter()
+        self.pantry_index = None
+        # the writes made as of the pantry index's last sync, None before the first
+        self.pantry_synced = None
+
+
+class BatchArgumentParser(argparse.ArgumentParser):
+    """
+    Parses the commands in a batch file, raising CommandError for a bad one instead of
+    printing the usage and exiting. Subparsers are made of the same class, so this
+    covers every command
+    """
+
+    def error(self, message: str):
+        raise CommandError(message)
+
+
+def recipe_ls(tx: Transaction, user_id: int, args: argparse.Namespace):
+    recipes = tx.callproc("get_all_recipes_for_user", [user_id])
+    print_table(
+        ["ID", "Name", "Cooking time"],
+        (
+            (row.get("recipe_id"), row.get("name"), row.get("cooking_time"))
+            for row in recipes
+        ),
+    )
+
+
+def recipe_add(tx: Transaction, user_id: int, args: argparse.Namespace):
+    ingredients = {}
+    for pair in args.ingredient:
+        ing_id, sep, amount = pair.partition("=")
+        if not sep or not ing_id.isdigit():
+            raise CommandError(f"Expected INGREDIENT_ID=AMOUNT, got '{pair}'")
+        if int(ing_id) in ingredients:
+            raise CommandError("Duplicate ingredient in the recipe is not allowed")
+        ingredients[int(ing_id)] = amount
+
+    from recipe_writes import write_full_recipe
+
+    recipe_id = write_full_recipe(
+        tx,
+        user_id,
+        args.name,
+        args.instructions,
+        args.cooking_time,
+        ingredients,
+        list(dict.fromkeys(args.category)),
+    )
+    return f"Created new recipe with ID {recipe_id}"
+
+
+def recipe_import(db: ConnectionPool, user_id: int, args: argparse.Namespace):
+    # commits a chunk at a time itself, so it is given the pool instead of a transaction
+    from importer import clean_records, import_recipes, read_csv, read_jsonl
+
+    fmt = args.format or ("csv" if args.file.endswith(".csv") else "jsonl")
+    reader = read_csv if fmt == "csv" else read_jsonl
+
+    with open_input(args.file) as f:
+        report = import_recipes(
+            db, user_id, clean_records(reader(f)), args.chunk_size, print
+        )
+
+    print(
+        f"Done. {report}, with {report.created_ingredients} new ingredient(s) "
+        f"and {report.created_categories} new category(s)"
+    )
+
+
+def export(db: ConnectionPool, user_id: int, args: argparse.Namespace):
+    from exporter import export_catalog
+
+    export_catalog(db, user_id, args.directory, args.format, print)
+
+
+def recipe_cook(tx: Transaction, user_id: int, args: argparse.Namespace):
+    from pantry import synced_pantry
+    from recipe import Recipe
+
+    recipes = {
+        row.get("recipe_id"): Recipe(row)
+        for row in tx.callproc("get_all_recipes_for_user", [user_id])
+    }
+    pantry = synced_pantry(args.session, tx, recipes)
+
+    print_table(
+        ["ID", "Name", "Missing", "Missing ingredient IDs"],
+        (
+            (
+                recipe_id,
+                recipes[recipe_id].name,
+                count,
+                ", ".join(map(str, pantry.ingredients(missing))),
+            )
+            for recipe_id, count, missing in pantry.cookable(
+                args.ingredient_id, args.missing
+            )
+        ),
+    )
+
+
+def recipe_delete(tx: Transaction, user_id: int, args: argparse.Namespace):
+    tx.callproc_many("delete_recipe", [[recipe_id] for recipe_id in args.recipe_id])
+    # their reviews went with them, and the saved rating statistics are only written
+    # once the deletes commit, so have them rebuilt instead
+    from ratings import RatingAggregates, ratings_path
+
+    ratings = RatingAggregates.load(ratings_path(args.db_key))
+    ratings.mark_stale()
+    ratings.save(ratings_path(args.db_key))
+    return f"Deleted {len(args.recipe_id)} recipe(s)"
+
+
+def ingredient_ls(tx: Transaction, user_id: int, args: argparse.Namespace):
+    ingredients = tx.callproc("get_all_ingredients_for_user", [user_id])
+    print_table(
+        ["ID", "Name"],
+        ((row.get("ingredient_id"), row.get("name")) for row in ingredients),
+    )
+
+
+def ingredient_add(tx: Transaction, user_id: int, args: argparse.Namespace):
+    return _create_ingredients(tx, user_id, args.name)
+
+
+def ingredient_import(tx: Transaction, user_id: int, args: argparse.Namespace):
+    # one ingredient name per line, blank lines are ignored
+    with open_input(args.file) as f:
+        names = [line.strip() for line in f]
+
+    return _create_ingredients(tx, user_id, [name for name in names if name])
+
+
+def _create_ingredients(tx: Transaction, user_id: int, names: list[str]) -> str:
+    existing = {
+        row.get("name")
+        for row in tx.callproc("get_all_ingredients_for_user", [user_id])
+    }
+    new_names = [name for name in dict.fromkeys(names) if name not in existing]
+
+    tx.callproc_many("create_ingredient", [[name, user_id] for name in new_names])
+    return (
+        f"Created {len(new_names)} ingredient(s), "
+        f"skipped {len(names) - len(new_names)} that already exist"
+    )
+
+
+def category_ls(tx: Transaction, user_id: int, args: argparse.Namespace):
+    categories = tx.callproc("get_all_categories_for_user", [user_id])
+    print_table(
+        ["ID", "Name", "Number of recipes"],
+        (
+            (row.get("category_id"), row.get("name"), row.get("recipe_num"))
+            for row in categories
+        ),
+    )
+
+
+def category_add(tx: Transaction, user_id: int, args: argparse.Namespace):
+    category_id = tx.callproc("create_category", [args.name, user_id])[0].get(
+        "category_id"
+    )
+    tx.callproc_many(
+        "add_recipe_to_category",
+        [[recipe_id, category_id] for recipe_id in dict.fromkeys(args.recipe)],
+    )
+    return f"Created new category with ID {category_id}"
+
+
+def list_ls(tx: Transaction, user_id: int, args: argparse.Namespace):
+    lists = tx.callproc("get_all_lists_for_user", [user_id])
+    print_table(
+        ["ID", "Name", "Date Created"],
+        (
+            (row.get("list_id"), row.get("name"), row.get("date_created"))
+            for row in lists
+        ),
+    )
+
+
+def list_items(tx: Transaction, user_id: int, args: argparse.Namespace):
+    items = tx.callproc("get_ingredients_for_list", [args.list_id])
+    print_table(
+        ["ID", "Item", "Completed"],
+        (
+            (
+                row.get("item_id"),
+                row.get("name"),
+                "x" if row.get("completed") == 1 else "",
+            )
+            for row in items
+        ),
+    )
+
+
+def list_create(tx: Transaction, user_id: int, args: argparse.Namespace):
+    list_id = tx.callproc("create_list", [args.name, user_id])[0].get("list_id")
+    tx.callproc_many(
+        "create_list_item",
+        [[ing_id, list_id] for ing_id in dict.fromkeys(args.ingredient)],
+    )
+    return f"Created new list with ID {list_id}"
+
+
+def list_shop(tx: Transaction, user_id: int, args: argparse.Namespace):
+    servings = {}
+    for choice in args.recipe:
+        recipe_id, sep, multiplier = choice.partition("=")
+        try:
+            servings[int(recipe_id)] = float(multiplier) if sep else 1.0
+        except ValueError:
+            raise CommandError(
+                f"Expected RECIPE_ID or RECIPE_ID=SERVINGS, got '{choice}'"
+            )
+
+    from shopping import build_shopping_list, write_shopping_list
+
+    items = build_shopping_list(tx, servings)
+    list_id = write_shopping_list(tx, user_id, args.name, items)
+    print_table(
+        ["Item", "Amount needed"],
+        ((item.name, item.amount) for item in items.values()),
+    )
+    return f"Created new list with ID {list_id} (amounts are not saved with it)"
+
+
+def list_add(tx: Transaction, user_id: int, args: argparse.Namespace):
+    tx.callproc_many(
+        "create_list_item",
+        [[ing_id, args.list_id] for ing_id in dict.fromkeys(args.ingredient_id)],
+    )
+    return f"Added {len(args.ingredient_id)} item(s) to list {args.list_id}"
+
+
+def list_toggle(tx: Transaction, user_id: int, args: argparse.Namespace):
+    status = 0 if args.undone else 1
+    tx.callproc_many(
+        "toggle_item_status_in_list",
+        [[item_id, args.list_id, status] for item_id in args.item_id],
+    )
+    return f"Marked {len(args.item_id)} item(s) as {'not ' if args.undone else ''}completed"
+
+
+def review_ls(tx: Transaction, user_id: int, args: argparse.Namespace):
+    reviews = tx.callproc("get_all_reviews")
+    print_table(
+        ["ID", "Recipe Name", "Rating", "Creator Name"],
+        (
+            (
+                row.get("review_id"),
+                row.get("recipe_name"),
+                str(row.get("rating")) + "/10",
+                row.get("creator_name"),
+            )
+            for row in reviews
+        ),
+    )
+
+
+def review_top(db: ConnectionPool, user_id: int, args: argparse.Namespace):
+    # may stream every review to rebuild the saved statistics, so it is given the pool
+    # instead of a transaction
+    from ratings import load_ratings
+
+    ratings = load_ratings(db, args.db_key)
+    if args.trending and not ratings.can_trend:
+        raise CommandError(
+            "Trending needs the date of each review, which this database does not "
+            "give (see get_review_ratings in the README)"
+        )
+    top = ratings.top_trending(args.n) if args.trending else ratings.best_rated(args.n)
+    print_table(
+        ["Rank", "Recipe Name", "Score", "Reviews"],
+        (
+            (rank, ratings.names[key], f"{score:.2f}", ratings.recipes[key].count)
+            for rank, (key, score) in enumerate(top, start=1)
+        ),
+    )
+
+
+def review_add(tx: Transaction, user_id: int, args: argparse.Namespace):
+    if args.rating < 0 or args.rating > 10:
+        raise CommandError("Rating must be between 0 and 10")
+
+    review_id = tx.callproc(
+        "create_review", [args.recipe_id, args.rating, args.text, user_id]
+    )[0].get("review_id")
+    return f"Created new review with ID {review_id}"
+
+
+def open_input(path: str):
+    """
+    Opens a file named on the command line for reading, where - means standard input
+    """
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin)
+    return open(path, encoding="utf-8", newline="")
+
+
+def build_parser(
+    parser_class: type[argparse.ArgumentParser] = argparse.ArgumentParser,
+) -> argparse.ArgumentParser:
+    """
+    Returns the parser for the whole command surface. Connection and login settings
+    fall back to RECIPEMASTER_* environment variables, and the database ones to the
+    config file after that. Commands that write return a message, which is printed
+    only once their transaction has been committed
+    """
+    settings = db_settings()
+    parser = parser_class(
+        prog="recipemaster",
+        exit_on_error=False,
+        description="Run RecipeMaster operations without the interactive menus",
+    )
+    parser.add_argument(
+        "--db-backend",
+        type=str.lower,
+        choices=BACKENDS,
+        default=settings.get("backend", "mysql"),
+    )
+    parser.add_argument("--db-path", default=settings.get("path"), help="SQLite file")
+    parser.add_argument("--db-host", default=settings.get("host", "localhost"))
+    parser.add_argument("--db-user", default=settings.get("user"))
+    parser.add_argument("--user", default=os.environ.get("RECIPEMASTER_USER"))
+
+    groups = parser.add_subparsers(dest="group", required=True)
+
+    recipe = groups.add_parser("recipe", help="Work with recipes")
+    commands = recipe.add_subparsers(dest="command", required=True)
+    commands.add_parser("ls", help="List all recipes").set_defaults(func=recipe_ls)
+    add = commands.add_parser("add", help="Create a recipe")
+    add.add_argument("name")
+    add.add_argument("--instructions", default="")
+    add.add_argument("--cooking-time", type=int, default=0, help="In seconds")
+    add.add_argument(
+        "--ingredient",
+        action="append",
+        default=[],
+        metavar="ID=AMOUNT",
+        help="Add an ingredient, can be repeated",
+    )
+    add.add_argument(
+        "--category",
+        action="append",
+        type=int,
+        default=[],
+        metavar="ID",
+        help="Add the recipe to a category, can be repeated",
+    )
+    add.set_defaults(func=recipe_add)
+    imp = commands.add_parser(
+        "import", help="Create recipes from a JSON Lines or CSV file"
+    )
+    imp.add_argument("file", help="Path to the file, or - for standard input")
+    imp.add_argument(
+        "--format",
+        choices=["jsonl", "csv"],
+        help="Defaults to csv for .csv files and jsonl otherwise",
+    )
+    imp.add_argument(
+        "--chunk-size",
+        type=int,
+        default=IMPORT_CHUNK_SIZE,
+        help="Number of recipes committed together in one transaction",
+    )
+    imp.set_defaults(func=recipe_import, own_transactions=True)
+    cook = commands.add_parser(
+        "cook", help="List the recipes that can be made from some ingredients"
+    )
+    cook.add_argument("ingredient_id", type=int, nargs="*")
+    cook.add_argument(
+        "--missing",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Also list recipes missing up to N of their ingredients",
+    )
+    cook.set_defaults(func=recipe_cook)
+    delete = commands.add_parser("delete", help="Delete recipes")
+    delete.add_argument("recipe_id", type=int, nargs="+")
+    delete.set_defaults(func=recipe_delete)
+
+    ingredient = groups.add_parser("ingredient", help="Work with ingredients")
+    commands = ingredient.add_subparsers(dest="command", required=True)
+    commands.add_parser("ls", help="List all ingredients").set_defaults(
+        func=ingredient_ls
+    )
+    add = commands.add_parser("add", help="Create ingredients")
+    add.add_argument("name", nargs="+")
+    add.set_defaults(func=ingredient_add)
+    imp = commands.add_parser(
+        "import", help="Create ingredients from a file with one name per line"
+    )
+    imp.add_argument("file", help="Path to the file, or - for standard input")
+    imp.set_defaults(func=ingredient_import)
+
+    category = groups.add_parser("category", help="Work with categories")
+    commands = category.add_subparsers(dest="command", required=True)
+    commands.add_parser("ls", help="List all categories").set_defaults(func=category_ls)
+    add = commands.add_parser("add", help="Create a category")
+    add.add_argument("name")
+    add.add_argument(
+        "--recipe",
+        action="append",
+        type=int,
+        default=[],
+        metavar="ID",
+        help="Add a recipe to the category, can be repeated",
+    )
+    add.set_defaults(func=category_add)
+
+    lists = groups.add_parser("list", help="Work with lists")
+    commands = lists.add_subparsers(dest="command", required=True)
+    commands.add_parser("ls", help="List all lists").set_defaults(func=list_ls)
+    items = commands.add_parser("items", help="Show the items in a list")
+    items.add_argument("list_id", type=int)
+    items.set_defaults(func=list_items)
+    create = commands.add_parser("create", help="Create a list")
+    create.add_argument("name")
+    create.add_argument(
+        "--ingredient",
+        action="append",
+        type=int,
+        default=[],
+        metavar="ID",
+        help="Add an ingredient to the list, can be repeated",
+    )
+    create.set_defaults(func=list_create)
+    shop = commands.add_parser(
+        "shop", help="Create a list with the combined ingredients of some recipes"
+    )
+    shop.add_argument("name")
+    shop.add_argument(
+        "recipe",
+        nargs="+",
+        metavar="RECIPE_ID[=SERVINGS]",
+        help="A recipe to shop for, with its amounts multiplied by SERVINGS",
+    )
+    shop.set_defaults(func=list_shop)
+    add = commands.add_parser("add", help="Add ingredients to a list")
+    add.add_argument("list_id", type=int)
+    add.add_argument("ingredient_id", type=int, nargs="+")
+    add.set_defaults(func=list_add)
+    toggle = commands.add_parser("toggle", help="Mark items in a list as completed")
+    toggle.add_argument("list_id", type=int)
+    toggle.add_argument("item_id", type=int, nargs="+")
+    toggle.add_argument(
+        "--undone", action="store_true", help="Mark the items as not completed"
+    )
+    toggle.set_defaults(func=list_toggle)
+
+    review = groups.add_parser("review", help="Work with reviews")
+    commands = review.add_subparsers(dest="command", required=True)
+    commands.add_parser("ls", help="List all reviews").set_defaults(func=review_ls)
+    top = commands.add_parser("top", help="List the best rated recipes")
+    top.add_argument(
+        "--trending",
+        action="store_true",
+        help="Rank by recent reviews instead of by all of them",
+    )
+    top.add_argument("-n", type=int, default=LEADERBOARD_SIZE, help="Number of recipes")
+    top.set_defaults(func=review_top, own_transactions=True)
+    add = commands.add_parser("add", help="Review a recipe")
+    add.add_argument("recipe_id", type=int)
+    add.add_argument("rating", type=int, help="Out of ten")
+    add.add_argument("text")
+    add.set_defaults(func=review_add)
+
+    exp = groups.add_parser(
+        "export", help="Write all of your recipes, lists and reviews to files"
+    )
+    exp.add_argument("directory", help="Directory the files are written to")
+    exp.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    exp.set_defaults(func=export, own_transactions=True)
+
+    batch = groups.add_parser(
+        "batch",
+        help="Run every command in a file (one per line) on a single connection",
+    )
+    batch.add_argument("file", help="Path to the file, or - for standard input")
+    batch.add_argument(
+        "--group-size",
+        type=int,
+        default=BATCH_GROUP_SIZE,
+        help="Number of commands committed together in one transaction",
+    )
+    batch.set_defaults(func=None)
+
+    return parser
+
+
+def read_batch(
+    parser: argparse.ArgumentParser, lines
+) -> list[tuple[int, argparse.Namespace]]:
+    """
+    Parses every command in a batch file up front, so a mistake anywhere in the file
+    is reported before anything is written. Blank lines and lines starting with # are
+    skipped. Returns (line number, parsed command) pairs
+    """
+    commands = []
+
+    for line_num, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            args = parser.parse_args(shlex.split(line))
+        except (argparse.ArgumentError, CommandError, ValueError) as e:
+            raise CommandError(f"Line {line_num}: {e}")
+        except SystemExit:
+            # --help, which has already been printed
+            raise CommandError(f"Line {line_num}: could not parse '{line}'")
+
+        if args.group == "batch":
+            raise CommandError(f"Line {line_num}: batch files cannot run other batches")
+        if getattr(args, "own_transactions", False):
+            raise CommandError(
+                f"Line {line_num}: '{line}' manages its own transactions and "
+                "cannot be run from a batch file"
+            )
+
+        commands.append((line_num, args))
+
+    return commands
+
+
+def run_batch(
+    db: ConnectionPool,
+    session: Session,
+    commands: list[tuple[int, argparse.Namespace]],
+    group_size: int,
+):
+    """
+    Runs parsed batch commands, committing every group_size of them together. If a
+    command fails, its group is rolled back and the rest of the batch is not run. What
+    the commands of a group report is printed once the group has been committed
+    """
+    committed = 0
+
+    for start in range(0, len(commands), group_size):
+        group = commands[start : start + group_size]
+        line_num = group[0][0]
+        messages = []
+
+        try:
+            with db.transaction() as tx:
+                tx = RecordedTransaction(tx, session.written)
+                for line_num, args in group:
+                    messages.append(args.func(tx, session.user_id, args))
+        except (database_error(), CommandError) as e:
+            raise CommandError(
+                f"Line {line_num}: {describe_error(e)}. "
+                f"{committed} command(s) before this group were committed"
+            )
+
+        committed += len(group)
+        for message in messages:
+            if message:
+                print(message)
+
+    print(f"Ran {committed} command(s)")
+
+
+def database_error(name: str = "DatabaseError") -> type[Exception]:
+    """
+    Returns one of pymysql's error classes, which the SQLite backend raises as well. It
+    is called in except clauses, which are only evaluated once something was raised,
+    so pymysql is never imported for a command that succeeds on SQLite
+    """
+    from pymysql import err
+
+    return getattr(err, name)
+
+
+def describe_error(e: Exception) -> str:
+    """
+    Returns a readable explanation of why a command failed
+    """
+    if isinstance(e, database_error()) and e.args:
+        if e.args[0] == DUPLICATE_CODE:
+            return "a duplicate entry is not allowed"
+        if e.args[0] == NOT_FOUND_CODE:
+            return "a referenced ID does not exist"
+    return str(e)
+
+
+def login(db: ConnectionPool, username: str) -> int:
+    """
+    Returns the ID of the RecipeMaster user with the given name, reading the password
+    from RECIPEMASTER_PASSWORD or prompting for it
+    """
+    password = os.environ.get("RECIPEMASTER_PASSWORD")
+    if password is None:
+        password = getpass(f"Password for {username}: ")
+
+    user_id = db.execute("SELECT get_user_id(%s, %s) AS user_id", [username, password])[
+        0
+    ].get("user_id")
+
+    if user_id == -1:
+        raise CommandError("Invalid RecipeMaster credentials")
+
+    return user_id
+
+
+def main(argv: list[str] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.user is None:
+        parser.error("--user (or RECIPEMASTER_USER) is required")
+    if args.db_user is None and not is_embedded({"backend": args.db_backend}):
+        parser.error("--db-user (or RECIPEMASTER_DB_USER) is required for MySQL")
+
+    try:
+        commands = None
+        if args.group == "batch":
+            with open_input(args.file) as f:
+                commands = read_batch(build_parser(BatchArgumentParser), f)
+    except (CommandError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    settings = {"backend": args.db_backend}
+    if args.db_path is not None:
+        settings["path"] = args.db_path
+    if not is_embedded(settings):
+        settings.update(host=args.db_host, user=args.db_user)
+        settings["password"] = db_settings().get("password")
+        if settings["password"] is None:
+            settings["password"] = getpass(f"MySQL password for {args.db_user}: ")
+    # names the database in the paths of the files saved for the user
+    args.db_key = database_key(settings)
+    for _, command in commands or ():
+        command.db_key = args.db_key
+
+    # a single connection serves every command, batch files included. An export
+    # streams from two at once, with a third for any lookups made meanwhile
+    try:
+        db = instrument(open_database(settings, max_size=3))
+    except database_error("OperationalError") as e:
+        print(e, file=sys.stderr)
+        print("Could not open the database", file=sys.stderr)
+        return 1
+
+    try:
+        user_id = login(db, args.user)
+        args.session = Session(user_id, args.db_key)
+        for _, command in commands or ():
+            command.session = args.session
+
+        if commands is not None:
+            run_batch(db, args.session, commands, args.group_size)
+        elif getattr(args, "own_transactions", False):
+            args.func(db, user_id, args)
+        else:
+            with db.transaction() as tx:
+                tx = RecordedTransaction(tx, args.session.written)
+                message = args.func(tx, user_id, args)
+            if message:
+                print(message)
+    except database_error("OperationalError") as e:
+        print(e, file=sys.stderr)
+        print("Could not connect to the database", file=sys.stderr)
+        return 1
+    except (
+        database_error(),
+        CommandError,
+        RecipeImportError,
+        OSError,
+        RuntimeError,
+    ) as e:
+        print(describe_error(e), file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+        metrics = getattr(db, "metrics", None)
+        if metrics is not None:
+            print(f"Metrics saved to {metrics.dump_json()}", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import os
+from configparser import ConfigParser
+
+# Optional file with the database connection settings, for example
+#   [database]
+#   host = localhost
+#   user = root
+#   password = secret
+# or, to keep everything in a local file instead of on a MySQL server
+#   [database]
+#   backend = sqlite
+#   path = ~/recipes.db
+CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".recipemaster", "config.ini")
+
+# Settings that can be given in the [database] section, each overridden by the
+# environment variable it is mapped to
+DB_SETTINGS = {
+    "backend": "RECIPEMASTER_DB_BACKEND",
+    "path": "RECIPEMASTER_DB_PATH",
+    "host": "RECIPEMASTER_DB_HOST",
+    "user": "RECIPEMASTER_DB_USER",
+    "password": "RECIPEMASTER_DB_PASSWORD",
+}
+
+# The database backends that can be chosen, MySQL unless configured otherwise
+BACKENDS = ("mysql", "sqlite")
+
+
+def db_settings(path: str = CONFIG_PATH) -> dict[str, str]:
+    """
+    Returns the database connection settings found in the environment or the config
+    file, leaving out the ones that are in neither
+    """
+    config = ConfigParser()
+    # a missing file is the same as an empty one
+    config.read(path)
+    section = config["database"] if config.has_section("database") else {}
+
+    settings = {}
+    for name, variable in DB_SETTINGS.items():
+        value = os.environ.get(variable, section.get(name))
+        if value is not None:
+            settings[name] = value
+
+    return settings
+
+
+def is_embedded(settings: dict[str, str]) -> bool:
+    """
+    Whether the settings choose the embedded SQLite database, which needs no MySQL login
+    """
+    return settings.get("backend", "mysql").lower() == "sqlite"
+
+
+def open_database(settings: dict[str, str], **pool_args):
+    """
+    Opens the database the settings choose: an SQLiteDatabase on the configured file, or
+    a ConnectionPool (created with pool_args) to the MySQL server. Either is imported
+    only here, so starting up never loads the driver it does not use
+    """
+    backend = settings.get("backend", "mysql").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown database backend {backend!r}")
+
+    if is_embedded(settings):
+        from embedded import DEFAULT_DB_PATH, SQLiteDatabase
+
+        return SQLiteDatabase(os.path.expanduser(settings.get("path", DEFAULT_DB_PATH)))
+
+    from pool import ConnectionPool, mysql_factory
+
+    connect_args = {
+        name: value
+        for name, value in settings.items()
+        if name not in ("backend", "path")
+    }
+    return ConnectionPool(mysql_factory(**connect_args), **pool_args)
+
+
+def database_key(settings: dict[str, str]) -> str:
+    """
+    Returns a short name for the database the settings choose, to keep the files saved
+    for one database (such as a user's search index) apart from those of another, where
+    the same user ID can belong to someone else
+    """
+    if is_embedded(settings):
+        from embedded import DEFAULT_DB_PATH
+
+        path = os.path.expanduser(settings.get("path", DEFAULT_DB_PATH))
+        where = f"sqlite:{os.path.abspath(path)}"
+    else:
+        where = f"mysql:{settings.get('host', 'localhost')}/{settings.get('db', '')}"
+    # only needed once logged in, so kept off the startup path
+    import hashlib
+
+    return hashlib.blake2b(where.encode(), digest_size=6).hexdigest()
@@ -0,0 +1,641 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+
+from helpers import DUPLICATE_CODE, MISSING_PROC_CODE, NOT_FOUND_CODE
+
+# Where the embedded database is kept unless a path is configured
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".recipemaster", "recipes.db")
+
+# MySQL's error code for a failed CHECK constraint, such as a rating above 10
+CHECK_CODE = 3819
+
+# Milliseconds a connection waits for another one's write to finish before failing
+BUSY_TIMEOUT = 5000
+
+# Iterations of PBKDF2 used to hash passwords
+PASSWORD_ITERATIONS = 100_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password_hash BLOB NOT NULL,
+    salt BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS recipes (
+    recipe_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    instructions TEXT,
+    cooking_time INTEGER,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS ingredients (
+    ingredient_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS recipe_ingredients (
+    recipe_id INTEGER NOT NULL REFERENCES recipes ON DELETE CASCADE,
+    ingredient_id INTEGER NOT NULL REFERENCES ingredients ON DELETE CASCADE,
+    amount TEXT,
+    PRIMARY KEY (recipe_id, ingredient_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS recipe_ingredients_by_ingredient
+    ON recipe_ingredients (ingredient_id);
+
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS recipe_categories (
+    recipe_id INTEGER NOT NULL REFERENCES recipes ON DELETE CASCADE,
+    category_id INTEGER NOT NULL REFERENCES categories ON DELETE CASCADE,
+    PRIMARY KEY (recipe_id, category_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS recipe_categories_by_category
+    ON recipe_categories (category_id);
+
+CREATE TABLE IF NOT EXISTS lists (
+    list_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    date_created TEXT NOT NULL DEFAULT (date('now', 'localtime')),
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS list_items (
+    item_id INTEGER PRIMARY KEY,
+    list_id INTEGER NOT NULL REFERENCES lists ON DELETE CASCADE,
+    ingredient_id INTEGER NOT NULL REFERENCES ingredients ON DELETE CASCADE,
+    completed INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (list_id, ingredient_id)
+);
+CREATE INDEX IF NOT EXISTS list_items_by_ingredient ON list_items (ingredient_id);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id INTEGER PRIMARY KEY,
+    recipe_id INTEGER NOT NULL REFERENCES recipes ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    rating INTEGER NOT NULL CHECK (rating BETWEEN 0 AND 10),
+    review_text TEXT,
+    date_created TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS reviews_by_recipe ON reviews (recipe_id);
+CREATE INDEX IF NOT EXISTS reviews_by_user ON reviews (user_id);
+"""
+
+
+class Procedure:
+    """
+    A stored procedure written as one SQL statement with named parameters, given in the
+    order the procedure's arguments are passed. When must_change is set, a call that
+    changes no rows fails the way a missing foreign key does in MySQL
+    """
+
+    __slots__ = ("params", "sql", "must_change")
+
+    def __init__(self, params: list[str], sql: str, must_change: bool = False):
+        self.params = params
+        self.sql = sql
+        self.must_change = must_change
+
+    def run(self, cur: sqlite3.Cursor, args: list) -> sqlite3.Cursor:
+        cur.execute(self.sql, dict(zip(self.params, args)))
+        if self.must_change and cur.rowcount == 0:
+            from pymysql.err import IntegrityError
+
+            raise IntegrityError(NOT_FOUND_CODE, "No matching row")
+        return cur
+
+    def run_many(self, cur: sqlite3.Cursor, arg_rows: list[list]):
+        if self.must_change:
+            # executemany only counts the rows all of them changed together
+            for args in arg_rows:
+                self.run(cur, args)
+        else:
+            cur.executemany(
+                self.sql, [dict(zip(self.params, args)) for args in arg_rows]
+            )
+
+
+def hash_password(password: str, salt: bytes) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_ITERATIONS)
+
+
+class CreateUser(Procedure):
+    """
+    create_user, which hashes the password before storing it
+    """
+
+    def __init__(self):
+        super().__init__(
+            ["username", "password_hash", "salt"],
+            "INSERT INTO users (username, password_hash, salt) "
+            "VALUES (:username, :password_hash, :salt) RETURNING user_id",
+        )
+
+    def run(self, cur: sqlite3.Cursor, args: list) -> sqlite3.Cursor:
+        username, password = args
+        salt = os.urandom(16)
+        return super().run(cur, [username, hash_password(password, salt), salt])
+
+    def run_many(self, cur: sqlite3.Cursor, arg_rows: list[list]):
+        for args in arg_rows:
+            self.run(cur, args)
+
+
+# Every stored procedure the app calls, as the MySQL schema defines them
+PROCEDURES = {
+    "create_user": CreateUser(),
+    "get_all_recipes_for_user": Procedure(
+        ["user_id"],
+        """
+        SELECT r.recipe_id, r.name, r.instructions, r.cooking_time,
+            (SELECT group_concat(c.name, ',')
+             FROM recipe_categories rc JOIN categories c USING (category_id)
+             WHERE rc.recipe_id = r.recipe_id) AS category_names
+        FROM recipes r
+        WHERE r.user_id = :user_id
+        ORDER BY r.recipe_id
+        """,
+    ),
+    "create_recipe": Procedure(
+        ["name", "instructions", "cooking_time", "user_id"],
+        "INSERT INTO recipes (name, instructions, cooking_time, user_id) "
+        "VALUES (:name, :instructions, :cooking_time, :user_id) RETURNING recipe_id",
+    ),
+    "update_recipe": Procedure(
+        ["name", "instructions", "cooking_time", "recipe_id"],
+        "UPDATE recipes SET name = :name, instructions = :instructions, "
+        "cooking_time = :cooking_time WHERE recipe_id = :recipe_id",
+        must_change=True,
+    ),
+    "delete_recipe": Procedure(
+        ["recipe_id"], "DELETE FROM recipes WHERE recipe_id = :recipe_id"
+    ),
+    "get_ingredients_for_recipe": Procedure(
+        ["recipe_id"],
+        """
+        SELECT i.ingredient_id, i.name, ri.amount
+        FROM recipe_ingredients ri JOIN ingredients i USING (ingredient_id)
+        WHERE ri.recipe_id = :recipe_id
+        ORDER BY i.name
+        """,
+    ),
+    "get_recipe_ingredients_for_user": Procedure(
+        ["user_id"],
+        """
+        SELECT ri.recipe_id, i.ingredient_id, i.name, ri.amount
+        FROM recipes r
+            JOIN recipe_ingredients ri USING (recipe_id)
+            JOIN ingredients i USING (ingredient_id)
+        WHERE r.user_id = :user_id
+        ORDER BY ri.recipe_id, i.name
+        """,
+    ),
+    "add_ingredient_to_recipe": Procedure(
+        ["ingredient_id", "amount", "recipe_id"],
+        "INSERT INTO recipe_ingredients (ingredient_id, amount, recipe_id) "
+        "VALUES (:ingredient_id, :amount, :recipe_id)",
+    ),
+    "add_ingredients_to_recipe": Procedure(
+        ["rows"],
+        """
+        INSERT INTO recipe_ingredients (ingredient_id, amount, recipe_id)
+        SELECT value ->> 0, value ->> 1, value ->> 2 FROM json_each(:rows)
+        """,
+    ),
+    "update_recipe_ingredient": Procedure(
+        ["recipe_id", "old_ingredient_id", "ingredient_id", "amount"],
+        "UPDATE recipe_ingredients SET ingredient_id = :ingredient_id, amount = :amount "
+        "WHERE recipe_id = :recipe_id AND ingredient_id = :old_ingredient_id",
+        must_change=True,
+    ),
+    "remove_ingredient_from_recipe": Procedure(
+        ["recipe_id", "ingredient_id"],
+        "DELETE FROM recipe_ingredients "
+        "WHERE recipe_id = :recipe_id AND ingredient_id = :ingredient_id",
+    ),
+    "get_all_ingredients_for_user": Procedure(
+        ["user_id"],
+        "SELECT ingredient_id, name FROM ingredients WHERE user_id = :user_id "
+        "ORDER BY ingredient_id",
+    ),
+    "create_ingredient": Procedure(
+        ["name", "user_id"],
+        "INSERT INTO ingredients (name, user_id) VALUES (:name, :user_id) "
+        "RETURNING ingredient_id",
+    ),
+    "update_ingredient_name": Procedure(
+        ["ingredient_id", "name"],
+        "UPDATE ingredients SET name = :name WHERE ingredient_id = :ingredient_id",
+        must_change=True,
+    ),
+    "delete_ingredient": Procedure(
+        ["ingredient_id"],
+        "DELETE FROM ingredients WHERE ingredient_id = :ingredient_id",
+    ),
+    "get_all_categories_for_user": Procedure(
+        ["user_id"],
+        """
+        SELECT c.category_id, c.name, count(rc.recipe_id) AS recipe_num
+        FROM categories c LEFT JOIN recipe_categories rc USING (category_id)
+        WHERE c.user_id = :user_id
+        GROUP BY c.category_id
+        ORDER BY c.category_id
+        """,
+    ),
+    "get_categories_for_user": Procedure(
+        ["user_id"],
+        "SELECT category_id, name FROM categories WHERE user_id = :user_id "
+        "ORDER BY category_id",
+    ),
+    "get_categories_for_recipe": Procedure(
+        ["recipe_id"],
+        """
+        SELECT c.category_id, c.name
+        FROM recipe_categories rc JOIN categories c USING (category_id)
+        WHERE rc.recipe_id = :recipe_id
+        ORDER BY c.category_id
+        """,
+    ),
+    "get_recipe_categories_for_user": Procedure(
+        ["user_id"],
+        """
+        SELECT rc.recipe_id, c.category_id, c.name
+        FROM recipes r
+            JOIN recipe_categories rc USING (recipe_id)
+            JOIN categories c USING (category_id)
+        WHERE r.user_id = :user_id
+        ORDER BY rc.recipe_id, c.category_id
+        """,
+    ),
+    "create_category": Procedure(
+        ["name", "user_id"],
+        "INSERT INTO categories (name, user_id) VALUES (:name, :user_id) "
+        "RETURNING category_id",
+    ),
+    "update_category_name": Procedure(
+        ["category_id", "name"],
+        "UPDATE categories SET name = :name WHERE category_id = :category_id",
+        must_change=True,
+    ),
+    "delete_category": Procedure(
+        ["category_id"], "DELETE FROM categories WHERE category_id = :category_id"
+    ),
+    "add_recipe_to_category": Procedure(
+        ["recipe_id", "category_id"],
+        "INSERT INTO recipe_categories (recipe_id, category_id) "
+        "VALUES (:recipe_id, :category_id)",
+    ),
+    "add_recipe_to_categories": Procedure(
+        ["rows"],
+        """
+        INSERT INTO recipe_categories (recipe_id, category_id)
+        SELECT value ->> 0, value ->> 1 FROM json_each(:rows)
+        """,
+    ),
+    "remove_recipe_from_category": Procedure(
+        ["recipe_id", "category_id"],
+        "DELETE FROM recipe_categories "
+        "WHERE recipe_id = :recipe_id AND category_id = :category_id",
+    ),
+    "get_all_lists_for_user": Procedure(
+        ["user_id"],
+        "SELECT list_id, name, date_created FROM lists WHERE user_id = :user_id "
+        "ORDER BY list_id",
+    ),
+    "create_list": Procedure(
+        ["name", "user_id"],
+        "INSERT INTO lists (name, user_id) VALUES (:name, :user_id) RETURNING list_id",
+    ),
+    "update_list_name": Procedure(
+        ["list_id", "name"],
+        "UPDATE lists SET name = :name WHERE list_id = :list_id",
+        must_change=True,
+    ),
+    "delete_list": Procedure(["list_id"], "DELETE FROM lists WHERE list_id = :list_id"),
+    "get_ingredients_for_list": Procedure(
+        ["list_id"],
+        """
+        SELECT li.item_id, i.name, li.completed, li.ingredient_id
+        FROM list_items li JOIN ingredients i USING (ingredient_id)
+        WHERE li.list_id = :list_id
+        ORDER BY li.item_id
+        """,
+    ),
+    "get_list_items_for_user": Procedure(
+        ["user_id"],
+        """
+        SELECT li.list_id, li.item_id, i.name, li.completed, li.ingredient_id
+        FROM lists l
+            JOIN list_items li USING (list_id)
+            JOIN ingredients i USING (ingredient_id)
+        WHERE l.user_id = :user_id
+        ORDER BY li.list_id, li.item_id
+        """,
+    ),
+    "create_list_item": Procedure(
+        ["ingredient_id", "list_id"],
+        "INSERT INTO list_items (ingredient_id, list_id) "
+        "VALUES (:ingredient_id, :list_id)",
+    ),
+    "create_list_items": Procedure(
+        ["rows"],
+        """
+        INSERT INTO list_items (ingredient_id, list_id)
+        SELECT value ->> 0, value ->> 1 FROM json_each(:rows)
+        """,
+    ),
+    "toggle_item_status_in_list": Procedure(
+        ["item_id", "list_id", "completed"],
+        "UPDATE list_items SET completed = :completed "
+        "WHERE item_id = :item_id AND list_id = :list_id",
+        must_change=True,
+    ),
+    "remove_item_from_list": Procedure(
+        ["item_id", "list_id"],
+        "DELETE FROM list_items WHERE item_id = :item_id AND list_id = :list_id",
+        must_change=True,
+    ),
+    "get_all_reviews": Procedure(
+        [],
+        """
+        SELECT rv.review_id, r.name AS recipe_name, rv.rating, rv.user_id,
+            u.username AS creator_name, rv.review_text, rv.date_created
+        FROM reviews rv
+            JOIN recipes r USING (recipe_id)
+            JOIN users u ON u.user_id = rv.user_id
+        ORDER BY rv.review_id
+        """,
+    ),
+    "get_reviews_for_user": Procedure(
+        ["user_id"],
+        """
+        SELECT rv.review_id, r.name AS recipe_name, rv.rating, rv.user_id,
+            u.username AS creator_name, rv.review_text, rv.date_created
+        FROM reviews rv
+            JOIN recipes r USING (recipe_id)
+            JOIN users u ON u.user_id = rv.user_id
+        WHERE rv.user_id = :user_id
+        ORDER BY rv.review_id
+        """,
+    ),
+    "get_reviews_after": Procedure(
+        ["after_id", "max_rows"],
+        """
+        SELECT rv.review_id, r.name AS recipe_name, rv.rating, rv.user_id,
+            u.username AS creator_name, rv.review_text, rv.date_created
+        FROM reviews rv
+            JOIN recipes r USING (recipe_id)
+            JOIN users u ON u.user_id = rv.user_id
+        WHERE rv.review_id > :after_id
+        ORDER BY rv.review_id
+        LIMIT :max_rows
+        """,
+    ),
+    "get_review_ratings": Procedure(
+        ["after_id"],
+        """
+        SELECT rv.review_id, rv.recipe_id, r.name AS recipe_name, rv.rating,
+            rv.date_created
+        FROM reviews rv
+            JOIN recipes r USING (recipe_id)
+        WHERE rv.review_id > :after_id
+        ORDER BY rv.review_id
+        """,
+    ),
+    "create_review": Procedure(
+        ["recipe_id", "rating", "review_text", "user_id"],
+        "INSERT INTO reviews (recipe_id, rating, review_text, user_id) "
+        "VALUES (:recipe_id, :rating, :review_text, :user_id) RETURNING review_id",
+    ),
+    "update_review_rating": Procedure(
+        ["review_id", "rating"],
+        "UPDATE reviews SET rating = :rating WHERE review_id = :review_id",
+        must_change=True,
+    ),
+    "update_review_text": Procedure(
+        ["review_id", "review_text"],
+        "UPDATE reviews SET review_text = :review_text WHERE review_id = :review_id",
+        must_change=True,
+    ),
+    "delete_review": Procedure(
+        ["review_id"], "DELETE FROM reviews WHERE review_id = :review_id"
+    ),
+}
+
+
+@contextmanager
+def mysql_errors():
+    """
+    Raises SQLite errors as the pymysql errors (and MySQL error codes) the rest of the
+    app checks for
+    """
+    try:
+        yield
+    except sqlite3.Error as e:
+        raise _mysql_error(e) from e
+
+
+def _mysql_error(e: sqlite3.Error) -> Exception:
+    # pymysql is only needed once something has gone wrong
+    from pymysql import err
+
+    if isinstance(e, sqlite3.IntegrityError):
+        message = str(e)
+        if message.startswith(("UNIQUE", "PRIMARY KEY")):
+            code = DUPLICATE_CODE
+        elif message.startswith("FOREIGN KEY"):
+            code = NOT_FOUND_CODE
+        elif message.startswith("CHECK"):
+            code = CHECK_CODE
+        else:
+            code = 0
+        return err.IntegrityError(code, message)
+    if isinstance(e, sqlite3.OperationalError):
+        return err.OperationalError(0, str(e))
+    return err.DatabaseError(0, str(e))
+
+
+def _dict_rows(cur: sqlite3.Cursor) -> tuple[dict[str,], ...]:
+    columns = [col[0] for col in cur.description or ()]
+    return tuple(dict(zip(columns, row)) for row in cur.fetchall())
+
+
+def _procedure(proc_name: str) -> Procedure:
+    procedure = PROCEDURES.get(proc_name)
+    if procedure is None:
+        from pymysql.err import ProgrammingError
+
+        raise ProgrammingError(
+            MISSING_PROC_CODE, f"PROCEDURE {proc_name} does not exist"
+        )
+    return procedure
+
+
+class SQLiteTransaction:
+    """
+    Stored procedure calls made inside one SQLite transaction, the embedded counterpart
+    of pool.Transaction
+    """
+
+    def __init__(self, cur: sqlite3.Cursor):
+        self.cur = cur
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        with mysql_errors():
+            return _dict_rows(_procedure(proc_name).run(self.cur, args))
+
+    def callproc_many(self, proc_name: str, arg_rows: list[list]):
+        if not arg_rows:
+            return
+
+        with mysql_errors():
+            _procedure(proc_name).run_many(self.cur, arg_rows)
+
+
+class SQLiteDatabase:
+    """
+    Runs RecipeMaster on an SQLite file instead of a MySQL server, with every stored
+    procedure implemented in SQL against an equivalent schema. Offers the same methods
+    as ConnectionPool, so it can be used anywhere a pool is. Each thread gets its own
+    connection, and the database is in WAL mode so readers never wait on a writer.
+
+    An in-memory database (a path of ":memory:") exists only within the connection that
+    opened it, so every thread shares one connection instead, taking turns with it: a
+    call, stream or transaction holds it until it is done
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # taken around every use of the shared connection of an in-memory database
+        self._turn = threading.RLock() if path == ":memory:" else nullcontext()
+
+        with mysql_errors():
+            self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.path == ":memory:" and self._connections:
+            return self._connections[0]
+
+        cnx = getattr(self._local, "cnx", None)
+        if cnx is None:
+            # autocommit, transactions are begun explicitly
+            cnx = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False
+            )
+            cnx.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+            cnx.execute("PRAGMA foreign_keys = ON")
+            cnx.execute("PRAGMA journal_mode = WAL")
+            cnx.execute("PRAGMA synchronous = NORMAL")
+            cnx.create_function("get_user_id", 2, self._get_user_id)
+            self._local.cnx = cnx
+            with self._lock:
+                self._connections.append(cnx)
+        return cnx
+
+    def _get_user_id(self, username: str, password: str) -> int:
+        """
+        The get_user_id SQL function: the ID of the user with these credentials, or -1
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT user_id, password_hash, salt FROM users WHERE username = ?",
+                [username],
+            )
+            .fetchone()
+        )
+        if row is None:
+            return -1
+
+        user_id, password_hash, salt = row
+        if not hmac.compare_digest(hash_password(password, salt), password_hash):
+            return -1
+        return user_id
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        with self._turn, mysql_errors():
+            cur = _procedure(proc_name).run(self._connection().cursor(), args)
+            return _dict_rows(cur)
+
+    def callproc_tuples(
+        self, proc_name: str, args: list = []
+    ) -> tuple[dict[str, int], tuple[tuple, ...]]:
+        with self._turn, mysql_errors():
+            cur = _procedure(proc_name).run(self._connection().cursor(), args)
+            rows = tuple(cur.fetchall())
+            columns = {col[0]: i for i, col in enumerate(cur.description or ())}
+            return columns, rows
+
+    def execute(self, query: str, args: list = []) -> tuple[dict[str,], ...]:
+        # queries are written for MySQL, whose placeholders are %s
+        with self._turn, mysql_errors():
+            return _dict_rows(
+                self._connection().execute(query.replace("%s", "?"), args)
+            )
+
+    @contextmanager
+    def stream(self, proc_name: str, args: list = []):
+        """
+        Yields an iterator over a procedure's rows as dicts, read from the file as they
+        are iterated
+        """
+        with self._turn:
+            with mysql_errors():
+                cur = _procedure(proc_name).run(self._connection().cursor(), args)
+            columns = [col[0] for col in cur.description or ()]
+
+            def rows():
+                with mysql_errors():
+                    for row in cur:
+                        yield dict(zip(columns, row))
+
+            try:
+                yield rows()
+            finally:
+                cur.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields an SQLiteTransaction, committing when the with block finishes and rolling
+        back if it raises
+        """
+        with self._turn:
+            cnx = self._connection()
+            with mysql_errors():
+                cnx.execute("BEGIN IMMEDIATE")
+            try:
+                yield SQLiteTransaction(cnx.cursor())
+            except BaseException:
+                cnx.rollback()
+                raise
+            with mysql_errors():
+                cnx.commit()
+
+    def close(self):
+        with self._lock:
+            for cnx in self._connections:
+                cnx.close()
+            self._connections = []
+        self._local = threading.local()
@@ -0,0 +1,338 @@
+import csv
+import json
+import os
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Iterator
+
+from helpers import MISSING_PROC_CODE
+from importer import CSV_AMOUNT_SEP, CSV_LIST_SEP, escape
+
+# Formats a catalog can be exported to, each written as one file per kind of record
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+
+# Number of records buffered before a row group is written to a Parquet file
+PARQUET_ROW_GROUP_SIZE = 10_000
+
+# Columns of the records of each kind, in the order they are written
+RECIPE_FIELDS = [
+    "id",
+    "name",
+    "instructions",
+    "cooking_time",
+    "ingredients",
+    "categories",
+]
+LIST_FIELDS = ["id", "name", "date_created", "items"]
+REVIEW_FIELDS = ["id", "recipe_name", "rating", "review_text"]
+
+# Parquet types of the columns that are not stored as text
+PARQUET_TYPES = {"id": "int64", "cooking_time": "int64", "rating": "int64"}
+
+
+class GroupedStream:
+    """
+    The streamed rows of a procedure returning the rows of every one of a user's
+    recipes or lists ordered by their parent's ID, such as every recipe's ingredients.
+    They are handed out one parent at a time while the parents are streamed in the same
+    order, so only one parent's rows are held at once. A parent met out of order, or
+    every parent when the procedure is missing (rows is None), is read with
+    fallback_proc instead
+    """
+
+    def __init__(self, db, rows, group_column: str, fallback_proc: str):
+        self.db = db
+        self.rows = rows
+        self.group_column = group_column
+        self.fallback_proc = fallback_proc
+        self.next_row = None if rows is None else next(rows, None)
+        self.last_key = None
+
+    def rows_for(self, key) -> list[dict[str,]]:
+        """
+        Returns the rows of the parent with the given ID, skipping the rows of any
+        parent before it that was never asked for
+        """
+        if self.rows is None or (self.last_key is not None and key < self.last_key):
+            return list(self.db.callproc(self.fallback_proc, [key]))
+        self.last_key = key
+
+        group = []
+        while self.next_row is not None and self.next_row.get(self.group_column) <= key:
+            if self.next_row.get(self.group_column) == key:
+                group.append(self.next_row)
+            self.next_row = next(self.rows, None)
+        return group
+
+
+@contextmanager
+def grouped_stream(
+    db, proc_name: str, user_id: int, group_column: str, fallback_proc: str
+):
+    """
+    Streams a procedure returning the rows of every one of a user's recipes or lists,
+    yielding a GroupedStream of them. A database made from an older dump without the
+    procedure is read with fallback_proc, once for each parent
+    """
+    from pymysql import DatabaseError
+
+    with ExitStack() as stack:
+        try:
+            rows = stack.enter_context(db.stream(proc_name, [user_id]))
+        except DatabaseError as e:
+            if not e.args or e.args[0] != MISSING_PROC_CODE:
+                raise
+            rows = None
+        yield GroupedStream(db, rows, group_column, fallback_proc)
+
+
+def iter_recipes(db, user_id: int) -> Iterator[dict]:
+    """
+    Yields each of a user's recipes with its ingredients and categories. The recipes and
+    the ingredients of all of them are streamed side by side on two connections, both
+    in recipe ID order, so only one recipe is held at a time
+    """
+    with grouped_stream(
+        db,
+        "get_recipe_ingredients_for_user",
+        user_id,
+        "recipe_id",
+        "get_ingredients_for_recipe",
+    ) as ingredients, db.stream("get_all_recipes_for_user", [user_id]) as rows:
+        for row in rows:
+            names = row.get("category_names")
+
+            yield {
+                "type": "recipe",
+                "id": row.get("recipe_id"),
+                "name": row.get("name"),
+                "instructions": row.get("instructions"),
+                "cooking_time": row.get("cooking_time"),
+                "ingredients": [
+                    {"name": ing.get("name"), "amount": ing.get("amount")}
+                    for ing in ingredients.rows_for(row.get("recipe_id"))
+                ],
+                "categories": names.split(",") if names else [],
+            }
+
+
+def iter_lists(db, user_id: int) -> Iterator[dict]:
+    """
+    Yields each of a user's lists with its items, the items of every list being streamed
+    alongside the lists the same way as a recipe's ingredients
+    """
+    with grouped_stream(
+        db, "get_list_items_for_user", user_id, "list_id", "get_ingredients_for_list"
+    ) as items, db.stream("get_all_lists_for_user", [user_id]) as rows:
+        for row in rows:
+            yield {
+                "type": "list",
+                "id": row.get("list_id"),
+                "name": row.get("name"),
+                "date_created": row.get("date_created"),
+                "items": [
+                    {"name": item.get("name"), "completed": item.get("completed") == 1}
+                    for item in items.rows_for(row.get("list_id"))
+                ],
+            }
+
+
+def iter_reviews(db, user_id: int) -> Iterator[dict]:
+    """
+    Yields each review the user has written
+    """
+    for row in _user_reviews(db, user_id):
+        yield {
+            "type": "review",
+            "id": row.get("review_id"),
+            "recipe_name": row.get("recipe_name"),
+            "rating": row.get("rating"),
+            "review_text": row.get("review_text"),
+        }
+
+
+def _user_reviews(db, user_id: int) -> Iterator[dict]:
+    from pymysql import DatabaseError
+
+    try:
+        with db.stream("get_reviews_for_user", [user_id]) as rows:
+            yield from rows
+        return
+    except DatabaseError as e:
+        if not e.args or e.args[0] != MISSING_PROC_CODE:
+            raise
+
+    # a database made from an older dump can only give every user's reviews
+    with db.stream("get_all_reviews") as rows:
+        for row in rows:
+            if row.get("user_id") == user_id:
+                yield row
+
+
+class JsonlWriter:
+    """
+    Writes records as JSON Lines. Recipe files can be read back by the importer
+    """
+
+    def __init__(self, path: str, fields: list[str]):
+        self.f = open(path, "w", encoding="utf-8")
+
+    def write(self, record: dict):
+        self.f.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        self.f.close()
+
+
+class CsvWriter:
+    """
+    Writes records as CSV, joining nested lists into single columns the same way the
+    importer splits them
+    """
+
+    def __init__(self, path: str, fields: list[str]):
+        self.f = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.f, fields, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, record: dict):
+        self.writer.writerow({key: flatten(value) for key, value in record.items()})
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    """
+    Writes records to a Parquet file a row group at a time, for loading into analytics
+    tools. Needs the optional pyarrow package
+    """
+
+    def __init__(self, path: str, fields: list[str]):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(
+                "Exporting to Parquet needs pyarrow (pip install pyarrow)"
+            )
+
+        self.pa = pyarrow
+        self.fields = fields
+        self.path = path
+        self.writer = None
+        self.buffer = []
+
+    def write(self, record: dict):
+        row = {key: flatten(record.get(key)) for key in self.fields}
+        for key in self.fields:
+            if key not in PARQUET_TYPES and row[key] is not None:
+                row[key] = str(row[key])
+        self.buffer.append(row)
+        if len(self.buffer) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self.writer is None:
+            # nothing was written, still leave a valid file with every column
+            schema = self.pa.schema(
+                [(field, self._type(field)) for field in self.fields]
+            )
+            self.writer = self.pa.parquet.ParquetWriter(self.path, schema)
+        self.writer.close()
+
+    def _type(self, field: str):
+        return getattr(self.pa, PARQUET_TYPES.get(field, "string"))()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+
+        # the types are fixed up front so every row group agrees on the schema
+        table = self.pa.table(
+            {
+                field: self.pa.array(
+                    [row[field] for row in self.buffer], self._type(field)
+                )
+                for field in self.fields
+            }
+        )
+
+        if self.writer is None:
+            self.writer = self.pa.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def flatten(value) -> str:
+    """
+    Joins the nested lists in a record into one string the importer can split again,
+    escaping the separators inside names and amounts, and leaves other values alone
+    """
+    if not isinstance(value, list):
+        return value
+
+    parts = []
+    for item in value:
+        if isinstance(item, dict):
+            name, detail = list(item.values())[:2]
+            parts.append(f"{escape(str(name))}{CSV_AMOUNT_SEP}{escape(str(detail))}")
+        else:
+            parts.append(escape(str(item)))
+    return CSV_LIST_SEP.join(parts)
+
+
+class ExportReport:
+    """
+    Counts the records an export has written and how quickly
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.started = time.perf_counter()
+
+    @property
+    def rows(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        rate = self.rows / self.elapsed if self.elapsed else 0.0
+        counts = ", ".join(f"{n} {kind}" for kind, n in self.counts.items())
+        return f"Exported {counts} in {self.elapsed:.1f}s ({rate:.0f} rows/s)"
+
+
+def export_catalog(db, user_id: int, directory: str, fmt: str, progress=print):
+    """
+    Exports a user's recipes, lists and reviews into recipes, lists and reviews files
+    of the given format in directory. Records are written as they are read, so only
+    the ingredients of the recipes and the items of the lists are held in memory as a
+    whole. Calls progress with a line of text after each file
+    """
+    os.makedirs(directory, exist_ok=True)
+    report = ExportReport()
+
+    for kind, fields, records in (
+        ("recipes", RECIPE_FIELDS, iter_recipes(db, user_id)),
+        ("lists", LIST_FIELDS, iter_lists(db, user_id)),
+        ("reviews", REVIEW_FIELDS, iter_reviews(db, user_id)),
+    ):
+        writer = WRITERS[fmt](os.path.join(directory, f"{kind}.{fmt}"), fields)
+        report.counts[kind] = 0
+        try:
+            for record in records:
+                writer.write(record)
+                report.counts[kind] += 1
+        finally:
+            writer.close()
+
+        progress(str(report))
+
+    return report
@@ -1,11 +1,22 @@
 import os
 import sys
-from pymysql import cursors, DatabaseError
-from prettytable import PrettyTable
+from functools import lru_cache
+from itertools import chain, islice
+from typing import Container
+from cache import CachedDatabase
+
+# pymysql and prettytable are slow to import, so they are imported where they are
+# used, the first time that happens
 
 # Error codes from MySQL, used for error checking/custom error messages
 DUPLICATE_CODE = 1062
 NOT_FOUND_CODE = 1452
+MISSING_PROC_CODE = 1305
+
+# Number of rows print_table shows at a time before asking whether to show more
+TABLE_PAGE_SIZE = 50
+# Number of rows print_table looks at to decide its column widths when paging
+WIDTH_SAMPLE_SIZE = 200
 
 
 def clear_screen():
@@ -53,9 +64,10 @@ def get_num_input(min: int, max: int, prompt: str) -> int:
     return choice
 
 
-def num_input_list_neg_one(valid_nums: list[int], prompt: str) -> int:
+def num_input_list_neg_one(valid_nums: Container[int], prompt: str) -> int:
     """
-    Returns a number entered by the user validated from the provided list or -1
+    Returns a number entered by the user validated from the provided collection or -1.
+    Pass a set or a dict keyed by ID so each check takes constant time
     """
 
     while True:
@@ -83,57 +95,210 @@ def print_menu(prompt: str, statements: list[str]):
 
 
 def call_proc(
-    cur: cursors.DictCursor, proc_name: str, args: list = []
+    db: CachedDatabase, proc_name: str, args: list = []
 ) -> tuple[dict[str,], ...]:
     """
-    Calls and returns the results of a stored procedure in the database based on the name and arguments provided
+    Calls and returns the results of a stored procedure in the database based on the name and arguments provided.
+    Reads may be served from the database's result cache, writes invalidate it
     """
 
-    cur.callproc(proc_name, args)
-    return cur.fetchall()
+    return db.callproc(proc_name, args)
 
 
-def print_table(fields: list[str], data: list):
+def call_proc_tuples(
+    db: CachedDatabase, proc_name: str, args: list = []
+) -> tuple[dict[str, int], tuple[tuple, ...]]:
     """
-    Prints a PrettyTable based on the list of field names and data provided
+    Calls a stored procedure like call_proc but returns its rows as plain tuples along
+    with a map of each column name to its position, for building models with from_rows
     """
-    p = PrettyTable()
-    p.field_names = fields
-    p.add_rows(data)
-    print(p)
+
+    return db.callproc_tuples(proc_name, args)
 
 
-def print_recipe_table(cur: cursors.DictCursor, user_id: int) -> list[int]:
+class GroupedRows(dict):
     """
-    Prints a table of all a user's recipes
+    The rows of a procedure grouped by the ID of the row they belong to, such as each
+    recipe's ingredients. An ID with no rows has an empty list, unless fetch is given,
+    in which case its rows are read with fetch the first time it is looked up
     """
+
+    def __init__(self, fetch=None):
+        super().__init__()
+        self.fetch = fetch
+
+    def __missing__(self, key) -> list[dict[str,]]:
+        if self.fetch is None:
+            return []
+        rows = self[key] = list(self.fetch(key))
+        return rows
+
+
+def call_proc_grouped(
+    db: CachedDatabase,
+    proc_name: str,
+    args: list,
+    group_column: str,
+    fallback_proc: str,
+) -> GroupedRows:
+    """
+    Calls a procedure returning the rows of many parents at once, such as the
+    ingredients of every recipe of a user, and groups them by group_column. A database
+    made from an older dump without the procedure is read with fallback_proc, once for
+    each ID as it is looked up
+    """
+    from pymysql import DatabaseError
+
     try:
-        recipes = call_proc(cur, "get_all_recipes_for_user", [user_id])
+        rows = db.callproc(proc_name, args)
+    except DatabaseError as e:
+        if not e.args or e.args[0] != MISSING_PROC_CODE:
+            raise
+        return GroupedRows(lambda key: db.callproc(fallback_proc, [key]))
+
+    grouped = GroupedRows()
+    for row in rows:
+        grouped.setdefault(row.get(group_column), []).append(row)
+    return grouped
+
+
+class Model:
+    """
+    Base class for the domain objects built from stored procedure results. Subclasses
+    declare their attributes in __slots__ and map each one to the column it is read
+    from in COLUMNS
+    """
+
+    __slots__ = ()
+
+    # attribute name -> result column name
+    COLUMNS: dict[str, str] = {}
+
+    def __init__(self, row: dict[str,]):
+        for attr, column in self.COLUMNS.items():
+            setattr(self, attr, row.get(column))
+
+    @classmethod
+    def from_rows(cls, columns: dict[str, int], rows) -> list:
+        """
+        Builds one object per tuple row, given the position of each column in the rows.
+        Columns missing from the result are left as None
+        """
+        positions = tuple(columns.get(column) for column in cls.COLUMNS.values())
+        return list(map(_row_builder(cls, positions), rows))
+
+
+@lru_cache(maxsize=None)
+def _row_builder(cls: type, positions: tuple[int | None, ...]):
+    """
+    Returns a function building a cls from a tuple row whose columns are at the given
+    positions. It assigns each attribute straight from its position in the row, written
+    out as one statement per attribute the way a hand-written constructor would, which
+    is what makes building from tuples cheaper than building from dicts
+    """
+    lines = ["def build(row):", "    model = new(cls)"]
+    for attr, pos in zip(cls.COLUMNS, positions):
+        lines.append(f"    model.{attr} = {'None' if pos is None else f'row[{pos}]'}")
+    lines.append("    return model")
+
+    namespace = {"new": cls.__new__, "cls": cls}
+    exec("\n".join(lines), namespace)
+    return namespace["build"]
+
+
+def print_table(fields: list[str], data, page_size: int = TABLE_PAGE_SIZE):
+    """
+    Prints a PrettyTable based on the list of field names and data provided. Data can be
+    any iterable of rows; if there are more rows than fit on one page, they are printed a
+    page at a time so only the visible page is ever formatted or held in memory
+    """
+    from prettytable import PrettyTable
+
+    rows = iter(data)
+    first_page = list(islice(rows, page_size))
+    following = next(rows, None)
+
+    if following is None:
+        # everything fits on a single page
+        p = PrettyTable()
+        p.field_names = fields
+        p.add_rows(first_page)
+        print(p)
+        return
+
+    # fix the column widths from a bounded sample so every page lines up
+    sample = list(islice(rows, max(0, WIDTH_SAMPLE_SIZE - page_size - 1)))
+    widths = [len(str(field)) for field in fields]
+    for row in chain(first_page, [following], sample):
+        for i, cell in enumerate(row):
+            widths[i] = max(widths[i], len(str(cell)))
+
+    rows = chain([following], sample, rows)
+    page = first_page
+    page_num = 1
+    # only stop between pages to ask when there is someone there to answer
+    interactive = sys.stdin.isatty()
+
+    while page:
+        p = PrettyTable()
+        p.field_names = fields
+        for field, width in zip(fields, widths):
+            p.min_width[field] = width
+            p.max_width[field] = width
+        p.add_rows(page)
+        print(p)
+
+        page = list(islice(rows, page_size))
+        if not page:
+            break
+
+        if interactive:
+            try:
+                more = input(f"Page {page_num}, press Enter for more or q to stop: ")
+            except KeyboardInterrupt:
+                print("\nQuitting...")
+                sys.exit()
+            if more == "q" or more == "Q":
+                break
+
+        page_num += 1
+
+
+def print_recipe_table(db: CachedDatabase, user_id: int) -> set[int]:
+    """
+    Prints a table of all a user's recipes and returns their IDs
+    """
+    from pymysql import DatabaseError
+
+    try:
+        recipes = call_proc(db, "get_all_recipes_for_user", [user_id])
     except DatabaseError as e:
         print(e)
         print("Error retrieving user's recipes")
-        return
+        return set()
 
-    recipe_table_data = [(row.get("recipe_id"), row.get("name")) for row in recipes]
+    recipe_table_data = ((row.get("recipe_id"), row.get("name")) for row in recipes)
 
     print_table(["ID", "Name"], recipe_table_data)
 
-    return [row.get("recipe_id") for row in recipes]
+    return {row.get("recipe_id") for row in recipes}
 
 
-def print_ingredient_table(cur: cursors.DictCursor, user_id: int) -> list[int]:
+def print_ingredient_table(db: CachedDatabase, user_id: int) -> set[int]:
     """
-    Prints a table of all a user's ingredients
+    Prints a table of all a user's ingredients and returns their IDs
     """
+    from pymysql import DatabaseError
+
     try:
-        ingredients = call_proc(cur, "get_all_ingredients_for_user", [user_id])
+        ingredients = call_proc(db, "get_all_ingredients_for_user", [user_id])
     except DatabaseError as e:
         print(e)
         print("Error retrieving user's ingredients")
-        return
+        return set()
 
-    ing_table_data = [row.values() for row in ingredients]
+    ing_table_data = (row.values() for row in ingredients)
 
     print_table(["ID", "Name"], ing_table_data)
 
-    return [row.get("ingredient_id") for row in ingredients]
+    return {row.get("ingredient_id") for row in ingredients}
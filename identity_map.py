@@ -0,0 +1,72 @@
+from collections import defaultdict
+from typing import Iterable
+
+from helpers import Model
+
+
+class IdentityMap:
+    """
+    Holds every model loaded during a session, keyed by model class and ID, so each
+    database row is represented by a single object that every screen shares and any
+    object can be looked up by its ID in constant time
+    """
+
+    def __init__(self):
+        # model class -> {ID -> model}
+        self._models = defaultdict(dict)
+
+    def load(self, cls: type, columns: dict[str, int], rows) -> dict[int, Model]:
+        """
+        Builds models from tuple rows (as returned by call_proc_tuples) and registers
+        them. Returns the models keyed by ID, in the order of the rows
+        """
+        return self.register(cls.from_rows(columns, rows))
+
+    def register(self, models: Iterable[Model]) -> dict[int, Model]:
+        """
+        Adds models to the map. A model whose ID is already known updates the existing
+        object in place instead of replacing it, and that existing object is what gets
+        returned. Returns the models keyed by ID, in the order they were given
+        """
+        registered = {}
+
+        for model in models:
+            known = self._models[type(model)]
+            existing = known.get(model.id)
+
+            if existing is None:
+                known[model.id] = model
+            else:
+                for attr in model.__slots__:
+                    setattr(existing, attr, getattr(model, attr))
+                model = existing
+
+            registered[model.id] = model
+
+        return registered
+
+    def get(self, cls: type, id: int) -> Model | None:
+        """
+        Returns the model of the given class with the given ID if it has been loaded
+        """
+        return self._models[cls].get(id)
+
+    def update(self, cls: type, id: int, **changes):
+        """
+        Applies changes made in the database to a loaded model, if there is one
+        """
+        model = self._models[cls].get(id)
+        if model is None:
+            return
+
+        for attr, value in changes.items():
+            setattr(model, attr, value)
+
+    def remove(self, cls: type, id: int):
+        """
+        Forgets a model that was deleted from the database
+        """
+        self._models[cls].pop(id, None)
+
+    def clear(self):
+        self._models.clear()
@@ -0,0 +1,322 @@
+import csv
+import json
+import re
+import time
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from helpers import DUPLICATE_CODE
+from recipe_writes import write_full_recipe
+
+if TYPE_CHECKING:
+    from pool import Transaction
+
+# Number of recipes written together in one transaction by default
+IMPORT_CHUNK_SIZE = 500
+
+# Separators used inside the ingredients and categories columns of a CSV file, for
+# example "flour:2 cups;salt:1 tsp" and "Baking;Breakfast". A separator (or backslash)
+# that is part of a name or amount is escaped with a backslash, as in "ratio 1\:2"
+CSV_LIST_SEP = ";"
+CSV_AMOUNT_SEP = ":"
+CSV_ESCAPE = "\\"
+
+
+class RecipeImportError(ValueError):
+    """
+    Raised when a record in an import file is not a valid recipe
+    """
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Yields one record per non-blank line of a JSON Lines file. Each record looks like
+    {"name": ..., "instructions": ..., "cooking_time": ...,
+     "ingredients": [{"name": ..., "amount": ...}, ...], "categories": [...]}
+    """
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise RecipeImportError(f"Line {line_num}: {e}")
+        if not isinstance(record, dict):
+            raise RecipeImportError(f"Line {line_num}: a record must be a JSON object")
+        record["line"] = line_num
+        yield record
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Yields one record per row of a CSV file with a header row naming the columns
+    name, instructions, cooking_time, ingredients and categories
+    """
+    for line_num, row in enumerate(csv.DictReader(lines), start=2):
+        ingredients = []
+        for pair in split_escaped(row.get("ingredients") or "", CSV_LIST_SEP):
+            if not pair:
+                continue
+            name, *amount = split_escaped(pair, CSV_AMOUNT_SEP)
+            ingredients.append(
+                {
+                    "name": unescape(name),
+                    "amount": unescape(CSV_AMOUNT_SEP.join(amount)),
+                }
+            )
+
+        yield {
+            "name": row.get("name"),
+            "instructions": row.get("instructions"),
+            "cooking_time": row.get("cooking_time"),
+            "ingredients": ingredients,
+            "categories": [
+                unescape(name)
+                for name in split_escaped(row.get("categories") or "", CSV_LIST_SEP)
+            ],
+            "line": line_num,
+        }
+
+
+def escape(text: str) -> str:
+    """
+    Escapes the separators in a name or amount written to a CSV list column
+    """
+    for char in (CSV_ESCAPE, CSV_LIST_SEP, CSV_AMOUNT_SEP):
+        text = text.replace(char, CSV_ESCAPE + char)
+    return text
+
+
+def unescape(text: str) -> str:
+    return re.sub(rf"{re.escape(CSV_ESCAPE)}(.)", r"\1", text, flags=re.S)
+
+
+def split_escaped(text: str, sep: str) -> list[str]:
+    """
+    Splits text on every sep that is not escaped, leaving the escapes in each part
+    """
+    parts = []
+    start = i = 0
+    while i < len(text):
+        if text[i] == CSV_ESCAPE:
+            i += 2
+            continue
+        if text[i] == sep:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def clean_records(records: Iterable[dict]) -> Iterator[dict]:
+    """
+    Validates records and normalizes their fields, stripping names and dropping empty
+    or repeated ingredients and categories. Names are compared ignoring case, the way
+    MySQL compares them, keeping the first spelling. Records of other kinds (such as
+    the lists and reviews in an export) are skipped
+    """
+    for record in records:
+        if not isinstance(record, dict):
+            raise RecipeImportError(f"A record must be an object, got {record!r}")
+        if record.get("type", "recipe") != "recipe":
+            continue
+
+        line = record.get("line")
+        name = _text(record.get("name"), line, "a recipe's name")
+        if not name:
+            raise RecipeImportError(f"Line {line}: a recipe needs a name")
+
+        try:
+            cooking_time = int(record.get("cooking_time") or 0)
+        except (TypeError, ValueError):
+            raise RecipeImportError(f"Line {line}: cooking_time must be a whole number")
+
+        ingredients = {}
+        for ing in _items(record.get("ingredients"), line, "ingredients"):
+            if not isinstance(ing, dict):
+                raise RecipeImportError(
+                    f"Line {line}: an ingredient must be an object with a name and "
+                    f"amount, got {ing!r}"
+                )
+            ing_name = _text(ing.get("name"), line, "an ingredient's name")
+            if ing_name:
+                ingredients.setdefault(
+                    ing_name.casefold(),
+                    (ing_name, str(ing.get("amount") or "").strip()),
+                )
+
+        categories = {}
+        for cat in _items(record.get("categories"), line, "categories"):
+            cat_name = _text(cat, line, "a category")
+            if cat_name:
+                categories.setdefault(cat_name.casefold(), cat_name)
+
+        yield {
+            "name": name,
+            "instructions": record.get("instructions") or "",
+            "cooking_time": cooking_time,
+            "ingredients": dict(ingredients.values()),
+            "categories": list(categories.values()),
+            "line": line,
+        }
+
+
+def _items(value, line: int, field: str) -> list:
+    if not value:
+        return []
+    if not isinstance(value, list):
+        raise RecipeImportError(f"Line {line}: {field} must be a list")
+    return value
+
+
+def _text(value, line: int, field: str) -> str:
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise RecipeImportError(f"Line {line}: {field} must be text, got {value!r}")
+    return value.strip()
+
+
+def _database_error() -> type[Exception]:
+    # only evaluated once something was raised, so pymysql is not imported to import
+    # into SQLite
+    from pymysql import DatabaseError
+
+    return DatabaseError
+
+
+class NameLookup:
+    """
+    Maps a user's ingredient or category names to their IDs, creating the ones that do
+    not exist yet. Names are resolved a whole chunk at a time so each chunk needs at
+    most one batch of creates and one refresh, however many names it uses. Names are
+    matched by their casefolded form, since MySQL's collation ignores case and would
+    reject "Flour" as a duplicate of "flour"
+    """
+
+    def __init__(self, user_id: int, list_proc: str, create_proc: str, id_column: str):
+        self.user_id = user_id
+        self.list_proc = list_proc
+        self.create_proc = create_proc
+        self.id_column = id_column
+        self.ids = None
+        self.created = 0
+
+    def resolve(self, tx: "Transaction", names: Iterable[str]) -> dict[str, int]:
+        """
+        Makes sure every name exists, returning the map of casefolded name to ID
+        """
+        if self.ids is None:
+            self._refresh(tx)
+
+        missing = {}
+        for name in names:
+            key = name.casefold()
+            if key not in self.ids:
+                missing.setdefault(key, name)
+        missing = list(missing.values())
+        if missing:
+            tx.callproc_many(
+                self.create_proc, [[name, self.user_id] for name in missing]
+            )
+            self.created += len(missing)
+            # the batch discards what each create returns, so read the new IDs back
+            self._refresh(tx)
+
+        return self.ids
+
+    def _refresh(self, tx: "Transaction"):
+        self.ids = {
+            row.get("name").casefold(): row.get(self.id_column)
+            for row in tx.callproc(self.list_proc, [self.user_id])
+        }
+
+
+class ImportReport:
+    """
+    Counts what an import has done so far and how quickly
+    """
+
+    def __init__(self):
+        self.recipes = 0
+        self.chunks = 0
+        self.created_ingredients = 0
+        self.created_categories = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.recipes / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"Imported {self.recipes} recipes in {self.chunks} transaction(s) "
+            f"in {self.elapsed:.1f}s ({self.rate:.0f} recipes/s)"
+        )
+
+
+def import_recipes(
+    db,
+    user_id: int,
+    records: Iterable[dict],
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    progress=print,
+) -> ImportReport:
+    """
+    Writes cleaned recipe records for a user, chunk_size recipes per transaction.
+    Only one chunk of records is held in memory at a time. Ingredients and categories
+    are matched by name and created when missing. Calls progress with a line of text
+    after every chunk
+    """
+    ingredients = NameLookup(
+        user_id, "get_all_ingredients_for_user", "create_ingredient", "ingredient_id"
+    )
+    categories = NameLookup(
+        user_id, "get_all_categories_for_user", "create_category", "category_id"
+    )
+    report = ImportReport()
+    records = iter(records)
+
+    while chunk := list(islice(records, chunk_size)):
+        with db.transaction() as tx:
+            ing_ids = ingredients.resolve(
+                tx, (name for record in chunk for name in record["ingredients"])
+            )
+            cat_ids = categories.resolve(
+                tx, (name for record in chunk for name in record["categories"])
+            )
+
+            for record in chunk:
+                try:
+                    write_full_recipe(
+                        tx,
+                        user_id,
+                        record["name"],
+                        record["instructions"],
+                        record["cooking_time"],
+                        {
+                            ing_ids[name.casefold()]: amount
+                            for name, amount in record["ingredients"].items()
+                        },
+                        [cat_ids[name.casefold()] for name in record["categories"]],
+                    )
+                except _database_error() as e:
+                    if not e.args or e.args[0] != DUPLICATE_CODE:
+                        raise
+                    raise RecipeImportError(
+                        f"Line {record.get('line')}: a recipe named "
+                        f"{record['name']!r} already exists"
+                    ) from e
+
+        report.recipes += len(chunk)
+        report.chunks += 1
+        report.created_ingredients = ingredients.created
+        report.created_categories = categories.created
+        progress(str(report))
+
+    return report
@@ -1,16 +1,22 @@
+from functools import partial
 from helpers import *
 from source import State, main_menu
 from pymysql import DatabaseError
+from pantry import forget_pantry_ingredient, synced_pantry
+from recipe import Recipe, recipe_action
 
+# Largest number of missing ingredients that can be asked for when looking for recipes
+MAX_MISSING_INGREDIENTS = 20
 
-class Ingredient:
+
+class Ingredient(Model):
     """
     Represents an Ingredient and the data that represents it
     """
 
-    def __init__(self, i_dict: dict[str,]):
-        self.id = i_dict.get("ingredient_id")
-        self.name = i_dict.get("name")
+    __slots__ = ("id", "name")
+
+    COLUMNS = {"id": "ingredient_id", "name": "name"}
 
     def print_self(self):
         print(f"Name: {self.name}")
@@ -21,45 +27,46 @@ def ingredient_module(state: State):
 
     state.print_message_reset()
 
-    cur = state.cur
+    db = state.db
     print_menu(
-        "Choose an action", ["View all ingredients", "Create new ingredient", "Go back"]
+        "Choose an action",
+        [
+            "View all ingredients",
+            "Create new ingredient",
+            "What can I cook?",
+            "Go back",
+        ],
     )
-    choice = get_num_input(1, 3, "Go to")
+    choice = get_num_input(1, 4, "Go to")
 
     match choice:
         case 1:
             # View all ingredients
             try:
-                ingredients = call_proc(
-                    cur, "get_all_ingredients_for_user", [state.user_id]
+                ingredients = state.identities.load(
+                    Ingredient,
+                    *call_proc_tuples(
+                        db, "get_all_ingredients_for_user", [state.user_id]
+                    ),
                 )
             except DatabaseError as e:
                 print(e)
                 print("Error occurred when trying to fetch all of user's ingredients")
+                ingredients = {}
 
-            ing_table_data = [row.values() for row in ingredients]
-
-            ingredient_ids = [row.get("ingredient_id") for row in ingredients]
+            ing_table_data = ((i.id, i.name) for i in ingredients.values())
 
             print_table(["ID", "Name"], ing_table_data)
 
             choice = num_input_list_neg_one(
-                ingredient_ids, "Choose an ingredient ID or go back with -1"
+                ingredients, "Choose an ingredient ID or go back with -1"
             )
 
             match choice:
                 case -1:
-                    ingredient_module(state)
-                    return
+                    return ingredient_module
                 case _:
-                    ingredient = [
-                        row for row in ingredients if row.get("ingredient_id") == choice
-                    ]
-
-                    i_obj = Ingredient(ingredient[0])
-
-                    ingredient_action(i_obj, state)
+                    return partial(ingredient_action, ingredients[choice])
 
         case 2:
             # Create a new ingredient
@@ -69,7 +76,17 @@ def ingredient_module(state: State):
                     print("Must enter a valid name")
                     continue
                 try:
-                    new_ing = call_proc(cur, "create_ingredient", [name, state.user_id])
+                    new_ing = call_proc(db, "create_ingredient", [name, state.user_id])
+                    state.identities.register(
+                        [
+                            Ingredient(
+                                {
+                                    "ingredient_id": new_ing[0].get("ingredient_id"),
+                                    "name": name,
+                                }
+                            )
+                        ]
+                    )
                 except DatabaseError as e:
                     if e.args[0] == DUPLICATE_CODE:
                         print("This ingredient already exists, try again")
@@ -81,10 +98,83 @@ def ingredient_module(state: State):
             state.update_message(
                 f"New ingredient with ID {new_ing[0].get('ingredient_id')} created!"
             )
-            ingredient_module(state)
+            return ingredient_module
         case 3:
+            # Find the recipes that can be made from the ingredients on hand
+            return what_can_i_cook
+        case 4:
             # Return to main menu
-            main_menu(state)
+            return main_menu
+
+
+def what_can_i_cook(state: State):
+    """
+    Menu to find the recipes that can be made with the ingredients the user has, or
+    with only a few of their ingredients missing
+    """
+    db = state.db
+
+    try:
+        ingredients = state.identities.load(
+            Ingredient,
+            *call_proc_tuples(db, "get_all_ingredients_for_user", [state.user_id]),
+        )
+        recipes = state.identities.load(
+            Recipe,
+            *call_proc_tuples(db, "get_all_recipes_for_user", [state.user_id]),
+        )
+        pantry = synced_pantry(state, db, recipes)
+    except DatabaseError as e:
+        print(e)
+        state.update_message("Error occurred when trying to fetch user's recipes")
+        return ingredient_module
+
+    print_table(["ID", "Name"], ((i.id, i.name) for i in ingredients.values()))
+
+    have = set()
+    while True:
+        choice = num_input_list_neg_one(
+            ingredients, "Enter an ingredient ID you have or -1 when done"
+        )
+        if choice == -1:
+            break
+        have.add(choice)
+
+    max_missing = get_num_input(
+        0, MAX_MISSING_INGREDIENTS, "Most ingredients a recipe may be missing"
+    )
+
+    matches = [
+        match for match in pantry.cookable(have, max_missing) if match[0] in recipes
+    ]
+    if not matches:
+        state.update_message("No recipes can be made with those ingredients")
+        return ingredient_module
+
+    def missing_names(mask: int) -> str:
+        return ", ".join(
+            ingredients[ing_id].name if ing_id in ingredients else str(ing_id)
+            for ing_id in pantry.ingredients(mask)
+        )
+
+    print_table(
+        ["ID", "Name", "Missing", "Missing ingredients"],
+        (
+            (recipe_id, recipes[recipe_id].name, count, missing_names(missing))
+            for recipe_id, count, missing in matches
+        ),
+    )
+
+    match_ids = {match[0] for match in matches}
+    state.prefetcher.recipes(match_ids)
+
+    choice = num_input_list_neg_one(match_ids, "Open a recipe ID or go back with -1")
+
+    match choice:
+        case -1:
+            return ingredient_module
+        case _:
+            return partial(recipe_action, recipes[choice])
 
 
 def ingredient_action(ingredient: Ingredient, state: State):
@@ -105,9 +195,8 @@ def ingredient_action(ingredient: Ingredient, state: State):
             # Edit this ingredient's name
             new_name = input(f"Enter a new name for {ingredient.name}: ")
             try:
-                call_proc(
-                    state.cur, "update_ingredient_name", [ingredient.id, new_name]
-                )
+                call_proc(state.db, "update_ingredient_name", [ingredient.id, new_name])
+                state.identities.update(Ingredient, ingredient.id, name=new_name)
             except DatabaseError as e:
                 print(e)
                 print("Error updating this ingredient's name")
@@ -116,7 +205,7 @@ def ingredient_action(ingredient: Ingredient, state: State):
                 f"Changed ingredient '{ingredient.name}' to '{new_name}'"
             )
 
-            ingredient_module(state)
+            return ingredient_module
 
         case 2:
             # Delete this ingredient
@@ -125,14 +214,16 @@ def ingredient_action(ingredient: Ingredient, state: State):
             )
             if confirm == "Y" or confirm == "y":
                 try:
-                    call_proc(state.cur, "delete_ingredient", [ingredient.id])
+                    call_proc(state.db, "delete_ingredient", [ingredient.id])
+                    state.identities.remove(Ingredient, ingredient.id)
+                    forget_pantry_ingredient(state, ingredient.id)
                 except DatabaseError as e:
                     print(e)
                     print("Error occurred when trying to delete this ingredient")
                 finally:
                     state.update_message(f"Deleted ingredient '{ingredient.name}'")
 
-            ingredient_module(state)
+            return ingredient_module
         case 3:
             # Return to ingredient menu
-            ingredient_module(state)
+            return ingredient_module
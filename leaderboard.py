@@ -0,0 +1,101 @@
+import heapq
+from operator import itemgetter
+
+# How many reviews' worth of the average rating every recipe starts with, so a recipe
+# with a single 10/10 review does not outrank one with hundreds of 9/10 reviews
+BAYES_PRIOR_WEIGHT = 5
+
+# Seconds after which a review counts half as much towards a recipe trending
+TRENDING_HALF_LIFE = 3.5 * 24 * 60 * 60
+
+# Number of recipes shown on a leaderboard by default
+LEADERBOARD_SIZE = 10
+
+
+def bayesian_average(total: int, count: int, prior_mean: float) -> float:
+    """
+    Returns the mean rating pulled towards prior_mean, less so the more ratings there are
+    """
+    return (BAYES_PRIOR_WEIGHT * prior_mean + total) / (BAYES_PRIOR_WEIGHT + count)
+
+
+def decay_weight(timestamp: float, epoch: float) -> float:
+    """
+    Returns how much something that happened at timestamp counts, relative to
+    something that happened at epoch. Weights measured against the same epoch can be
+    added up and compared directly, since moving the epoch scales them all alike
+    """
+    return 2 ** ((timestamp - epoch) / TRENDING_HALF_LIFE)
+
+
+class Leaderboard:
+    """
+    Keys with a score each, of which only the best few are ever asked for. The best
+    keys are kept in a min-heap of at most size entries as scores change: a key that
+    beats the worst of them replaces it, and any other key outside of them costs
+    nothing beyond storing its score. Only when one of the best keys falls or goes
+    away can a key outside of them have overtaken it, and then the next top() rescans
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE):
+        self.size = size
+        # key -> score
+        self.scores = {}
+        # key -> score of the best keys, or None when they have to be picked again
+        self._best = {}
+        # (score, key) of the keys in _best, worst first
+        self._heap = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _outside_keys(self) -> bool:
+        return len(self.scores) > len(self._best)
+
+    def _reheap(self):
+        self._heap = [(score, key) for key, score in self._best.items()]
+        heapq.heapify(self._heap)
+
+    def set(self, key, score: float):
+        old = self.scores.get(key)
+        self.scores[key] = score
+        if self._best is None:
+            return
+        if key in self._best:
+            if score < old and self._outside_keys():
+                # A key outside of the best may have overtaken it now
+                self._best = None
+                return
+            self._best[key] = score
+            self._reheap()
+        elif len(self._best) < self.size:
+            self._best[key] = score
+            heapq.heappush(self._heap, (score, key))
+        elif score > self._heap[0][0]:
+            _, dropped = heapq.heapreplace(self._heap, (score, key))
+            del self._best[dropped]
+            self._best[key] = score
+
+    def discard(self, key):
+        if self.scores.pop(key, None) is None or self._best is None:
+            return
+        if key in self._best:
+            del self._best[key]
+            if self._outside_keys():
+                # The best key outside of them has to move up into the empty place
+                self._best = None
+            else:
+                self._reheap()
+
+    def top(self, n: int = LEADERBOARD_SIZE) -> list[tuple[object, float]]:
+        """
+        Returns the n best (key, score) pairs, best first
+        """
+        if n > self.size:
+            self.size = n
+            self._best = None
+        if self._best is None:
+            best = heapq.nlargest(self.size, self.scores.items(), key=itemgetter(1))
+            self._best = dict(best)
+            self._reheap()
+        return sorted(self._best.items(), key=itemgetter(1), reverse=True)[:n]
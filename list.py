@@ -1,17 +1,21 @@
+from functools import partial
 from source import State, main_menu
 from helpers import *
 from pymysql import DatabaseError
+from shopping import build_shopping_list, write_shopping_list
 
+# Largest servings multiplier accepted for a recipe on a shopping list
+MAX_SERVINGS = 100
 
-class List:
+
+class List(Model):
     """
     Represents a List of ingredients and the data associated with it
     """
 
-    def __init__(self, l_dict: dict[str,]):
-        self.id = l_dict.get("list_id")
-        self.name = l_dict.get("name")
-        self.date_created = l_dict.get("date_created")
+    __slots__ = ("id", "name", "date_created")
+
+    COLUMNS = {"id": "list_id", "name": "name", "date_created": "date_created"}
 
     def print_self(self):
         print(f"Name: {self.name}")
@@ -27,58 +31,59 @@ def list_module(state: State):
     state.print_message_reset()
 
     # Main menu
-    print_menu("Choose an action", ["View all lists", "Create new list", "Go back"])
-    choice = get_num_input(1, 3, "Go to")
-
-    cur = state.cur
+    print_menu(
+        "Choose an action",
+        [
+            "View all lists",
+            "Create new list",
+            "Create shopping list from recipes",
+            "Go back",
+        ],
+    )
+    choice = get_num_input(1, 4, "Go to")
+
+    db = state.db
 
     match choice:
         case 1:
             # View all lists
             try:
-                lists = call_proc(cur, "get_all_lists_for_user", [state.user_id])
+                lists = state.identities.load(
+                    List,
+                    *call_proc_tuples(db, "get_all_lists_for_user", [state.user_id]),
+                )
             except DatabaseError as e:
                 print(e)
                 print("Error occurred when trying to fetch all lists")
-                list_module(state)
-                return
-
-            list_table_data = [row.values() for row in lists]
+                return list_module
 
-            list_ids = [row.get("list_id") for row in lists]
+            list_table_data = ((l.id, l.name, l.date_created) for l in lists.values())
 
             print_table(["ID", "Name", "Date Created"], list_table_data)
 
-            choice = num_input_list_neg_one(
-                list_ids, "Choose a list ID or -1 to go back"
-            )
+            choice = num_input_list_neg_one(lists, "Choose a list ID or -1 to go back")
 
             match choice:
                 case -1:
-                    list_module(state)
-                    return
+                    return list_module
                 case _:
-                    l_obj = List(
-                        [row for row in lists if row.get("list_id") == choice][0]
-                    )
-                    list_action(l_obj, state)
+                    return partial(list_action, lists[choice])
 
         case 2:
             # Create a new list
             name = input("Enter name of new list: ")
 
             try:
-                list_id = call_proc(cur, "create_list", [name, state.user_id])
+                list_id = call_proc(db, "create_list", [name, state.user_id])
             except DatabaseError as e:
                 if e.args[0] == DUPLICATE_CODE:
                     print("Cannot create a list with a duplicated title")
                 print("Error creating new list")
-                list_module(state)
-                return
+                return list_module
             finally:
                 list_id = list_id[0].get("list_id")
 
-            print_ingredient_table(cur, state.user_id)
+            print_ingredient_table(db, state.user_id)
 
             # Loop for adding ingredients to list
             while True:
@@ -90,7 +95,7 @@ def list_module(state: State):
                     break
 
                 try:
-                    call_proc(cur, "create_list_item", [ing_id, list_id])
+                    call_proc(db, "create_list_item", [ing_id, list_id])
                 except DatabaseError as e:
                     if e.args[0] == DUPLICATE_CODE:
                         print("Duplicate entries are not allowed")
@@ -100,12 +105,116 @@ def list_module(state: State):
                         print("Error adding this ingredient to the list")
 
             state.update_message(f"Created new list with ID {list_id}")
-            list_module(state)
-            return
+            return list_module
 
         case 3:
+            # Create a list with the ingredients of several recipes
+            return shopping_list
+        case 4:
             # Return to the main screen
-            main_menu(state)
+            return main_menu
+
+
+def get_servings(prompt: str) -> float:
+    """
+    Returns a servings multiplier entered by the user, 1 if nothing is entered
+    """
+    while True:
+        entered = input(prompt + " (Enter for 1): ")
+        if entered == "":
+            return 1.0
+
+        try:
+            servings = float(entered)
+        except ValueError:
+            servings = 0.0
+
+        if 0 < servings <= MAX_SERVINGS:
+            return servings
+
+        print(f"Please input a number above 0 and up to {MAX_SERVINGS}")
+
+
+def shopping_list(state: State):
+    """
+    Menu to create one list with the combined ingredients of the recipes chosen, with
+    the amounts needed for each number of servings added together
+    """
+    db = state.db
+
+    recipe_ids = print_recipe_table(db, state.user_id)
+
+    servings = {}
+    while True:
+        recipe_id = num_input_list_neg_one(
+            recipe_ids, "Choose a recipe ID to shop for or -1 when done"
+        )
+        if recipe_id == -1:
+            break
+        servings[recipe_id] = get_servings("Servings multiplier")
+
+    if not servings:
+        state.update_message("No recipes chosen, no list was created")
+        return list_module
+
+    try:
+        items = build_shopping_list(db, servings)
+    except DatabaseError as e:
+        print(e)
+        state.update_message("Error reading the recipes' ingredients")
+        return list_module
+
+    # the list only holds the items, so the added up amounts are shown before it is
+    # created for the user to write down or check against
+    print("\nAmounts needed, which are not saved with the list:")
+    print_table(
+        ["Item", "Amount"],
+        ((item.name, item.amount) for item in items.values()),
+    )
+
+    name = input("Enter name of new list or leave empty to cancel: ")
+    if not name:
+        state.update_message("No list was created")
+        return list_module
+
+    try:
+        # read again inside the transaction, so the items written are the ingredients
+        # the recipes have when the list is created
+        with db.transaction() as tx:
+            items = build_shopping_list(tx, servings)
+            list_id = write_shopping_list(tx, state.user_id, name, items)
+    except DatabaseError as e:
+        if e.args[0] == DUPLICATE_CODE:
+            print("Cannot create a list with a duplicated title")
+        else:
+            print(e)
+        state.update_message("Error creating shopping list")
+        return list_module
+
+    clear_screen()
+    print(
+        f"Created list '{name}' with {len(items)} item(s) from {len(servings)} recipe(s)"
+    )
+
+    print_menu("\nChoose an action", ["Open the new list", "Go back"])
+    choice = get_num_input(1, 2, "Go to")
+
+    match choice:
+        case 1:
+            try:
+                lists = state.identities.load(
+                    List,
+                    *call_proc_tuples(db, "get_all_lists_for_user", [state.user_id]),
+                )
+            except DatabaseError as e:
+                print(e)
+                state.update_message("Error occurred when trying to fetch all lists")
+                return list_module
+
+            return partial(list_action, lists[list_id])
+        case 2:
+            state.update_message(f"Created new list with ID {list_id}")
+            return list_module
 
 
 def list_action(list: List, state: State):
@@ -119,15 +228,15 @@ def list_action(list: List, state: State):
     list.print_self()
 
     try:
-        items = call_proc(state.cur, "get_ingredients_for_list", [list.id])
+        items = call_proc(state.db, "get_ingredients_for_list", [list.id])
     except DatabaseError as e:
         print(e)
         print("Error occurred when trying to fetch ingredients for this list")
 
-    item_table_data = [
+    item_table_data = (
         (row.get("item_id"), row.get("name"), "x" if row.get("completed") == 1 else "")
         for row in items
-    ]
+    )
 
     # Print a table for the ingredients in the list and their statuses
     print_table(["ID", "Item", "Completed"], item_table_data)
@@ -156,9 +265,8 @@ def list_action(list: List, state: State):
                         new_name = input(f"Enter a new name for '{list.name}': ")
 
                         try:
-                            call_proc(
-                                state.cur, "update_list_name", [list.id, new_name]
-                            )
+                            call_proc(state.db, "update_list_name", [list.id, new_name])
+                            state.identities.update(List, list.id, name=new_name)
                         except DatabaseError as e:
                             if e.args[0] == DUPLICATE_CODE:
                                 print("Cannot have duplicate list names")
@@ -178,7 +286,7 @@ def list_action(list: List, state: State):
                         match choice:
                             case 1:
                                 # Add items to the list
-                                print_ingredient_table(state.cur, state.user_id)
+                                print_ingredient_table(state.db, state.user_id)
                                 while True:
                                     ing_id = safe_num_input(
                                         "Choose an ingredient ID to add to the list or -1 to cancel"
@@ -189,7 +297,7 @@ def list_action(list: List, state: State):
 
                                     try:
                                         call_proc(
-                                            state.cur,
+                                            state.db,
                                             "create_list_item",
                                             [ing_id, list.id],
                                         )
@@ -208,23 +316,23 @@ def list_action(list: List, state: State):
                                     update_msg += " with different items"
                             case 2:
                                 # Delete items from a list
+                                item_ids = {row.get("item_id") for row in items}
+
                                 while True:
                                     item_id = safe_num_input(
                                         "Choose an item ID from the list to remove or -1 to cancel"
                                     )
 
-                                    if item_id not in [
-                                        row.get("item_id") for row in items
-                                    ]:
-                                        print("Invalid item ID, try again")
-                                        continue
-
                                     if item_id == -1:
                                         break
 
+                                    if item_id not in item_ids:
+                                        print("Invalid item ID, try again")
+                                        continue
+
                                     try:
                                         call_proc(
-                                            state.cur,
+                                            state.db,
                                             "remove_item_from_list",
                                             [item_id, list.id],
                                         )
@@ -242,7 +350,7 @@ def list_action(list: List, state: State):
                                 # Update the statuses of items on the list (complete or not)
                                 try:
                                     items = call_proc(
-                                        state.cur, "get_ingredients_for_list", [list.id]
+                                        state.db, "get_ingredients_for_list", [list.id]
                                     )
                                 except DatabaseError as e:
                                     print(e)
@@ -250,14 +358,14 @@ def list_action(list: List, state: State):
                                         "Error occurred when fetching ingredients for this list"
                                     )
 
-                                item_table_data = [
+                                item_table_data = (
                                     (
                                         row.get("item_id"),
                                         row.get("name"),
                                         "x" if row.get("completed") == 1 else "",
                                     )
                                     for row in items
-                                ]
+                                )
 
                                 print_table(
                                     ["ID", "Item", "Completed"], item_table_data
@@ -281,7 +389,7 @@ def list_action(list: List, state: State):
                                             else 0
                                         )
                                         call_proc(
-                                            state.cur,
+                                            state.db,
                                             "toggle_item_status_in_list",
                                             [item_id, list.id, new_status],
                                         )
@@ -306,29 +414,22 @@ def list_action(list: List, state: State):
 
             state.update_message(update_msg)
 
-            # Update the properties of the list after editing it
-            new_list = List(
-                {
-                    "list_id": list.id,
-                    "name": new_name,
-                    "date_created": list.date_created,
-                }
-            )
-            list_action(new_list, state)
+            return partial(list_action, list)
 
         case 2:
             # Delete a list
             confirm = input(f"Are you sure you want to delete '{list.name}'? Y/N: ")
             if confirm == "Y" or confirm == "y":
                 try:
-                    call_proc(state.cur, "delete_list", [list.id])
+                    call_proc(state.db, "delete_list", [list.id])
+                    state.identities.remove(List, list.id)
                 except DatabaseError as e:
                     print(e)
                     print("Error occurred when trying to delete this list")
 
                 state.update_message(f"Deleted list '{list.name}'")
-            list_module(state)
+            return list_module
 
         case 3:
             # Return to the top level menu for all lists
-            list_module(state)
+            return list_module
@@ -0,0 +1,410 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Setting RECIPEMASTER_METRICS to 1 records the latency of every call made to the
+# database. When unset the database is not wrapped at all, so nothing is measured
+METRICS_ENV = "RECIPEMASTER_METRICS"
+
+# Calls slower than this many milliseconds are written to the slow call log
+SLOW_CALL_ENV = "RECIPEMASTER_SLOW_MS"
+SLOW_CALL_MS = 100.0
+
+# Where slow calls are logged and metrics are dumped to
+METRICS_DIR = os.path.join(os.path.expanduser("~"), ".recipemaster", "metrics")
+SLOW_LOG_PATH = os.path.join(METRICS_DIR, "slow.log")
+
+# Latency histogram buckets grow geometrically from the smallest one, so every
+# percentile read from them is within about 10% of the true value
+BUCKET_MIN = 0.00005
+BUCKET_GROWTH = 1.1
+BUCKET_COUNT = 150
+
+PERCENTILES = (50, 95, 99)
+
+# Procedures whose arguments include a password, which the slow call log leaves out
+SECRET_PROCS = {"create_user"}
+
+# Bytes counted for a column value that is not text or binary data
+SCALAR_BYTES = 8
+
+
+def metrics_enabled() -> bool:
+    return os.environ.get(METRICS_ENV, "") not in ("", "0")
+
+
+def slow_call_threshold() -> float:
+    """
+    Returns the slow call threshold in seconds
+    """
+    try:
+        return float(os.environ[SLOW_CALL_ENV]) / 1000
+    except (KeyError, ValueError):
+        return SLOW_CALL_MS / 1000
+
+
+def row_bytes(rows) -> int:
+    """
+    Estimates the bytes fetched for rows given as dicts or tuples, counting text and
+    binary values by their length and anything else as SCALAR_BYTES
+    """
+    total = 0
+    for row in rows:
+        for value in row.values() if isinstance(row, dict) else row:
+            if isinstance(value, (str, bytes)):
+                total += len(value)
+            elif value is not None:
+                total += SCALAR_BYTES
+    return total
+
+
+class Histogram:
+    """
+    Counts latencies in geometrically sized buckets, so any number of calls is kept in
+    constant space. The last bucket holds everything too slow for the others
+    """
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        if seconds <= BUCKET_MIN:
+            index = 0
+        else:
+            index = min(
+                BUCKET_COUNT - 1,
+                math.ceil(math.log(seconds / BUCKET_MIN, BUCKET_GROWTH)),
+            )
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns the latency in seconds that p percent of calls were at most, as the
+        upper bound of the bucket it falls in
+        """
+        if not self.count:
+            return 0.0
+
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(BUCKET_MIN * BUCKET_GROWTH**index, self.max)
+        return self.max
+
+
+class ProcedureStats:
+    """
+    Everything recorded about the calls to one procedure
+    """
+
+    __slots__ = ("latency", "rows", "bytes", "errors")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.bytes = 0
+        # MySQL error code -> number of calls that failed with it
+        self.errors = {}
+
+    def as_dict(self) -> dict[str,]:
+        latency = self.latency
+        return {
+            "calls": latency.count,
+            "total_ms": latency.total * 1000,
+            "mean_ms": latency.total / latency.count * 1000 if latency.count else 0.0,
+            "max_ms": latency.max * 1000,
+            **{f"p{p}_ms": latency.percentile(p) * 1000 for p in PERCENTILES},
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "errors": {str(code): n for code, n in self.errors.items()},
+        }
+
+
+class ProcedureMetrics:
+    """
+    Latency histograms, row and byte counts and error codes for each procedure called,
+    shared by every thread using the database. Calls slower than slow_threshold seconds
+    are appended to the slow call log
+    """
+
+    def __init__(
+        self, slow_threshold: float = None, slow_log_path: str = SLOW_LOG_PATH
+    ):
+        if slow_threshold is None:
+            slow_threshold = slow_call_threshold()
+        self.slow_threshold = slow_threshold
+        self.slow_log_path = slow_log_path
+        self.slow_calls = 0
+        self.started = time.time()
+
+        self._procs = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        name: str,
+        seconds: float,
+        args: list = (),
+        rows: int = 0,
+        nbytes: int = 0,
+        error: Exception = None,
+    ):
+        with self._lock:
+            stats = self._procs.get(name)
+            if stats is None:
+                stats = self._procs[name] = ProcedureStats()
+
+            stats.latency.add(seconds)
+            stats.rows += rows
+            stats.bytes += nbytes
+            if error is not None:
+                code = error.args[0] if error.args else type(error).__name__
+                stats.errors[code] = stats.errors.get(code, 0) + 1
+
+        if seconds >= self.slow_threshold:
+            self.log_slow_call(name, seconds, args, rows, error)
+
+    def log_slow_call(
+        self, name: str, seconds: float, args: list, rows: int, error: Exception
+    ):
+        shown = "..." if name in SECRET_PROCS else ", ".join(map(repr, args))
+        line = (
+            f"{datetime.now().isoformat(timespec='milliseconds')} "
+            f"{seconds * 1000:.1f} ms {name}({shown}) "
+            f"rows={rows}"
+        )
+        if error is not None:
+            line += f" error={error!r}"
+
+        with self._lock:
+            self.slow_calls += 1
+            try:
+                os.makedirs(os.path.dirname(self.slow_log_path), exist_ok=True)
+                with open(self.slow_log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                # losing the log must never break the call that was being logged
+                pass
+
+    def snapshot(self) -> dict[str, dict[str,]]:
+        """
+        Returns the statistics of every procedure called so far, keyed by name
+        """
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._procs.items()}
+
+    def report(self) -> tuple[list[str], list[tuple]]:
+        """
+        Returns the fields and rows of a table of every procedure called, slowest in
+        total first, for print_table
+        """
+        fields = ["Procedure", "Calls", "Total ms"]
+        fields += [f"p{p} ms" for p in PERCENTILES]
+        fields += ["Max ms", "Rows", "KB", "Errors"]
+
+        rows = []
+        for name, stats in sorted(
+            self.snapshot().items(), key=lambda item: -item[1]["total_ms"]
+        ):
+            rows.append(
+                (
+                    name,
+                    stats["calls"],
+                    f"{stats['total_ms']:.1f}",
+                    *(f"{stats[f'p{p}_ms']:.2f}" for p in PERCENTILES),
+                    f"{stats['max_ms']:.2f}",
+                    stats["rows"],
+                    f"{stats['bytes'] / 1024:.1f}",
+                    ", ".join(f"{code} x{n}" for code, n in stats["errors"].items()),
+                )
+            )
+        return fields, rows
+
+    def dump_json(self, path: str = None) -> str:
+        """
+        Writes every procedure's statistics to a JSON file, by default a new one in
+        METRICS_DIR, and returns its path
+        """
+        if path is None:
+            path = os.path.join(
+                METRICS_DIR,
+                f"metrics-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.json",
+            )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # only needed when metrics are dumped, so kept off the startup path
+        import json
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "started": datetime.fromtimestamp(self.started).isoformat(
+                        timespec="seconds"
+                    ),
+                    "ended": datetime.now().isoformat(timespec="seconds"),
+                    "slow_threshold_ms": self.slow_threshold * 1000,
+                    "slow_calls": self.slow_calls,
+                    "procedures": self.snapshot(),
+                },
+                f,
+                indent=2,
+            )
+        return path
+
+
+class InstrumentedTransaction:
+    """
+    Records the calls made through a transaction of an InstrumentedDatabase
+    """
+
+    def __init__(self, tx, metrics: ProcedureMetrics):
+        self.tx = tx
+        self.metrics = metrics
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        return _timed(self.metrics, proc_name, args, self.tx.callproc, row_bytes)
+
+    def callproc_many(self, proc_name: str, arg_rows: list[list]):
+        # a batch is timed as a whole, recorded as one call under its own name
+        started = time.perf_counter()
+        try:
+            self.tx.callproc_many(proc_name, arg_rows)
+        except Exception as e:
+            self.metrics.record(
+                f"{proc_name} (batch)", time.perf_counter() - started, error=e
+            )
+            raise
+        self.metrics.record(f"{proc_name} (batch)", time.perf_counter() - started)
+
+
+class InstrumentedDatabase:
+    """
+    Wraps a database (a ConnectionPool or SQLiteDatabase) so every call made to it is
+    timed and recorded in a ProcedureMetrics. It sits beneath the result cache, so only
+    calls that actually reach the database are recorded
+    """
+
+    def __init__(self, db, metrics: ProcedureMetrics):
+        self.db = db
+        self.metrics = metrics
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        return _timed(self.metrics, proc_name, args, self.db.callproc, row_bytes)
+
+    def callproc_tuples(
+        self, proc_name: str, args: list = []
+    ) -> tuple[dict[str, int], tuple[tuple, ...]]:
+        return _timed(
+            self.metrics,
+            proc_name,
+            args,
+            self.db.callproc_tuples,
+            lambda result: row_bytes(result[1]),
+            lambda result: len(result[1]),
+        )
+
+    def execute(self, query: str, args: list = []) -> tuple[dict[str,], ...]:
+        # the query text would make every call its own entry, and args can be secret
+        return _timed(
+            self.metrics,
+            "query",
+            [],
+            lambda _, __: self.db.execute(query, args),
+            row_bytes,
+        )
+
+    @contextmanager
+    def stream(self, proc_name: str, args: list = []):
+        """
+        Yields the streamed rows, recording the call once the with block ends along with
+        every row read. Only the time spent in the database counts (opening the stream,
+        fetching each row and closing it), not what the with block does between rows
+        """
+        elapsed = 0.0
+        rows = 0
+        nbytes = 0
+        error = None
+
+        def counted(it):
+            nonlocal elapsed, rows, nbytes, error
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next(it)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    elapsed += time.perf_counter() - started
+                rows += 1
+                nbytes += row_bytes((row,))
+                yield row
+
+        started = time.perf_counter()
+        raised = None
+        try:
+            with self.db.stream(proc_name, args) as it:
+                elapsed += time.perf_counter() - started
+                try:
+                    yield counted(iter(it))
+                except BaseException as e:
+                    # raised by the with block, or by reading a row (see counted)
+                    raised = e
+                    raise
+                finally:
+                    # closing the stream may still read the rows left unread
+                    started = time.perf_counter()
+        except Exception as e:
+            if e is not raised:
+                # the database failed to open or close the stream
+                error = e
+            raise
+        finally:
+            elapsed += time.perf_counter() - started
+            self.metrics.record(proc_name, elapsed, args, rows, nbytes, error)
+
+    @contextmanager
+    def transaction(self):
+        with self.db.transaction() as tx:
+            yield InstrumentedTransaction(tx, self.metrics)
+
+    def close(self):
+        self.db.close()
+
+
+def _timed(metrics: ProcedureMetrics, name: str, args: list, call, size, count=len):
+    started = time.perf_counter()
+    try:
+        result = call(name, args)
+    except Exception as e:
+        metrics.record(name, time.perf_counter() - started, args, error=e)
+        raise
+    metrics.record(
+        name, time.perf_counter() - started, args, count(result), size(result)
+    )
+    return result
+
+
+def instrument(db):
+    """
+    Returns the database wrapped in an InstrumentedDatabase if metrics are enabled,
+    otherwise the database itself
+    """
+    if not metrics_enabled():
+        return db
+    return InstrumentedDatabase(db, ProcedureMetrics())
@@ -0,0 +1,827 @@
+import hashlib
+import hmac
+import json
+import os
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterable, NamedTuple
+
+import pymysql
+
+from cache import changed_sections, is_mutating
+from embedded import hash_password
+from helpers import DUPLICATE_CODE, NOT_FOUND_CODE, call_proc_grouped
+from prefetch import CATALOG_PROCS
+
+# Where each user's snapshot, journal and conflict log are kept, apart for each database
+# (named by config.database_key) since the same username can be someone else on another
+OFFLINE_DIR = os.path.join(os.path.expanduser("~"), ".recipemaster", "offline")
+
+# Number of journaled writes replayed together in one transaction
+REPLAY_BATCH_SIZE = 50
+
+# Every read the snapshot holds for the user, besides the details of each list and recipe
+SNAPSHOT_PROCS = CATALOG_PROCS + ("get_categories_for_user",)
+
+# The reads of the rows of each list or recipe, made with one call for all of the user's
+# lists or recipes: (procedure for all of them, column holding whose rows they are,
+# procedure for one, which older dumps are read with instead)
+DETAIL_READS = {
+    "get_all_lists_for_user": (
+        ("get_list_items_for_user", "list_id", "get_ingredients_for_list"),
+    ),
+    "get_all_recipes_for_user": (
+        ("get_recipe_ingredients_for_user", "recipe_id", "get_ingredients_for_recipe"),
+        ("get_recipe_categories_for_user", "recipe_id", "get_categories_for_recipe"),
+    ),
+}
+
+# The procedures whose results each section of a user's data (see cache.WRITE_SECTIONS)
+# is held in, so the sections a session wrote to are read again together
+SNAPSHOT_SECTIONS = {
+    "recipes": (
+        "get_all_recipes_for_user",
+        "get_ingredients_for_recipe",
+        "get_categories_for_recipe",
+    ),
+    "ingredients": ("get_all_ingredients_for_user",),
+    "categories": ("get_all_categories_for_user", "get_categories_for_user"),
+    "lists": ("get_all_lists_for_user", "get_ingredients_for_list"),
+}
+
+# Seconds a snapshot is only brought up to date with the writes made through the app,
+# after which logging in reads all of it again to pick up changes made elsewhere
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+# Seconds shutting down waits for the offline copy to be saved, so a slow server cannot
+# keep the app from closing
+SNAPSHOT_SAVE_TIMEOUT = 10.0
+
+# MySQL client error code for a server that cannot be reached
+CONNECTION_ERROR_CODE = 2003
+
+# MySQL client error codes for failing to reach the server at all (unreachable, unknown
+# host, connection lost), the only failures to connect working offline stands in for
+UNREACHABLE_CODES = (CONNECTION_ERROR_CODE, 2005, 2013)
+
+
+class OfflineError(pymysql.err.OperationalError):
+    """
+    Raised for a call that cannot be served while working offline
+    """
+
+
+class RowKind(NamedTuple):
+    """
+    Where rows of one kind are read from: the procedure returning them, called with
+    either the ID of their parent or the user's ID, and the column holding their ID
+    """
+
+    read_proc: str
+    id_column: str
+
+
+ROW_KINDS = {
+    "item": RowKind("get_ingredients_for_list", "item_id"),
+    "list": RowKind("get_all_lists_for_user", "list_id"),
+    "recipe": RowKind("get_all_recipes_for_user", "recipe_id"),
+}
+
+
+class JournaledWrite(NamedTuple):
+    """
+    How a procedure that can be called offline changes a row: which kind of row it is,
+    whether it is updated, deleted or created, the positions of the row's ID and its
+    parent's ID in the arguments (None for a created row or one read by user ID), the
+    columns set from the arguments and, for a created row, the column that tells
+    whether an equal row exists already
+    """
+
+    kind: str
+    action: str
+    id_arg: int | None
+    parent_arg: int | None
+    fields: dict[str, int]
+    match: str | None = None
+
+    def target(self, args: list) -> dict[str,] | None:
+        """
+        Returns the row's columns as they are once the write has been made
+        """
+        if self.action == "delete":
+            return None
+        return {column: args[i] for column, i in self.fields.items()}
+
+
+# The writes that can be made offline, the ones needed to keep lists and recipes up to
+# date away from the server. Every other write fails while offline
+JOURNALED_WRITES = {
+    "create_list": JournaledWrite("list", "create", None, None, {"name": 0}, "name"),
+    "update_list_name": JournaledWrite("list", "update", 0, None, {"name": 1}),
+    "delete_list": JournaledWrite("list", "delete", 0, None, {}),
+    "create_list_item": JournaledWrite(
+        "item", "create", None, 1, {"ingredient_id": 0}, "ingredient_id"
+    ),
+    "toggle_item_status_in_list": JournaledWrite(
+        "item", "update", 0, 1, {"completed": 2}
+    ),
+    "remove_item_from_list": JournaledWrite("item", "delete", 0, 1, {}),
+    "update_recipe": JournaledWrite(
+        "recipe",
+        "update",
+        3,
+        None,
+        {"name": 0, "instructions": 1, "cooking_time": 2},
+    ),
+}
+
+
+def user_key(username: str) -> str:
+    # usernames can hold anything, so files are named after a hash of them
+    return hashlib.sha256(username.encode()).hexdigest()[:16]
+
+
+def snapshot_path(db_key: str, username: str) -> str:
+    return os.path.join(OFFLINE_DIR, f"{db_key}-{user_key(username)}.snapshot.json")
+
+
+def journal_path(db_key: str, username: str) -> str:
+    return os.path.join(OFFLINE_DIR, f"{db_key}-{user_key(username)}.journal.jsonl")
+
+
+def conflicts_path(db_key: str, username: str) -> str:
+    return os.path.join(OFFLINE_DIR, f"{db_key}-{user_key(username)}.conflicts.jsonl")
+
+
+def stale_path(db_key: str, username: str) -> str:
+    # there while a snapshot is being saved, so one left unfinished is read again whole
+    return os.path.join(OFFLINE_DIR, f"{db_key}-{user_key(username)}.stale")
+
+
+def has_snapshots(db_key: str) -> bool:
+    """
+    Returns whether any user of the database named by db_key has a snapshot to work
+    offline from
+    """
+    try:
+        return any(
+            name.startswith(f"{db_key}-") and name.endswith(".snapshot.json")
+            for name in os.listdir(OFFLINE_DIR)
+        )
+    except OSError:
+        return False
+
+
+def _json_value(value):
+    # dates and times are kept as the ISO text they print as
+    if isinstance(value, (date, datetime)):
+        return (
+            value.isoformat(" ") if isinstance(value, datetime) else value.isoformat()
+        )
+    return str(value)
+
+
+def _fsync_line(f, record: dict):
+    f.write(json.dumps(record, default=_json_value) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class Snapshot:
+    """
+    A copy of a user's procedure results (their recipes, ingredients, categories and
+    lists along with each list's items and each recipe's details) saved while online,
+    along with a hash of their password so they can log in without the server
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        username: str,
+        password_hash: str,
+        salt: str,
+        taken: str,
+        results: dict[tuple, list[dict[str,]]],
+    ):
+        self.user_id = user_id
+        self.username = username
+        self.password_hash = password_hash
+        self.salt = salt
+        self.taken = taken
+        # (proc name, args tuple) -> rows
+        self.results = results
+
+    @classmethod
+    def take(cls, db, user_id: int, username: str, password: str) -> "Snapshot":
+        """
+        Reads everything the snapshot holds from the database
+        """
+        snapshot = cls(user_id, username, "", "", "", {})
+        snapshot.set_password(password)
+        snapshot.refresh(db, SNAPSHOT_SECTIONS)
+        return snapshot
+
+    def refresh(self, db, sections: Iterable[str]):
+        """
+        Reads the given sections from the database again, replacing what the snapshot
+        held for them. The rows of every list or recipe are read with one call for all
+        of them, or one call each on older dumps
+        """
+        sections = set(sections)
+        procs = {
+            proc_name
+            for section in sections
+            for proc_name in SNAPSHOT_SECTIONS[section]
+        }
+        results = {
+            key: rows for key, rows in self.results.items() if key[0] not in procs
+        }
+
+        for proc_name in SNAPSHOT_PROCS:
+            if proc_name not in procs:
+                continue
+            rows = [dict(row) for row in db.callproc(proc_name, [self.user_id])]
+            results[(proc_name, (self.user_id,))] = rows
+
+            for batch_proc, id_column, proc_for_one in DETAIL_READS.get(proc_name, ()):
+                grouped = call_proc_grouped(
+                    db, batch_proc, [self.user_id], id_column, proc_for_one
+                )
+                for row in rows:
+                    results[(proc_for_one, (row.get(id_column),))] = [
+                        {
+                            column: value
+                            for column, value in dict(detail).items()
+                            if column != id_column
+                        }
+                        for detail in grouped[row.get(id_column)]
+                    ]
+
+        self.results = results
+        if sections >= SNAPSHOT_SECTIONS.keys():
+            self.taken = datetime.now().isoformat(" ", timespec="minutes")
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds since the whole snapshot was last read
+        """
+        return (datetime.now() - datetime.fromisoformat(self.taken)).total_seconds()
+
+    def set_password(self, password: str):
+        salt = os.urandom(16)
+        self.password_hash = hash_password(password, salt).hex()
+        self.salt = salt.hex()
+
+    def check_password(self, password: str) -> bool:
+        password_hash = hash_password(password, bytes.fromhex(self.salt))
+        return hmac.compare_digest(password_hash.hex(), self.password_hash)
+
+    def save(self, path: str):
+        """
+        Writes the snapshot to path, replacing the previous one only once it is complete
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + ".tmp"
+        # it holds the password hash, so only the user may read it, from the moment
+        # it is created
+        fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "user_id": self.user_id,
+                    "username": self.username,
+                    "password_hash": self.password_hash,
+                    "salt": self.salt,
+                    "taken": self.taken,
+                    "results": [
+                        [proc_name, list(args), rows]
+                        for (proc_name, args), rows in self.results.items()
+                    ],
+                },
+                f,
+                default=_json_value,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Snapshot | None":
+        """
+        Returns the snapshot saved at path, or None if there is none
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return cls(
+            data["user_id"],
+            data["username"],
+            data["password_hash"],
+            data["salt"],
+            data["taken"],
+            {
+                (proc_name, tuple(args)): rows
+                for proc_name, args, rows in data["results"]
+            },
+        )
+
+
+def save_snapshot(
+    db,
+    db_key: str,
+    user_id: int,
+    username: str,
+    password: str,
+    sections: Iterable[str] = (),
+):
+    """
+    Brings the user's snapshot up to date. When they have a current one, only the
+    given sections are read again, and nothing is read if none are given. Otherwise
+    the whole snapshot is taken anew. A snapshot is current if it belongs to the same
+    user, was read whole within SNAPSHOT_MAX_AGE and was not left partly saved. db_key
+    names the database the snapshot is read from, as config.database_key does
+    """
+    path = snapshot_path(db_key, username)
+    marker = stale_path(db_key, username)
+    snapshot = None if os.path.exists(marker) else Snapshot.load(path)
+    if (
+        snapshot is None
+        or snapshot.user_id != user_id
+        or snapshot.age > SNAPSHOT_MAX_AGE
+    ):
+        snapshot = Snapshot(user_id, username, "", "", "", {})
+        sections = SNAPSHOT_SECTIONS
+    elif not sections:
+        return
+
+    os.makedirs(OFFLINE_DIR, exist_ok=True)
+    with open(marker, "w"):
+        pass
+    snapshot.refresh(db, sections)
+    snapshot.set_password(password)
+    snapshot.save(path)
+    os.remove(marker)
+
+
+class Journal:
+    """
+    The writes made while offline, appended to a JSON Lines file and synced to disk one
+    by one so none are lost if the app is closed. Writes are never removed once
+    replayed; a checkpoint line records how far replaying got instead, and the file
+    is emptied once everything in it has been replayed, keeping only the last ID given
+    out offline
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = []
+        self.applied = 0
+        # lowest ID given out offline before the journal was last emptied, 0 if none
+        self.last_id = 0
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash while it was being written
+                        continue
+                    if "applied" in record:
+                        self.applied = max(self.applied, record["applied"])
+                    elif "last_id" in record:
+                        self.last_id = min(self.last_id, record["last_id"])
+                    else:
+                        self.entries.append(record)
+        except FileNotFoundError:
+            pass
+
+    def pending(self) -> list[dict[str,]]:
+        """
+        Returns the writes that have not been replayed yet, oldest first
+        """
+        return [entry for entry in self.entries if entry["seq"] > self.applied]
+
+    def next_id(self) -> int:
+        """
+        Returns an ID for a row created offline. IDs given out offline are negative so
+        they can never be mistaken for the server's, and are swapped for the server's
+        when the write creating the row is replayed. They are never given out twice,
+        so a row created offline is never mistaken for an earlier one either
+        """
+        return (
+            min([self.last_id] + [entry["id"] for entry in self.entries if entry["id"]])
+            - 1
+        )
+
+    def append(self, proc_name: str, args: list, before, created_id: int = None):
+        entry = {
+            "seq": self.entries[-1]["seq"] + 1 if self.entries else self.applied + 1,
+            "proc": proc_name,
+            "args": list(args),
+            "before": before,
+            "id": created_id,
+            "at": datetime.now().isoformat(" ", timespec="seconds"),
+        }
+        self._write(entry)
+        self.entries.append(entry)
+
+    def mark_applied(self, seq: int):
+        self._write({"applied": seq})
+        self.applied = seq
+
+    def compact(self):
+        """
+        Empties the journal if everything in it has been replayed, leaving only the
+        last ID given out so the next ones carry on from it
+        """
+        if self.pending():
+            return
+        self.last_id = self.next_id() + 1
+        self.entries = []
+        if self.last_id == 0:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return
+
+        partial = self.path + ".tmp"
+        with open(partial, "w", encoding="utf-8") as f:
+            _fsync_line(f, {"last_id": self.last_id})
+        os.replace(partial, self.path)
+
+    def _write(self, record: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            _fsync_line(f, record)
+
+
+class RowStore:
+    """
+    The rows that journaled writes change, as read from fetch (the server while
+    replaying, nothing while offline) and kept up to date as writes are applied to
+    them, keyed the same way as a Snapshot's results
+    """
+
+    def __init__(self, user_id: int, fetch, results: dict = None):
+        self.user_id = user_id
+        self.fetch = fetch
+        self.results = {} if results is None else results
+
+    def _key(self, write: JournaledWrite, args: list) -> tuple[str, tuple]:
+        # the read returning the row a write changes
+        parent = self.user_id if write.parent_arg is None else args[write.parent_arg]
+        return ROW_KINDS[write.kind].read_proc, (parent,)
+
+    def rows(self, write: JournaledWrite, args: list) -> list[dict[str,]]:
+        key = self._key(write, args)
+        if key not in self.results:
+            proc_name, read_args = key
+            self.results[key] = [
+                dict(row) for row in self.fetch(proc_name, list(read_args))
+            ]
+        return self.results[key]
+
+    def find(self, write: JournaledWrite, args: list) -> dict[str,] | None:
+        """
+        Returns the row a write changes, or for a created row the equal row that
+        exists already, or None if there is none
+        """
+        if write.action == "create":
+            column, value = write.match, args[write.fields[write.match]]
+        else:
+            column, value = ROW_KINDS[write.kind].id_column, args[write.id_arg]
+        return next(
+            (row for row in self.rows(write, args) if row.get(column) == value), None
+        )
+
+    def forget(self, write: JournaledWrite, args: list):
+        """
+        Drops the stored rows a write changes, so they are fetched again
+        """
+        self.results.pop(self._key(write, args), None)
+
+    def state(self, write: JournaledWrite, args: list) -> dict[str,] | None:
+        """
+        Returns the columns of the row a write changes, or None if it does not exist
+        """
+        row = self.find(write, args)
+        if row is None:
+            return None
+        return {column: row.get(column) for column in write.fields}
+
+    def apply(
+        self,
+        write: JournaledWrite,
+        args: list,
+        created_id: int = None,
+        extra: dict = {},
+    ):
+        """
+        Makes a write to the stored rows, giving a created row created_id along with the
+        columns in extra
+        """
+        rows = self.rows(write, args)
+        if write.action == "create":
+            rows.append(
+                {
+                    ROW_KINDS[write.kind].id_column: created_id,
+                    **write.target(args),
+                    **extra,
+                }
+            )
+            if write.kind == "list":
+                # a new list has no items yet
+                self.results[("get_ingredients_for_list", (created_id,))] = []
+            return
+
+        row = self.find(write, args)
+        if row is None:
+            return
+        if write.action == "update":
+            row.update(write.target(args))
+            return
+
+        rows.remove(row)
+        if write.kind == "list":
+            # the list's items went with it
+            self.results.pop(("get_ingredients_for_list", (args[write.id_arg],)), None)
+
+
+class OfflineTransaction:
+    """
+    Calls made in a transaction while offline. There is no rollback offline, so each
+    write is journaled as soon as it is made
+    """
+
+    def __init__(self, db: "OfflineDatabase"):
+        self.db = db
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        return self.db.callproc(proc_name, args)
+
+    def callproc_many(self, proc_name: str, arg_rows: list[list]):
+        for args in arg_rows:
+            self.db.callproc(proc_name, args)
+
+
+class OfflineDatabase:
+    """
+    Stands in for the database while the server cannot be reached, offering the same
+    methods as ConnectionPool. Reads are served from the user's snapshot and the writes
+    in JOURNALED_WRITES are appended to the journal and made to the snapshot, so they
+    show up in later reads straight away. Anything else fails with an OfflineError
+    """
+
+    def __init__(self, snapshot: Snapshot, journal: Journal):
+        self.snapshot = snapshot
+        self.journal = journal
+        self.store = RowStore(snapshot.user_id, self._missing, snapshot.results)
+
+        # bring the snapshot up to date with what was written in earlier offline sessions
+        for entry in journal.pending():
+            write = JOURNALED_WRITES[entry["proc"]]
+            self.store.apply(
+                write,
+                entry["args"],
+                entry["id"],
+                self._extra(entry["proc"], entry["args"]),
+            )
+
+    def _missing(self, proc_name: str, args: list):
+        raise OfflineError(
+            CONNECTION_ERROR_CODE, f"{proc_name} is not available offline"
+        )
+
+    def _extra(self, proc_name: str, args: list) -> dict[str,]:
+        # columns of a created row that come from elsewhere than its arguments
+        if proc_name == "create_list":
+            return {"date_created": date.today().isoformat()}
+        if proc_name == "create_list_item":
+            return {"name": self._ingredient_name(args[0]), "completed": 0}
+        return {}
+
+    def _ingredient_name(self, ingredient_id: int) -> str | None:
+        ingredients = self.snapshot.results.get(
+            ("get_all_ingredients_for_user", (self.snapshot.user_id,)), []
+        )
+        return next(
+            (
+                row.get("name")
+                for row in ingredients
+                if row.get("ingredient_id") == ingredient_id
+            ),
+            None,
+        )
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        if is_mutating(proc_name):
+            return self._write(proc_name, args)
+
+        rows = self.snapshot.results.get((proc_name, tuple(args)))
+        if rows is None:
+            self._missing(proc_name, args)
+        return tuple(dict(row) for row in rows)
+
+    def _write(self, proc_name: str, args: list) -> tuple[dict[str,], ...]:
+        write = JOURNALED_WRITES.get(proc_name)
+        if write is None:
+            self._missing(proc_name, args)
+
+        # fail the way the server would
+        existing = self.store.find(write, args)
+        if write.action == "create" and existing is not None:
+            raise pymysql.err.IntegrityError(DUPLICATE_CODE, "Duplicate entry")
+        if write.action != "create" and existing is None:
+            raise pymysql.err.IntegrityError(NOT_FOUND_CODE, "No matching row")
+        if proc_name == "create_list_item" and self._ingredient_name(args[0]) is None:
+            raise pymysql.err.IntegrityError(NOT_FOUND_CODE, "No such ingredient")
+
+        created_id = self.journal.next_id() if write.action == "create" else None
+        self.journal.append(proc_name, args, self.store.state(write, args), created_id)
+        self.store.apply(write, args, created_id, self._extra(proc_name, args))
+
+        if created_id is None:
+            return ()
+        return ({ROW_KINDS[write.kind].id_column: created_id},)
+
+    def callproc_tuples(
+        self, proc_name: str, args: list = []
+    ) -> tuple[dict[str, int], tuple[tuple, ...]]:
+        rows = self.callproc(proc_name, args)
+        columns = {column: i for i, column in enumerate(rows[0])} if rows else {}
+        # rows created offline may hold their columns in another order
+        return columns, tuple(
+            tuple(row.get(column) for column in columns) for row in rows
+        )
+
+    def execute(self, query: str, args: list = []) -> tuple[dict[str,], ...]:
+        raise OfflineError(CONNECTION_ERROR_CODE, "Queries are not available offline")
+
+    @contextmanager
+    def stream(self, proc_name: str, args: list = []):
+        yield iter(self.callproc(proc_name, args))
+
+    @contextmanager
+    def transaction(self):
+        yield OfflineTransaction(self)
+
+    def close(self):
+        pass
+
+
+class ReplayReport(NamedTuple):
+    applied: int
+    skipped: int
+    conflicts: list[tuple[dict[str,], str]]
+
+    def __str__(self) -> str:
+        return (
+            f"Synced {self.applied} change(s) made offline, {self.skipped} already "
+            f"made and {len(self.conflicts)} conflicting"
+        )
+
+
+def _resolve(write: JournaledWrite, args: list, id_map: dict[int, int]) -> list | None:
+    """
+    Returns the arguments with any IDs given out offline swapped for the server's, or
+    None if a row they refer to was never created on the server
+    """
+    args = list(args)
+    for i in (write.id_arg, write.parent_arg):
+        if i is not None and isinstance(args[i], int) and args[i] < 0:
+            if args[i] not in id_map:
+                return None
+            args[i] = id_map[args[i]]
+    return args
+
+
+def _replay_batch(tx, entries: list[dict[str,]], user_id: int, id_map: dict[int, int]):
+    """
+    Replays journaled writes in a transaction, checking each against the server's rows
+    first. A write is skipped if the server already has its result, and is a conflict
+    if the row it changes was changed on the server since the snapshot was taken (or
+    no longer exists). Consecutive writes to the same procedure are sent together.
+    Returns the numbers applied and skipped and the conflicts
+    """
+    queued = []
+
+    def flush():
+        while queued:
+            proc_name = queued[0][0]
+            count = next(
+                (i for i, (name, _) in enumerate(queued) if name != proc_name),
+                len(queued),
+            )
+            tx.callproc_many(proc_name, [args for _, args in queued[:count]])
+            del queued[:count]
+
+    def fetch(proc_name: str, args: list):
+        # reads have to see the writes before them
+        flush()
+        return tx.callproc(proc_name, args)
+
+    store = RowStore(user_id, fetch)
+    applied = skipped = 0
+    conflicts = []
+
+    for entry in entries:
+        write = JOURNALED_WRITES[entry["proc"]]
+        args = _resolve(write, entry["args"], id_map)
+        if args is None:
+            conflicts.append((entry, "the row it belongs to was not created"))
+            continue
+
+        now = store.state(write, args)
+        if now == write.target(args):
+            skipped += 1
+            if write.action == "create":
+                id_column = ROW_KINDS[write.kind].id_column
+                id_map[entry["id"]] = store.find(write, args)[id_column]
+            continue
+
+        if write.action == "update" and now is None:
+            conflicts.append((entry, "it no longer exists on the server"))
+            continue
+        if write.action == "update" and now != entry["before"]:
+            conflicts.append((entry, f"it was changed on the server to {now}"))
+            continue
+
+        if write.action == "create":
+            flush()
+            id_column = ROW_KINDS[write.kind].id_column
+            rows = tx.callproc(entry["proc"], args)
+            if rows:
+                store.apply(write, args, rows[0][id_column])
+            else:
+                # the procedure does not return the new ID, so it is read back
+                store.forget(write, args)
+            id_map[entry["id"]] = store.find(write, args)[id_column]
+        else:
+            queued.append((entry["proc"], args))
+            store.apply(write, args)
+        applied += 1
+
+    flush()
+    return applied, skipped, conflicts
+
+
+def replay(
+    db, journal: Journal, user_id: int, batch_size: int = REPLAY_BATCH_SIZE
+) -> ReplayReport:
+    """
+    Replays the journal's pending writes on the server in transactions of batch_size
+    writes, recording each committed batch in the journal so nothing is replayed twice.
+    A batch the server rejects is replayed again a write at a time, so only the
+    writes that fail are lost, as conflicts. Stops at the first connection error,
+    leaving the rest for next time
+    """
+    applied = skipped = 0
+    conflicts = []
+    id_map = {}
+    pending = journal.pending()
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start : start + batch_size]
+        attempts = [batch]
+        while attempts:
+            entries = attempts.pop(0)
+            batch_ids = dict(id_map)
+            try:
+                with db.transaction() as tx:
+                    outcome = _replay_batch(tx, entries, user_id, batch_ids)
+            except pymysql.err.OperationalError:
+                raise
+            except pymysql.err.DatabaseError as e:
+                if len(entries) > 1:
+                    attempts = [[entry] for entry in entries] + attempts
+                else:
+                    conflicts.append((entries[0], f"the server rejected it: {e}"))
+                continue
+
+            id_map = batch_ids
+            applied += outcome[0]
+            skipped += outcome[1]
+            conflicts.extend(outcome[2])
+
+        journal.mark_applied(batch[-1]["seq"])
+
+    journal.compact()
+    return ReplayReport(applied, skipped, conflicts)
+
+
+def log_conflicts(path: str, conflicts: list[tuple[dict[str,], str]]):
+    """
+    Appends the writes that could not be replayed, with why, to the conflict log
+    """
+    if not conflicts:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for entry, reason in conflicts:
+            _fsync_line(f, {**entry, "conflict": reason})
@@ -0,0 +1,220 @@
+import json
+import os
+
+from cache import changed_sections
+from helpers import call_proc_grouped
+from search import INDEX_DIR
+
+# Bump when the saved format changes, so old indexes are rebuilt instead of read
+PANTRY_VERSION = 2
+
+
+class PantryIndex:
+    """
+    Stores the ingredients of each of a user's recipes as a bitset, one bit per
+    ingredient, so finding the recipes that can be made from a set of ingredients takes
+    a couple of integer operations per recipe instead of a query per recipe. Every mask
+    is as wide as the number of distinct ingredients the user's recipes have used, so
+    each operation costs a word for every 64 of them
+    """
+
+    def __init__(self):
+        # ingredient ID -> bit position
+        self.bits = {}
+        # recipe ID -> ingredient mask
+        self.recipes = {}
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def __contains__(self, recipe_id: int):
+        return recipe_id in self.recipes
+
+    def mask(self, ingredient_ids) -> int:
+        """
+        Returns the bitset of the given ingredients, giving new ingredients the next
+        free bit
+        """
+        mask = 0
+        for ingredient_id in ingredient_ids:
+            bit = self.bits.get(ingredient_id)
+            if bit is None:
+                bit = self.bits[ingredient_id] = len(self.bits)
+            mask |= 1 << bit
+        return mask
+
+    def ingredients(self, mask: int) -> list[int]:
+        """
+        Returns the IDs of the ingredients in a bitset
+        """
+        return [
+            ingredient_id for ingredient_id, bit in self.bits.items() if mask >> bit & 1
+        ]
+
+    def add(self, recipe_id: int, ingredient_ids) -> bool:
+        """
+        Indexes a recipe's ingredients, replacing what was indexed for it before.
+        Returns whether that changed anything
+        """
+        mask = self.mask(ingredient_ids)
+        if self.recipes.get(recipe_id) == mask:
+            return False
+        self.recipes[recipe_id] = mask
+        return True
+
+    def discard(self, recipe_id: int):
+        self.recipes.pop(recipe_id, None)
+
+    def drop_ingredient(self, ingredient_id: int):
+        """
+        Takes a deleted ingredient out of every recipe. Its bit is left unused rather
+        than renumbering every mask
+        """
+        bit = self.bits.get(ingredient_id)
+        if bit is None:
+            return
+
+        keep = ~(1 << bit)
+        for recipe_id, mask in self.recipes.items():
+            self.recipes[recipe_id] = mask & keep
+
+    def cookable(self, have_ids, max_missing: int = 0) -> list[tuple[int, int, int]]:
+        """
+        Returns (recipe ID, number missing, missing ingredient mask) for every recipe
+        missing at most max_missing of its ingredients from have_ids, fewest missing
+        first
+        """
+        # ingredients that were never indexed are in no recipe, so they can be ignored
+        have = 0
+        for ingredient_id in have_ids:
+            bit = self.bits.get(ingredient_id)
+            if bit is not None:
+                have |= 1 << bit
+        lacking = ~have
+
+        matches = []
+        for recipe_id, mask in self.recipes.items():
+            missing = mask & lacking
+            count = missing.bit_count()
+            if count <= max_missing:
+                matches.append((recipe_id, count, missing))
+
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        saved = {
+            "version": PANTRY_VERSION,
+            "bits": list(self.bits.items()),
+            # masks are written in hex since they can be wider than JSON numbers allow
+            "recipes": [
+                [recipe_id, format(mask, "x")]
+                for recipe_id, mask in self.recipes.items()
+            ],
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PantryIndex":
+        """
+        Reads a saved index, returning an empty one if there is none or it is unusable
+        """
+        index = cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return index
+
+        if saved.get("version") != PANTRY_VERSION:
+            return index
+
+        index.bits = {ingredient_id: bit for ingredient_id, bit in saved["bits"]}
+        index.recipes = {
+            recipe_id: int(mask, 16) for recipe_id, mask in saved["recipes"]
+        }
+        return index
+
+
+def pantry_path(db_key: str, user_id: int) -> str:
+    """
+    Returns where a user's pantry index is saved, naming the database like index_path
+    """
+    return os.path.join(INDEX_DIR, f"pantry-{db_key}-{user_id}.json")
+
+
+def sync_pantry(index: PantryIndex, db, user_id: int, recipes: dict) -> int:
+    """
+    Brings the index up to date with a user's recipes (keyed by ID), reading the
+    ingredients of every recipe in one call. A recipe's mask is compared as a whole,
+    so ingredients changed outside the recipe's edit screen are noticed too. Returns
+    how many recipes were added, reindexed or removed
+    """
+    removed = [recipe_id for recipe_id in index.recipes if recipe_id not in recipes]
+    for recipe_id in removed:
+        index.discard(recipe_id)
+
+    ingredients = call_proc_grouped(
+        db,
+        "get_recipe_ingredients_for_user",
+        [user_id],
+        "recipe_id",
+        "get_ingredients_for_recipe",
+    )
+    changed = 0
+    for recipe_id in recipes:
+        ids = [row.get("ingredient_id") for row in ingredients[recipe_id]]
+        changed += index.add(recipe_id, ids)
+
+    return len(removed) + changed
+
+
+def user_pantry(state) -> PantryIndex:
+    """
+    Returns the session's pantry index, loading the user's saved one the first time
+    """
+    if state.pantry_index is None:
+        state.pantry_index = PantryIndex.load(pantry_path(state.db_key, state.user_id))
+    return state.pantry_index
+
+
+def synced_pantry(state, db, recipes: dict) -> PantryIndex:
+    """
+    Returns the session's pantry index, synced with the user's recipes (keyed by ID)
+    the first time it is needed in a session and afterwards only once the writes
+    counted in state.written have changed recipes
+    """
+    index = user_pantry(state)
+    if state.pantry_synced is None or "recipes" in changed_sections(
+        state.written - state.pantry_synced
+    ):
+        synced = state.written.copy()
+        if sync_pantry(index, db, state.user_id, recipes):
+            index.save(pantry_path(state.db_key, state.user_id))
+        state.pantry_synced = synced
+    return index
+
+
+def forget_pantry_recipe(state, recipe_id: int):
+    """
+    Drops a recipe that was edited or deleted from the user's pantry index, so it is
+    reindexed (or left out) the next time the index is synced
+    """
+    index = user_pantry(state)
+    if recipe_id in index:
+        index.discard(recipe_id)
+        index.save(pantry_path(state.db_key, state.user_id))
+
+
+def forget_pantry_ingredient(state, ingredient_id: int):
+    """
+    Takes a deleted ingredient out of the recipes in the user's pantry index
+    """
+    index = user_pantry(state)
+    if ingredient_id in index.bits:
+        index.drop_ingredient(ingredient_id)
+        index.save(pantry_path(state.db_key, state.user_id))
@@ -0,0 +1,373 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+import pymysql
+from pymysql import cursors
+
+from cache import is_mutating
+from helpers import MISSING_PROC_CODE
+
+# Error codes from the MySQL client for a connection that has gone away, used to
+# decide when a call should be retried on a fresh connection
+SERVER_GONE_CODE = 2006
+SERVER_LOST_CODE = 2013
+CONNECTION_LOST_CODES = (SERVER_GONE_CODE, SERVER_LOST_CODE)
+
+# Procedures adding many rows in one call, each taking a JSON array of the argument
+# lists of the procedure adding one row. Older dumps without them are called row by row
+BATCH_PROCS = {
+    "add_ingredient_to_recipe": "add_ingredients_to_recipe",
+    "add_recipe_to_category": "add_recipe_to_categories",
+    "create_list_item": "create_list_items",
+}
+
+
+class PoolTimeout(pymysql.err.OperationalError):
+    """
+    Raised when no connection could be checked out of the pool in time
+    """
+
+
+def mysql_factory(**connect_args) -> Callable[[], pymysql.connections.Connection]:
+    """
+    Returns a function that opens a new connection to the MySQL server with the given
+    arguments, for use as the factory of a ConnectionPool
+    """
+
+    connect_args.setdefault("host", "localhost")
+    connect_args.setdefault("db", "recipemaster")
+    connect_args.setdefault("charset", "utf8mb4")
+    # connections are shared between callers, so a write must never be left sitting in
+    # an open transaction when a connection goes back into the pool
+    connect_args.setdefault("autocommit", True)
+
+    def connect():
+        return pymysql.connect(**connect_args)
+
+    return connect
+
+
+class Transaction:
+    """
+    Stored procedure calls made on a single connection inside one database transaction
+    """
+
+    def __init__(self, cur: cursors.DictCursor, missing_procs: set[str] = None):
+        self.cur = cur
+        # batch procedures the server turned out not to have
+        self.missing_procs = set() if missing_procs is None else missing_procs
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        """
+        Calls a stored procedure within the transaction and returns its rows
+        """
+        self.cur.callproc(proc_name, args)
+        return self.cur.fetchall()
+
+    def callproc_many(self, proc_name: str, arg_rows: list[list]):
+        """
+        Calls a stored procedure once for each list of arguments, stopping at the first
+        call that fails. Any rows returned are discarded. Procedures in BATCH_PROCS are
+        sent every row in one call instead. Anything else is one statement per row:
+        sending them joined together would need multi-statement support on the
+        connection, which lets any query built from strings smuggle in another
+        """
+        if not arg_rows:
+            return
+
+        batch_proc = BATCH_PROCS.get(proc_name)
+        if batch_proc is not None and batch_proc not in self.missing_procs:
+            try:
+                self.cur.callproc(batch_proc, [json.dumps(arg_rows)])
+                self.cur.fetchall()
+                return
+            except pymysql.err.DatabaseError as e:
+                if not e.args or e.args[0] != MISSING_PROC_CODE:
+                    raise
+                self.missing_procs.add(batch_proc)
+
+        for args in arg_rows:
+            self.cur.callproc(proc_name, args)
+            self.cur.fetchall()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of database connections. Connections are created on demand by the
+    factory up to max_size, health-checked when they are checked out, closed after sitting
+    idle for longer than idle_timeout seconds and replaced if they are found to be broken
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], pymysql.connections.Connection],
+        max_size: int = 4,
+        idle_timeout: float = 300.0,
+        ping_interval: float = 30.0,
+        checkout_timeout: float = 30.0,
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # connections used more recently than this are trusted without a ping
+        self.ping_interval = ping_interval
+        self.checkout_timeout = checkout_timeout
+
+        # idle connections as (connection, time last returned) pairs, most recent last
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # batch procedures the server turned out not to have, see Transaction
+        self._missing_procs = set()
+
+    def acquire(self, timeout: float = None) -> pymysql.connections.Connection:
+        """
+        Checks a healthy connection out of the pool, opening a new one if none are idle
+        and the pool is not full, otherwise waiting up to timeout seconds for one
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise pymysql.err.InterfaceError("Connection pool is closed")
+
+                self._reap_locked()
+
+                if self._idle:
+                    cnx, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    # reserve the slot now so other threads cannot overfill the pool
+                    # while the connection is being opened
+                    self._size += 1
+                    cnx, last_used = None, None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"No database connection available after {timeout}s"
+                        )
+                    self._cond.wait(remaining)
+                    continue
+
+            if cnx is None:
+                try:
+                    return self.factory()
+                except Exception:
+                    self._discard_slot()
+                    raise
+
+            if time.monotonic() - last_used < self.ping_interval:
+                return cnx
+
+            try:
+                cnx.ping(reconnect=True)
+                return cnx
+            except pymysql.err.Error:
+                # the connection is dead and could not be revived, drop it and try again
+                self.discard(cnx)
+
+    def release(self, cnx: pymysql.connections.Connection):
+        """
+        Returns a connection that was checked out back to the pool
+        """
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                _close_quietly(cnx)
+                return
+
+            self._idle.append((cnx, time.monotonic()))
+            self._cond.notify()
+
+    def discard(self, cnx: pymysql.connections.Connection):
+        """
+        Closes a checked out connection that is broken instead of returning it to the pool
+        """
+        _close_quietly(cnx)
+        self._discard_slot()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the duration of a with block. If the block fails
+        because the connection was lost, the connection is discarded instead of reused
+        """
+        cnx = self.acquire()
+        try:
+            yield cnx
+        except pymysql.err.OperationalError as e:
+            if e.args and e.args[0] in CONNECTION_LOST_CODES:
+                self.discard(cnx)
+            else:
+                self.release(cnx)
+            raise
+        except BaseException:
+            self.release(cnx)
+            raise
+        else:
+            self.release(cnx)
+
+    def run(
+        self,
+        work: Callable[[cursors.Cursor], tuple],
+        cursor_class: type = cursors.DictCursor,
+        retry: bool = True,
+    ) -> tuple:
+        """
+        Runs work with a cursor (a dictionary cursor unless told otherwise) on a pooled
+        connection and returns its result. If the connection turns out to have been lost
+        and retry is set, work is retried once on a fresh one. Writes must not be
+        retried: the connection may have been lost after the server made the write
+        """
+        for attempt in range(2):
+            try:
+                with self.connection() as cnx:
+                    with cnx.cursor(cursor_class) as cur:
+                        return work(cur)
+            except pymysql.err.OperationalError as e:
+                if (
+                    attempt
+                    or not retry
+                    or not e.args
+                    or e.args[0] not in CONNECTION_LOST_CODES
+                ):
+                    raise
+
+    def callproc(self, proc_name: str, args: list = []) -> tuple[dict[str,], ...]:
+        """
+        Calls a stored procedure on a pooled connection and returns its rows. Only
+        reads are retried if the connection is lost
+        """
+
+        def work(cur):
+            cur.callproc(proc_name, args)
+            return cur.fetchall()
+
+        return self.run(work, retry=not is_mutating(proc_name))
+
+    def callproc_tuples(
+        self, proc_name: str, args: list = []
+    ) -> tuple[dict[str, int], tuple[tuple, ...]]:
+        """
+        Calls a stored procedure on a pooled connection and returns its rows as plain
+        tuples, along with a map of each column name to its position in the rows
+        """
+
+        def work(cur):
+            cur.callproc(proc_name, args)
+            rows = cur.fetchall()
+            columns = {col[0]: i for i, col in enumerate(cur.description or ())}
+            return columns, rows
+
+        return self.run(work, cursors.Cursor, retry=not is_mutating(proc_name))
+
+    def execute(self, query: str, args: list = []) -> tuple[dict[str,], ...]:
+        """
+        Executes a single query on a pooled connection and returns its rows. A query
+        could write anything, so it is never retried
+        """
+
+        def work(cur):
+            cur.execute(query, args)
+            return cur.fetchall()
+
+        return self.run(work, retry=False)
+
+    @contextmanager
+    def stream(self, proc_name: str, args: list = []):
+        """
+        Calls a stored procedure on an unbuffered cursor and yields an iterator over its
+        rows, which are read from the server only as they are consumed. The connection is
+        held until the with block ends; if the rows were not all read by then it is closed
+        rather than made to download the rest of the result
+        """
+        cnx = self.acquire()
+        cur = cnx.cursor(cursors.SSDictCursor)
+        finished = False
+
+        def rows():
+            nonlocal finished
+            yield from iter(cur.fetchone, None)
+            finished = True
+
+        try:
+            cur.callproc(proc_name, args)
+            yield rows()
+        except BaseException:
+            self.discard(cnx)
+            raise
+
+        if not finished:
+            self.discard(cnx)
+            return
+
+        try:
+            cur.close()
+        except pymysql.err.Error:
+            self.discard(cnx)
+            return
+        self.release(cnx)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Checks out a connection and yields a Transaction on it, committing when the with
+        block finishes and rolling back if it raises
+        """
+        with self.connection() as cnx:
+            cnx.begin()
+            try:
+                with cnx.cursor(cursors.DictCursor) as cur:
+                    yield Transaction(cur, self._missing_procs)
+            except BaseException:
+                cnx.rollback()
+                raise
+            cnx.commit()
+
+    def reap_idle(self):
+        """
+        Closes connections that have been idle for longer than the idle timeout
+        """
+        with self._cond:
+            self._reap_locked()
+
+    def close(self):
+        """
+        Closes every idle connection and stops handing out new ones. Connections that
+        are still checked out are closed as they are released
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                cnx, _ = self._idle.popleft()
+                self._size -= 1
+                _close_quietly(cnx)
+            self._cond.notify_all()
+
+    def _reap_locked(self):
+        # the oldest connections sit at the left of the deque
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            cnx, _ = self._idle.popleft()
+            self._size -= 1
+            _close_quietly(cnx)
+
+    def _discard_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+def _close_quietly(cnx: pymysql.connections.Connection):
+    try:
+        cnx.close()
+    except pymysql.err.Error:
+        pass
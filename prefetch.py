@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import CachedDatabase
+
+# Number of background threads reading ahead, each holding one pooled connection while
+# it reads
+PREFETCH_WORKERS = 2
+
+# Most recipes read ahead for any one table of recipes shown
+PREFETCH_LIMIT = 25
+
+# What opening or editing a recipe reads, so it is what gets read ahead
+RECIPE_DETAIL_PROCS = ("get_ingredients_for_recipe", "get_categories_for_recipe")
+
+# The user's catalog as the menus read it, read ahead right after logging in
+CATALOG_PROCS = (
+    "get_all_recipes_for_user",
+    "get_all_ingredients_for_user",
+    "get_all_categories_for_user",
+    "get_all_lists_for_user",
+)
+
+
+class Prefetcher:
+    """
+    Reads the details of recipes the user is likely to open next into the result cache
+    on background threads, while the user is still deciding. Anything not read by the
+    time it is needed is simply read as usual
+    """
+
+    def __init__(self, db: CachedDatabase, workers: int = PREFETCH_WORKERS):
+        self.db = db
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self.pending = []
+
+    def recipes(self, recipe_ids, limit: int = PREFETCH_LIMIT):
+        """
+        Starts reading the details of the given recipes, newest (highest ID) first,
+        dropping whatever was queued for the previous table that has not started yet
+        """
+        self.cancel()
+        for recipe_id in sorted(recipe_ids, reverse=True)[:limit]:
+            self.pending.append(self.executor.submit(self._warm_recipe, recipe_id))
+
+    def catalog(self, user_id: int):
+        """
+        Starts reading the user's recipes, ingredients, categories and lists, so the first menu
+        opened after logging in does not wait on them
+        """
+        for proc_name in CATALOG_PROCS:
+            self.pending.append(
+                self.executor.submit(self._warm, proc_name, [user_id], "tuples")
+            )
+
+    def cancel(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending = []
+
+    def close(self):
+        self.cancel()
+        self.executor.shutdown(wait=True)
+
+    def _warm(self, proc_name: str, args: list, kind: str = "dict"):
+        try:
+            self.db.warm(proc_name, args, kind)
+        except Exception:
+            # only a guess at what is needed next, the real read reports any errors
+            pass
+
+    def _warm_recipe(self, recipe_id: int):
+        for proc_name in RECIPE_DETAIL_PROCS:
+            self._warm(proc_name, [recipe_id])
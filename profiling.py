@@ -0,0 +1,166 @@
+import os
+import time
+from datetime import datetime
+
+# cProfile and pstats are slow to import, so they are only imported once profiling has
+# been turned on
+
+# Setting RECIPEMASTER_PROFILE to 1 profiles every screen shown, each one's profile kept
+# separately under the name of the screen's function
+PROFILE_ENV = "RECIPEMASTER_PROFILE"
+
+# Where each session's profiles are written, one directory per session
+PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".recipemaster", "profiles")
+
+# Number of functions listed in the report printed at the end of a session
+PROFILE_TOP_N = 20
+
+# Functions that only wait for the user to type, left out of the report since their
+# time says nothing about how slow the app is
+USER_WAIT_FUNCTIONS = {"<built-in method builtins.input>", "getpass", "unix_getpass"}
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+
+def screen_name(screen) -> str:
+    """
+    Returns the name a screen is profiled under, that of its function for a screen
+    given with partial
+    """
+    return getattr(getattr(screen, "func", screen), "__name__", repr(screen))
+
+
+def function_name(key: tuple[str, int, str]) -> str:
+    filename, line, name = key
+    if filename == "~":
+        # built-in functions have no file
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class ScreenProfiler:
+    """
+    Runs screens under cProfile, keeping a separate profile for every screen function so
+    time can be told apart by menu action. Profiles only the thread showing the screens,
+    so background reads are seen only as the time spent waiting on them
+    """
+
+    def __init__(self, directory: str = None):
+        if directory is None:
+            directory = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S}")
+        self.directory = directory
+        # screen name -> its profile
+        self.profiles = {}
+        # screen name -> [times shown, seconds spent]
+        self.timings = {}
+
+    def run(self, screen, state):
+        """
+        Shows a screen while profiling it, returning the next screen
+        """
+        name = screen_name(screen)
+        profile = self.profiles.get(name)
+        if profile is None:
+            import cProfile
+
+            profile = self.profiles[name] = cProfile.Profile()
+
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            return screen(state)
+        finally:
+            profile.disable()
+            timing = self.timings.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += time.perf_counter() - started
+
+    def save(self) -> str:
+        """
+        Writes each screen's profile to <screen>.prof in the session's directory, along
+        with all of them combined in all.prof, and returns the directory. Each can be
+        read with pstats or a viewer such as snakeviz
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+
+        combined = self.combined()
+        if combined is not None:
+            combined.dump_stats(os.path.join(self.directory, "all.prof"))
+        return self.directory
+
+    def combined(self):
+        """
+        Returns every screen's profile combined into one pstats.Stats, or None if no
+        screens were shown
+        """
+        import pstats
+
+        stats = None
+        for profile in self.profiles.values():
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def screen_report(self) -> tuple[list[str], list[tuple]]:
+        """
+        Returns the fields and rows of a table of the time spent in each screen, most
+        first, for print_table. The working time leaves out waiting for the user
+        """
+        import pstats
+
+        entries = []
+        for name, (shown, seconds) in self.timings.items():
+            waiting = sum(
+                cumulative
+                for key, (_, _, _, cumulative, _) in pstats.Stats(
+                    self.profiles[name]
+                ).stats.items()
+                if key[2] in USER_WAIT_FUNCTIONS
+            )
+            entries.append((seconds - waiting, shown, seconds, name))
+
+        rows = [
+            (
+                name,
+                shown,
+                f"{seconds:.3f}",
+                f"{working:.3f}",
+                f"{working / shown * 1000:.1f}",
+            )
+            for working, shown, seconds, name in sorted(entries, reverse=True)
+        ]
+        return ["Screen", "Shown", "Total s", "Working s", "Working ms each"], rows
+
+    def hot_functions(self, n: int = PROFILE_TOP_N) -> tuple[list[str], list[tuple]]:
+        """
+        Returns the fields and rows of a table of the n functions that took the most
+        time themselves across every screen, for print_table
+        """
+        combined = self.combined()
+        entries = []
+        if combined is not None:
+            for key, (_, calls, own, cumulative, _) in combined.stats.items():
+                if key[2] in USER_WAIT_FUNCTIONS:
+                    continue
+                entries.append((own, calls, cumulative, function_name(key)))
+
+        rows = [
+            (name, calls, f"{own * 1000:.1f}", f"{cumulative * 1000:.1f}")
+            for own, calls, cumulative, name in sorted(entries, reverse=True)[:n]
+        ]
+        return ["Function", "Calls", "Own ms", "Cumulative ms"], rows
+
+
+def screen_profiler() -> ScreenProfiler | None:
+    """
+    Returns a ScreenProfiler if profiling is enabled, otherwise None
+    """
+    if not profiling_enabled():
+        return None
+    return ScreenProfiler()
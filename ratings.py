@@ -0,0 +1,489 @@
+import json
+import os
+import time
+from datetime import date, datetime
+
+from pymysql import DatabaseError
+
+from helpers import MISSING_PROC_CODE
+from leaderboard import Leaderboard, bayesian_average, decay_weight
+from search import INDEX_DIR
+
+# Ratings go from 0 to this
+RATING_SCALE = 10
+
+# Seconds the aggregates are trusted for before the reviews written since are read, to
+# pick up the reviews other users have written in the meantime
+RATINGS_MAX_AGE = 600
+
+# Seconds after which the aggregates are rebuilt from every review, to pick up the
+# reviews other users have re-rated or deleted, which reading new reviews cannot see
+RATINGS_REBUILD_AGE = 24 * 60 * 60
+
+# Bump when the saved format changes, so old aggregates are rebuilt instead of read
+RATINGS_VERSION = 2
+
+
+def clamp_rating(rating) -> int:
+    """
+    Returns a rating as a whole number on the rating scale, so a bad rating in the
+    database cannot skew or break the statistics
+    """
+    return min(max(int(rating or 0), 0), RATING_SCALE)
+
+
+class RatingStats:
+    """
+    The number, total and distribution of the ratings a recipe has been given
+    """
+
+    __slots__ = ("count", "total", "histogram", "trend")
+
+    def __init__(
+        self,
+        count: int = 0,
+        total: int = 0,
+        histogram: list[int] = None,
+        trend: float = 0.0,
+    ):
+        self.count = count
+        self.total = total
+        # histogram[r] is the number of reviews rating the recipe r
+        self.histogram = histogram or [0] * (RATING_SCALE + 1)
+        # ratings out of 1 weighted by how recent their reviews are, see decay_weight
+        self.trend = trend
+
+    def state(self) -> list:
+        """
+        Returns what the constructor takes to make these statistics again
+        """
+        return [self.count, self.total, self.histogram, self.trend]
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def add(self, rating: int, weight: float = 1.0):
+        rating = clamp_rating(rating)
+        self.count += 1
+        self.total += rating
+        self.histogram[rating] += 1
+        self.trend += rating / RATING_SCALE * weight
+
+    def remove(self, rating: int, weight: float = 1.0):
+        rating = clamp_rating(rating)
+        self.count -= 1
+        self.total -= rating
+        self.histogram[rating] -= 1
+        self.trend -= rating / RATING_SCALE * weight
+
+    def __str__(self):
+        if not self.count:
+            return "No reviews yet"
+        return f"{self.mean:.1f}/{RATING_SCALE} from {self.count} review(s)"
+
+
+class RatingAggregates:
+    """
+    Rating statistics for every reviewed recipe, built with one pass over every review
+    and then kept up to date as reviews are created, re-rated and deleted, so reading a
+    recipe's statistics never touches the reviews themselves. The aggregates are saved
+    between sessions and brought up to date by reading only the reviews written since.
+    Recipes are keyed by ID, or by name when the database cannot say which recipe a
+    review is of (see review_key).
+
+    The recipes are also kept ranked by their Bayesian average rating and by how much
+    they are trending, each change moving only the recipe it affects
+    """
+
+    def __init__(self):
+        # recipe key -> stats
+        self.recipes = {}
+        # recipe key -> recipe name, for showing the ranked recipes
+        self.names = {}
+        # review ID -> (recipe key, rating, decay weight), to know what an update or
+        # delete replaces
+        self.reviews = {}
+        # highest review ID read from the database, reviews after it are new
+        self.last_review_id = 0
+        # whether reviews are keyed by recipe name since they have no recipe ID
+        self.by_name = False
+        # whether any review read had no date, leaving nothing to tell what is trending
+        self.undated = False
+        # when every review was last read (a timestamp, since it is saved), and when
+        # the new ones were last read in this session
+        self.built_at = None
+        self.checked_at = None
+        self.best = Leaderboard()
+        self.trending = Leaderboard()
+        # mean of every rating when the aggregates were built, which ratings are pulled
+        # towards. It is fixed between rebuilds so one review never reranks every recipe
+        self.prior_mean = RATING_SCALE / 2
+        # time decay weights are measured from
+        self.epoch = time.time()
+        self._ranking = True
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return (
+            self.built_at is None or time.time() - self.built_at > RATINGS_REBUILD_AGE
+        )
+
+    @property
+    def is_stale(self) -> bool:
+        return (
+            self.checked_at is None
+            or time.monotonic() - self.checked_at > RATINGS_MAX_AGE
+        )
+
+    def mark_stale(self):
+        """
+        Makes the next read rebuild the aggregates, for changes that cannot be applied
+        one review at a time
+        """
+        self.built_at = None
+
+    def rebuild(self, db):
+        """
+        Recomputes every recipe's statistics, streaming the reviews rather than loading
+        them all at once
+        """
+        self.recipes = {}
+        self.names = {}
+        self.reviews = {}
+        self.last_review_id = 0
+        self.by_name = False
+        self.undated = False
+        self.best = Leaderboard()
+        self.trending = Leaderboard()
+        self.epoch = time.time()
+
+        # rank once at the end, when the prior is known, rather than after every review
+        self._ranking = False
+        try:
+            self.catch_up(db)
+        finally:
+            self._ranking = True
+
+        count = sum(stats.count for stats in self.recipes.values())
+        total = sum(stats.total for stats in self.recipes.values())
+        self.prior_mean = total / count if count else RATING_SCALE / 2
+        self._rank_all()
+
+        self.built_at = time.time()
+
+    def catch_up(self, db) -> int:
+        """
+        Adds the reviews written since the last ones read, returning how many there were
+        """
+        added = 0
+        for row in _reviews_after(db, self.last_review_id):
+            review_id = row.get("review_id")
+            created = review_timestamp(row.get("date_created"))
+            if created is None:
+                self.undated = True
+            self.review_created(
+                review_id,
+                self.review_key(row),
+                row.get("recipe_name"),
+                row.get("rating"),
+                created,
+            )
+            self.last_review_id = max(self.last_review_id, review_id)
+            added += 1
+
+        self.checked_at = time.monotonic()
+        return added
+
+    def review_key(self, row: dict[str,]):
+        """
+        Returns the key of the recipe a review row is of: its ID, or its name for a
+        database made from an older dump, whose reviews only name their recipe
+        """
+        recipe_id = row.get("recipe_id")
+        if recipe_id is None:
+            self.by_name = True
+            return row.get("recipe_name")
+        return recipe_id
+
+    def recipe_key(self, recipe_id: int, recipe_name: str):
+        return recipe_name if self.by_name else recipe_id
+
+    def stats(self, recipe_id: int, recipe_name: str) -> RatingStats:
+        return (
+            self.recipes.get(self.recipe_key(recipe_id, recipe_name)) or RatingStats()
+        )
+
+    def review_stats(self, review_id: int) -> RatingStats:
+        """
+        Returns the statistics of the recipe a review is of
+        """
+        review = self.reviews.get(review_id)
+        stats = self.recipes.get(review[0]) if review else None
+        return stats or RatingStats()
+
+    def best_rated(self, n: int) -> list[tuple[object, float]]:
+        """
+        Returns the keys of the n recipes with the highest Bayesian average rating,
+        with it
+        """
+        return self.best.top(n)
+
+    @property
+    def can_trend(self) -> bool:
+        """
+        Whether the reviews say when they were written. Without that every review
+        would count as new, and trending would just be every rating added up
+        """
+        return not self.undated
+
+    def top_trending(self, n: int) -> list[tuple[object, float]]:
+        """
+        Returns the keys of the n recipes most trending right now, with how much. A
+        review counts as much as its rating out of 1 when new and half as much every
+        half-life after. Nothing is trending when the reviews have no dates
+        """
+        if not self.can_trend:
+            return []
+
+        now = decay_weight(time.time(), self.epoch)
+        return [(key, score / now) for key, score in self.trending.top(n)]
+
+    def review_created(
+        self,
+        review_id: int,
+        recipe_key,
+        recipe_name: str,
+        rating: int,
+        created: float = None,
+    ):
+        """
+        Adds a review written at the created timestamp, or just now if it is None
+        """
+        if review_id in self.reviews:
+            self.review_deleted(review_id)
+
+        rating = clamp_rating(rating)
+        weight = decay_weight(created or time.time(), self.epoch)
+
+        stats = self.recipes.get(recipe_key)
+        if stats is None:
+            stats = self.recipes[recipe_key] = RatingStats()
+        stats.add(rating, weight)
+        self.names[recipe_key] = recipe_name
+        self.reviews[review_id] = (recipe_key, rating, weight)
+        self._rank(recipe_key)
+
+    def rating_updated(self, review_id: int, rating: int):
+        review = self.reviews.get(review_id)
+        if review is None:
+            return
+
+        recipe_key, old_rating, weight = review
+        rating = clamp_rating(rating)
+        stats = self.recipes[recipe_key]
+        stats.remove(old_rating, weight)
+        stats.add(rating, weight)
+        self.reviews[review_id] = (recipe_key, rating, weight)
+        self._rank(recipe_key)
+
+    def review_deleted(self, review_id: int):
+        review = self.reviews.pop(review_id, None)
+        if review is None:
+            return
+
+        recipe_key, rating, weight = review
+        stats = self.recipes[recipe_key]
+        stats.remove(rating, weight)
+        if not stats.count:
+            del self.recipes[recipe_key]
+            del self.names[recipe_key]
+        self._rank(recipe_key)
+
+    def recipe_renamed(self, recipe_id: int, name: str):
+        if self.by_name:
+            # the reviews would have to be regrouped under the new name
+            self.mark_stale()
+        elif recipe_id in self.names:
+            self.names[recipe_id] = name
+
+    def recipe_deleted(self, recipe_id: int):
+        """
+        Drops the reviews of a deleted recipe, which were deleted along with it
+        """
+        if self.by_name:
+            # another user's recipe may have the same name
+            self.mark_stale()
+            return
+
+        for review_id in [
+            review_id
+            for review_id, review in self.reviews.items()
+            if review[0] == recipe_id
+        ]:
+            self.review_deleted(review_id)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        saved = {
+            "version": RATINGS_VERSION,
+            "built_at": self.built_at,
+            "epoch": self.epoch,
+            "prior_mean": self.prior_mean,
+            "last_review_id": self.last_review_id,
+            "by_name": self.by_name,
+            "undated": self.undated,
+            # recipe keys can be IDs or names, so they are kept in lists rather than
+            # as JSON object keys, which are always strings
+            "recipes": [
+                [key, self.names[key], *self.recipes[key].state()]
+                for key in self.recipes
+            ],
+            "reviews": [
+                [review_id, *review] for review_id, review in self.reviews.items()
+            ],
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RatingAggregates":
+        """
+        Reads saved aggregates, returning empty ones to be rebuilt if there are none or
+        they are unusable
+        """
+        aggregates = cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return aggregates
+
+        if saved.get("version") != RATINGS_VERSION:
+            return aggregates
+
+        aggregates.built_at = saved["built_at"]
+        aggregates.epoch = saved["epoch"]
+        aggregates.prior_mean = saved["prior_mean"]
+        aggregates.last_review_id = saved["last_review_id"]
+        aggregates.by_name = saved["by_name"]
+        aggregates.undated = saved["undated"]
+        for key, name, *state in saved["recipes"]:
+            aggregates.recipes[key] = RatingStats(*state)
+            aggregates.names[key] = name
+        aggregates.reviews = {
+            review_id: (key, rating, weight)
+            for review_id, key, rating, weight in saved["reviews"]
+        }
+        aggregates._rank_all()
+        return aggregates
+
+    def _rank_all(self):
+        for recipe_key in self.recipes:
+            self._rank(recipe_key)
+
+    def _rank(self, recipe_key):
+        if not self._ranking:
+            return
+
+        stats = self.recipes.get(recipe_key)
+        if stats is None:
+            self.best.discard(recipe_key)
+            self.trending.discard(recipe_key)
+            return
+
+        self.best.set(
+            recipe_key, bayesian_average(stats.total, stats.count, self.prior_mean)
+        )
+        self.trending.set(recipe_key, stats.trend)
+
+
+def _reviews_after(db, after_id: int):
+    try:
+        with db.stream("get_review_ratings", [after_id]) as rows:
+            yield from rows
+        return
+    except DatabaseError as e:
+        if not e.args or e.args[0] != MISSING_PROC_CODE:
+            raise
+
+    # a database made from an older dump can only give every review
+    with db.stream("get_all_reviews") as rows:
+        for row in rows:
+            if row.get("review_id") > after_id:
+                yield row
+
+
+def review_timestamp(created) -> float | None:
+    """
+    Returns the timestamp of when a review was written from its date column, or None if
+    reviews do not have one
+    """
+    if isinstance(created, datetime):
+        return created.timestamp()
+    if isinstance(created, date):
+        return datetime(created.year, created.month, created.day).timestamp()
+    if isinstance(created, str):
+        # SQLite hands dates back as the ISO text they are stored as
+        try:
+            return datetime.fromisoformat(created).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def ratings_path(db_key: str) -> str:
+    """
+    Returns where the rating aggregates of a database are saved. They cover every
+    user's reviews, so there is one file per database rather than per user
+    """
+    return os.path.join(INDEX_DIR, f"ratings-{db_key}.json")
+
+
+def load_ratings(db, db_key: str) -> RatingAggregates:
+    """
+    Reads the saved rating aggregates of a database and brings them up to date, reading
+    only the reviews written since they were saved unless they are due a rebuild
+    """
+    ratings = RatingAggregates.load(ratings_path(db_key))
+    refresh_ratings(ratings, db, db_key)
+    return ratings
+
+
+def refresh_ratings(ratings: RatingAggregates, db, db_key: str):
+    if ratings.needs_rebuild:
+        ratings.rebuild(db)
+    elif not ratings.catch_up(db):
+        return
+    ratings.save(ratings_path(db_key))
+
+
+def user_ratings(state) -> RatingAggregates:
+    """
+    Returns the session's rating aggregates, loading the saved ones the first time they
+    are needed and reading the reviews written since once they are too old
+    """
+    if state.ratings is None:
+        state.ratings = load_ratings(state.db, state.db_key)
+    elif state.ratings.is_stale or state.ratings.needs_rebuild:
+        refresh_ratings(state.ratings, state.db, state.db_key)
+    return state.ratings
+
+
+def session_ratings(state) -> RatingAggregates:
+    """
+    Returns the session's rating aggregates as they are, loading the saved ones without
+    reading any reviews if there are none yet, to apply a change the session made to
+    """
+    if state.ratings is None:
+        state.ratings = RatingAggregates.load(ratings_path(state.db_key))
+    return state.ratings
+
+
+def save_ratings(state):
+    """
+    Saves the session's rating aggregates after a change made to them in place
+    """
+    state.ratings.save(ratings_path(state.db_key))
@@ -1,25 +1,40 @@
+from functools import partial
+from cache import changed_sections
 from helpers import *
 from source import main_menu, State
 from pymysql import DatabaseError
+from recipe_writes import create_full_recipe
+from search import forget_recipe, index_path, sync_index, user_index
+from pantry import forget_pantry_recipe
+from ratings import save_ratings, session_ratings, user_ratings
 
+# Number of matches shown when searching recipes
+SEARCH_RESULT_LIMIT = 20
 
-class Recipe:
+
+class Recipe(Model):
     """
     Represents a Recipe object
     """
 
-    def __init__(self, recipe_dict: dict[str,]) -> None:
-        self.id = recipe_dict.get("recipe_id")
-        self.name = recipe_dict.get("name")
-        self.instructions = recipe_dict.get("instructions")
+    __slots__ = ("id", "name", "instructions", "cooking_time", "category_names")
+
+    COLUMNS = {
+        "id": "recipe_id",
+        "name": "name",
+        "instructions": "instructions",
         # number of seconds it takes to cook this recipe
-        self.cooking_time = recipe_dict.get("cooking_time")
-        # a list of categories this recipe belongs to
-        self.categories = (
-            recipe_dict.get("category_names").split(",")
-            if recipe_dict.get("category_names")
-            else []
-        )
+        "cooking_time": "cooking_time",
+        # comma separated names of the categories this recipe belongs to
+        "category_names": "category_names",
+    }
+
+    @property
+    def categories(self) -> list[str]:
+        """
+        A list of categories this recipe belongs to
+        """
+        return self.category_names.split(",") if self.category_names else []
 
     def print_self(self) -> None:
         """
@@ -31,15 +46,14 @@ class Recipe:
         print(f"Categories: {self.categories}")
 
 
-class Category:
+class Category(Model):
     """
     Represents a category of recipes
     """
 
-    def __init__(self, cat_dict: dict[str,]):
-        self.id = cat_dict.get("category_id")
-        self.name = cat_dict.get("name")
-        self.num_recipes = cat_dict.get("recipe_num")
+    __slots__ = ("id", "name", "num_recipes")
+
+    COLUMNS = {"id": "category_id", "name": "name", "num_recipes": "recipe_num"}
 
     def print_self(self):
         """
@@ -53,7 +67,7 @@ def recipe_module(state: State):
     """
     The top level menu to interact with recipes
     """
-    cur = state.cur
+    db = state.db
     user_id = state.user_id
     clear_screen()
 
@@ -65,34 +79,43 @@ def recipe_module(state: State):
             "Open existing recipe",
             "Create new recipe",
             "Categories",
+            "Search recipes",
             "Return to main menu",
         ],
     )
 
-    choice = get_num_input(1, 4, "Go to")
+    choice = get_num_input(1, 5, "Go to")
 
     match choice:
         case 1:
             # Open an existing recipe
-            recipes = call_proc(cur, "get_all_recipes_for_user", [user_id])
+            try:
+                recipes = state.identities.load(
+                    Recipe,
+                    *call_proc_tuples(db, "get_all_recipes_for_user", [user_id]),
+                )
+            except DatabaseError as e:
+                print(e)
+                state.update_message("Error retrieving user's recipes")
+                return recipe_module
 
-            recipe_ids = [row.get("recipe_id") for row in recipes]
+            print_table(
+                ["ID", "Name"],
+                ((recipe.id, recipe.name) for recipe in recipes.values()),
+            )
 
-            print_recipe_table(cur, user_id)
+            # read ahead what opening a recipe needs while the user picks one
+            state.prefetcher.recipes(recipes)
 
             choice = num_input_list_neg_one(
-                recipe_ids, "Select a recipe ID or -1 to go back"
+                recipes, "Select a recipe ID or -1 to go back"
             )
 
             match choice:
                 case -1:
-                    recipe_module(state)
-                    return
+                    return recipe_module
                 case _:
-                    recipe = Recipe(
-                        [row for row in recipes if row.get("recipe_id") == choice][0]
-                    )
-                    recipe_action(recipe, state)
+                    return partial(recipe_action, recipes[choice])
 
         case 2:
             # Create a new recipe
@@ -102,32 +125,25 @@ def recipe_module(state: State):
                 "Enter a cooking time (in seconds) for the recipe"
             )
 
-            try:
-                new_recipe = call_proc(
-                    cur,
-                    "create_recipe",
-                    [name, instructions, cooking_time, user_id],
-                )
-            except DatabaseError as e:
-                print(e)
-                print("Could not create new recipe")
-                recipe_module(state)
-                return
-
             print("Add ingredients to the recipe")
 
             try:
                 ingredients = call_proc(
-                    cur, "get_all_ingredients_for_user", [state.user_id]
+                    db, "get_all_ingredients_for_user", [state.user_id]
                 )
             except DatabaseError as e:
                 print(e)
                 print("Error occurred when trying to fetch all of user's ingredients")
+                ingredients = ()
 
-            ing_table_data = [row.values() for row in ingredients]
+            ing_table_data = (row.values() for row in ingredients)
+            ingredient_ids = {row.get("ingredient_id") for row in ingredients}
 
             print_table(["ID", "Name"], ing_table_data)
 
+            # ingredient ID -> amount, written to the database along with the recipe
+            recipe_ingredients = {}
+
             # Loop for adding ingredients and amounts to the recipe
             while True:
                 ing_id = safe_num_input(
@@ -135,31 +151,30 @@ def recipe_module(state: State):
                 )
                 if ing_id == -1:
                     break
-                ing_amt = input(f"Enter an amount for ingredient ID {ing_id}: ")
-
-                try:
-                    call_proc(
-                        cur,
-                        "add_ingredient_to_recipe",
-                        [ing_id, ing_amt, new_recipe[0].get("recipe_id")],
-                    )
-                except DatabaseError as e:
-                    if e.args[0] == DUPLICATE_CODE:
-                        print("Duplicate ingredient in the recipe is not allowed")
-                    elif e.args[0] == NOT_FOUND_CODE:
-                        print("This ingredient does not exist")
-                    else:
-                        print(e)
-                        print("Could not add ingredient to recipe")
+                if ing_id in recipe_ingredients:
+                    print("Duplicate ingredient in the recipe is not allowed")
+                    continue
+                if ing_id not in ingredient_ids:
+                    print("This ingredient does not exist")
+                    continue
+
+                recipe_ingredients[ing_id] = input(
+                    f"Enter an amount for ingredient ID {ing_id}: "
+                )
 
             print("\nAdd the recipe to categories")
             try:
-                categories = call_proc(cur, "get_categories_for_user", [state.user_id])
+                categories = call_proc(db, "get_categories_for_user", [state.user_id])
             except DatabaseError as e:
                 print(e)
                 print("Error occurred when trying to fetch user's categories")
+                categories = ()
+
+            category_ids = {row.get("category_id") for row in categories}
 
-            print_table(["ID", "Name"], [row.values() for row in categories])
+            print_table(["ID", "Name"], (row.values() for row in categories))
+
+            recipe_categories = []
 
             # Loop for adding recipe to categories
             while True:
@@ -169,27 +184,32 @@ def recipe_module(state: State):
 
                 if cat_id == -1:
                     break
+                if cat_id in recipe_categories:
+                    print("Duplicate recipe in a category is not allowed")
+                    continue
+                if cat_id not in category_ids:
+                    print("This category does not exist")
+                    continue
 
-                try:
-                    call_proc(
-                        cur,
-                        "add_recipe_to_category",
-                        [new_recipe[0].get("recipe_id"), cat_id],
-                    )
-                except DatabaseError as e:
-                    if e.args[0] == DUPLICATE_CODE:
-                        print("Duplicate recipe in a category is not allowed")
-                    elif e.args[0] == NOT_FOUND_CODE:
-                        print("This category does not exist")
-                    else:
-                        print(e)
-                        print("Could not add recipe to category")
+                recipe_categories.append(cat_id)
 
-            state.update_message(
-                f"Created new recipe with ID {new_recipe[0].get('recipe_id')}"
-            )
-            recipe_module(state)
-            return
+            try:
+                new_recipe_id = create_full_recipe(
+                    db,
+                    user_id,
+                    name,
+                    instructions,
+                    cooking_time,
+                    recipe_ingredients,
+                    recipe_categories,
+                )
+            except DatabaseError as e:
+                print(e)
+                state.update_message("Could not create new recipe")
+                return recipe_module
+
+            state.update_message(f"Created new recipe with ID {new_recipe_id}")
+            return recipe_module
         case 3:
             # Category Menu
             print_menu(
@@ -202,56 +222,50 @@ def recipe_module(state: State):
                     # View all categories
                     clear_screen()
                     try:
-                        categories = call_proc(
-                            cur, "get_all_categories_for_user", [user_id]
+                        categories = state.identities.load(
+                            Category,
+                            *call_proc_tuples(
+                                db, "get_all_categories_for_user", [user_id]
+                            ),
                         )
                     except DatabaseError as e:
                         print(e)
                         print("Error occurred when trying to fetch user's categories")
-                        recipe_module(state)
-                        return
-
-                    category_ids = [row.get("category_id") for row in categories]
+                        return recipe_module
 
                     print("Categories")
                     print_table(
                         ["ID", "Name", "Number of recipes"],
-                        [row.values() for row in categories],
+                        ((c.id, c.name, c.num_recipes) for c in categories.values()),
                     )
 
                     choice = num_input_list_neg_one(
-                        category_ids,
+                        categories,
                         "Choose a category to interact with or -1 to go back",
                     )
                     match choice:
                         case -1:
                             # Go back to recipe main menu
-                            recipe_module(state)
+                            return recipe_module
                         case _:
                             # Enter a category
-                            category = [
-                                row
-                                for row in categories
-                                if row.get("category_id") == choice
-                            ][0]
-                            category_action(Category(category), state)
+                            return partial(category_action, categories[choice])
 
                 case 2:
                     # Create a new category
                     name = input("Enter name for new category: ")
 
                     try:
-                        new_cat_id = call_proc(cur, "create_category", [name, user_id])
+                        new_cat_id = call_proc(db, "create_category", [name, user_id])
                         new_cat_id = new_cat_id[0].get("category_id")
                     except DatabaseError as e:
                         if e.args[0] == DUPLICATE_CODE:
                             print("Cannot have duplicate category names")
                         else:
                             print("Error creating new category")
-                        recipe_module(state)
-                        return
+                        return recipe_module
 
-                    print_recipe_table(cur, user_id)
+                    print_recipe_table(db, user_id)
 
                     # Loop for adding recipes to categories
                     while True:
@@ -264,7 +278,7 @@ def recipe_module(state: State):
 
                         try:
                             call_proc(
-                                cur, "add_recipe_to_category", [choice, new_cat_id]
+                                db, "add_recipe_to_category", [choice, new_cat_id]
                             )
                         except DatabaseError as e:
                             if e.args[0] == DUPLICATE_CODE:
@@ -274,28 +288,85 @@ def recipe_module(state: State):
                             else:
                                 print("Could not add recipe to category")
 
-                    recipe_module(state)
-                    return
+                    return recipe_module
                 case 3:
                     # Go back to the main recipe menu
-                    recipe_module(state)
+                    return recipe_module
         case 4:
+            # Search recipes
+            return recipe_search
+        case 5:
             # Go back to the main menu
-            main_menu(state)
+            return main_menu
+
+
+def recipe_search(state: State):
+    """
+    Menu to find recipes by words in their name, instructions, categories or ingredients
+    """
+    query = input("Search for: ")
+
+    try:
+        recipes = state.identities.load(
+            Recipe,
+            *call_proc_tuples(state.db, "get_all_recipes_for_user", [state.user_id]),
+        )
+        index = user_index(state)
+        # synced once a session, then only after recipes were written
+        if state.search_synced is None or "recipes" in changed_sections(
+            state.written - state.search_synced
+        ):
+            synced = state.written.copy()
+            if sync_index(index, state.db, state.user_id, recipes):
+                index.save(index_path(state.db_key, state.user_id))
+            state.search_synced = synced
+    except DatabaseError as e:
+        print(e)
+        state.update_message("Error occurred when trying to search recipes")
+        return recipe_module
+
+    results = [
+        (recipe_id, score)
+        for recipe_id, score in index.search(query, SEARCH_RESULT_LIMIT)
+        if recipe_id in recipes
+    ]
+
+    if not results:
+        state.update_message(f"No recipes found for '{query}'")
+        return recipe_module
+
+    print_table(
+        ["ID", "Name", "Score"],
+        (
+            (recipe_id, recipes[recipe_id].name, f"{score:.2f}")
+            for recipe_id, score in results
+        ),
+    )
+
+    result_ids = {recipe_id for recipe_id, _ in results}
+    state.prefetcher.recipes(result_ids)
+
+    choice = num_input_list_neg_one(result_ids, "Select a recipe ID or -1 to go back")
+
+    match choice:
+        case -1:
+            return recipe_module
+        case _:
+            return partial(recipe_action, recipes[choice])
 
 
 def recipe_action(recipe: Recipe, state: State):
     """
     Menu to interact with a specific Recipe that is given
     """
-    cur = state.cur
+    db = state.db
 
     clear_screen()
 
     state.print_message_reset()
 
     try:
-        ingredients = call_proc(cur, "get_ingredients_for_recipe", [recipe.id])
+        ingredients = call_proc(db, "get_ingredients_for_recipe", [recipe.id])
     except DatabaseError as e:
         print(e)
         print("Error occurred when trying to fetch all of user's ingredients")
@@ -303,6 +374,12 @@ def recipe_action(recipe: Recipe, state: State):
     print("Recipe\n")
     recipe.print_self()
 
+    try:
+        print(f"Rating: {user_ratings(state).stats(recipe.id, recipe.name)}")
+    except DatabaseError as e:
+        print(e)
+        print("Error occurred when trying to fetch this recipe's rating")
+
     print("\nIngredients:")
     print_table(
         ["Name", "Amount"],
@@ -333,7 +410,7 @@ def recipe_action(recipe: Recipe, state: State):
 
             try:
                 call_proc(
-                    cur,
+                    db,
                     "update_recipe",
                     [new_name, new_instructions, new_time, recipe.id],
                 )
@@ -358,7 +435,7 @@ def recipe_action(recipe: Recipe, state: State):
             print("\nUpdate the ingredients in this recipe")
 
             try:
-                ingredients = call_proc(cur, "get_ingredients_for_recipe", [recipe.id])
+                ingredients = call_proc(db, "get_ingredients_for_recipe", [recipe.id])
             except DatabaseError as e:
                 print(e)
                 print("Error occurred when trying to fetch recipe's ingredients")
@@ -387,7 +464,7 @@ def recipe_action(recipe: Recipe, state: State):
                 match choice:
                     case 1:
                         # Add ingredient to recipe
-                        print_ingredient_table(cur, state.user_id)
+                        print_ingredient_table(db, state.user_id)
 
                         # Loop to input ingredients + amounts
                         while True:
@@ -402,7 +479,7 @@ def recipe_action(recipe: Recipe, state: State):
 
                             try:
                                 call_proc(
-                                    cur,
+                                    db,
                                     "add_ingredient_to_recipe",
                                     [ing_id, amt, recipe.id],
                                 )
@@ -445,7 +522,7 @@ def recipe_action(recipe: Recipe, state: State):
 
                             try:
                                 call_proc(
-                                    cur,
+                                    db,
                                     "remove_ingredient_from_recipe",
                                     [recipe.id, ing_id],
                                 )
@@ -475,7 +552,7 @@ def recipe_action(recipe: Recipe, state: State):
                                     ):
                                         update_msg += " to have different ingredients"
                                     first_time_add_ing = False
-                                    print_ingredient_table(cur, state.user_id)
+                                    print_ingredient_table(db, state.user_id)
                                 new_ing_id = safe_num_input(
                                     f"Choose an ingredient ID to replace {row.get('name')} with"
                                 )
@@ -485,7 +562,7 @@ def recipe_action(recipe: Recipe, state: State):
 
                                 try:
                                     call_proc(
-                                        cur,
+                                        db,
                                         "update_recipe_ingredient",
                                         [
                                             recipe.id,
@@ -512,7 +589,7 @@ def recipe_action(recipe: Recipe, state: State):
 
             try:
                 categories = call_proc(
-                    cur, "get_all_categories_for_user", [state.user_id]
+                    db, "get_all_categories_for_user", [state.user_id]
                 )
             except DatabaseError as e:
                 print(e)
@@ -520,7 +597,7 @@ def recipe_action(recipe: Recipe, state: State):
 
             print_table(
                 ["ID", "Name", "Number of recipes"],
-                [row.values() for row in categories],
+                (row.values() for row in categories),
             )
 
             while True:
@@ -547,7 +624,7 @@ def recipe_action(recipe: Recipe, state: State):
 
                             try:
                                 call_proc(
-                                    cur, "add_recipe_to_category", [recipe.id, choice]
+                                    db, "add_recipe_to_category", [recipe.id, choice]
                                 )
                             except DatabaseError as e:
                                 if e.args[0] == DUPLICATE_CODE:
@@ -567,7 +644,7 @@ def recipe_action(recipe: Recipe, state: State):
                         # Remove recipe from category
                         try:
                             categories = call_proc(
-                                cur, "get_categories_for_recipe", [recipe.id]
+                                db, "get_categories_for_recipe", [recipe.id]
                             )
                         except DatabaseError as e:
                             print(e)
@@ -576,7 +653,7 @@ def recipe_action(recipe: Recipe, state: State):
                             )
 
                         print_table(
-                            ["ID", "Name"], [row.values() for row in categories]
+                            ["ID", "Name"], (row.values() for row in categories)
                         )
 
                         while True:
@@ -589,7 +666,7 @@ def recipe_action(recipe: Recipe, state: State):
 
                             try:
                                 call_proc(
-                                    cur,
+                                    db,
                                     "remove_recipe_from_category",
                                     [recipe.id, choice],
                                 )
@@ -615,39 +692,58 @@ def recipe_action(recipe: Recipe, state: State):
 
             state.update_message(update_msg)
             try:
-                categories = call_proc(cur, "get_categories_for_recipe", [recipe.id])
+                categories = call_proc(db, "get_categories_for_recipe", [recipe.id])
             except DatabaseError as e:
                 print(e)
                 print(
                     "Error occurred when trying to fetch all the categories for this recipe"
                 )
 
-            # New recipe with updated attributes
-            new_recipe = Recipe(
-                {
-                    "recipe_id": recipe.id,
-                    "name": new_name,
-                    "instructions": new_instructions,
-                    "cooking_time": new_time,
-                    "category_names": ",".join([row.get("name") for row in categories]),
-                }
-            )
-            recipe_action(new_recipe, state)
+            if new_name != recipe.name:
+                session_ratings(state).recipe_renamed(recipe.id, new_name)
+                save_ratings(state)
+
+            # Bring the session's recipe object up to date with the edits
+            recipe = state.identities.register(
+                [
+                    Recipe(
+                        {
+                            "recipe_id": recipe.id,
+                            "name": new_name,
+                            "instructions": new_instructions,
+                            "cooking_time": new_time,
+                            "category_names": ",".join(
+                                [row.get("name") for row in categories]
+                            ),
+                        }
+                    )
+                ]
+            )[recipe.id]
+            # its ingredients may have changed too, so reindex it on the next search
+            forget_recipe(state, recipe.id)
+            forget_pantry_recipe(state, recipe.id)
+            return partial(recipe_action, recipe)
         case 2:
             # Delete a recipe
             confirm = input(f"Are you sure you want to delete '{recipe.name}'? Y/N: ")
             if confirm == "Y" or confirm == "y":
                 try:
-                    call_proc(cur, "delete_recipe", [recipe.id])
+                    call_proc(db, "delete_recipe", [recipe.id])
+                    state.identities.remove(Recipe, recipe.id)
+                    forget_recipe(state, recipe.id)
+                    forget_pantry_recipe(state, recipe.id)
+                    # the recipe's reviews went with it
+                    session_ratings(state).recipe_deleted(recipe.id)
+                    save_ratings(state)
                 except DatabaseError as e:
                     print(e)
                     print("Error occurred when trying to delete this recipe")
                 finally:
                     state.update_message(f"Deleted recipe '{recipe.name}'")
 
-            recipe_module(state)
+            return recipe_module
         case 3:
-            recipe_module(state)
+            return recipe_module
 
 
 def category_action(category: Category, state: State):
@@ -668,7 +764,8 @@ def category_action(category: Category, state: State):
             new_name = input(f"Enter a new name for category '{category.name}': ")
 
             try:
-                call_proc(state.cur, "update_category_name", [category.id, new_name])
+                call_proc(state.db, "update_category_name", [category.id, new_name])
+                state.identities.update(Category, category.id, name=new_name)
             except DatabaseError as e:
                 if e.args == DUPLICATE_CODE:
                     print("Duplicate category names are not allowed")
@@ -677,22 +774,23 @@ def category_action(category: Category, state: State):
 
             state.update_message(f"Changed category '{category.name}' to '{new_name}'")
 
-            recipe_module(state)
+            return recipe_module
 
         case 2:
             # Delete this category
             confirm = input(f"Are you sure you want to delete '{category.name}'? Y/N: ")
             if confirm == "Y" or confirm == "y":
                 try:
-                    call_proc(state.cur, "delete_category", [category.id])
+                    call_proc(state.db, "delete_category", [category.id])
+                    state.identities.remove(Category, category.id)
                 except DatabaseError as e:
                     print(e)
                     print("Error occurred when trying to delete this category")
                 finally:
                     state.update_message(f"Deleted category '{category.name}'")
 
-            recipe_module(state)
+            return recipe_module
 
         case 3:
             # Go back to the main recipe menu
-            recipe_module(state)
+            return recipe_module
@@ -0,0 +1,54 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cache import CachedDatabase
+    from pool import Transaction
+
+
+def create_full_recipe(
+    db: "CachedDatabase",
+    user_id: int,
+    name: str,
+    instructions: str,
+    cooking_time: int,
+    ingredients: dict[int, str],
+    category_ids: list[int],
+) -> int:
+    """
+    Creates a recipe along with its ingredients (a map of ingredient ID to amount) and
+    categories in a single transaction, so either all of it is saved or none of it is.
+    Returns the new recipe's ID
+    """
+    with db.transaction() as tx:
+        return write_full_recipe(
+            tx, user_id, name, instructions, cooking_time, ingredients, category_ids
+        )
+
+
+def write_full_recipe(
+    tx: "Transaction",
+    user_id: int,
+    name: str,
+    instructions: str,
+    cooking_time: int,
+    ingredients: dict[int, str],
+    category_ids: list[int],
+) -> int:
+    """
+    Writes a recipe along with its ingredients and categories as part of a transaction
+    that is already open, batching the ingredient and category calls. Returns the new
+    recipe's ID
+    """
+    recipe_id = tx.callproc(
+        "create_recipe", [name, instructions, cooking_time, user_id]
+    )[0].get("recipe_id")
+
+    tx.callproc_many(
+        "add_ingredient_to_recipe",
+        [[ing_id, amount, recipe_id] for ing_id, amount in ingredients.items()],
+    )
+    tx.callproc_many(
+        "add_recipe_to_category", [[recipe_id, cat_id] for cat_id in category_ids]
+    )
+
+    return recipe_id
@@ -1,20 +1,38 @@
+from functools import partial
+from itertools import islice
 from source import State, main_menu
 from helpers import *
 from pymysql import DatabaseError
+from ratings import save_ratings, session_ratings, user_ratings
+from leaderboard import LEADERBOARD_SIZE
+from recipe import Recipe
 
+# Number of reviews shown on each page when browsing all reviews
+REVIEW_PAGE_SIZE = 20
 
-class Review:
+
+class Review(Model):
     """
     Represents a Review of a recipe and the data associated with it
     """
 
-    def __init__(self, rev_dict: dict[str,]):
-        self.id = rev_dict.get("review_id")
-        self.recipe_name = rev_dict.get("recipe_name")
-        self.rating = rev_dict.get("rating")
-        self.creator_id = rev_dict.get("user_id")
-        self.creator_name = rev_dict.get("creator_name")
-        self.review_text = rev_dict.get("review_text")
+    __slots__ = (
+        "id",
+        "recipe_name",
+        "rating",
+        "creator_id",
+        "creator_name",
+        "review_text",
+    )
+
+    COLUMNS = {
+        "id": "review_id",
+        "recipe_name": "recipe_name",
+        "rating": "rating",
+        "creator_id": "user_id",
+        "creator_name": "creator_name",
+        "review_text": "review_text",
+    }
 
     def print_self(self):
         print(f"Recipe: {self.recipe_name}")
@@ -23,6 +41,86 @@ class Review:
         print(f"Creator: {self.creator_name}")
 
 
+class ReviewPager:
+    """
+    Pages through every review in the system in order of ID, reading one page at a time
+    so only the current page is ever held in memory and no connection is kept busy
+    while the user looks at it. Each page is bookmarked by the ID of the review just
+    before it and read as the reviews after that ID, so going back is as cheap as going
+    forward and a bookmarked review being deleted only moves the page to the next one
+    """
+
+    def __init__(self, db: CachedDatabase, page_size: int = REVIEW_PAGE_SIZE):
+        self.db = db
+        self.page_size = page_size
+        self.page = []
+        # bookmarks[i] is the ID of the last review before page i (0 for the first)
+        self.bookmarks = [0]
+        self._has_next = False
+
+    @property
+    def page_number(self) -> int:
+        return len(self.bookmarks)
+
+    @property
+    def has_next(self) -> bool:
+        return self._has_next
+
+    @property
+    def has_previous(self) -> bool:
+        return len(self.bookmarks) > 1
+
+    def first(self):
+        """
+        Loads the first page of reviews
+        """
+        self.bookmarks = [0]
+        self._load()
+
+    def next(self):
+        """
+        Loads the page after the current one, if there is one
+        """
+        if not self.has_next:
+            return
+
+        self.bookmarks.append(self.page[-1].get("review_id"))
+        self._load()
+
+    def previous(self):
+        """
+        Loads the page before the current one, if there is one
+        """
+        if not self.has_previous:
+            return
+
+        self.bookmarks.pop()
+        self._load()
+
+    def _load(self):
+        # one review past the page is read to know whether there is another page
+        rows = self._reviews_after(self.bookmarks[-1], self.page_size + 1)
+        self.page = list(rows[: self.page_size])
+        self._has_next = len(rows) > self.page_size
+
+    def _reviews_after(self, after_id: int, max_rows: int) -> tuple[dict[str,], ...]:
+        try:
+            return self.db.callproc("get_reviews_after", [after_id, max_rows])
+        except DatabaseError as e:
+            if not e.args or e.args[0] != MISSING_PROC_CODE:
+                raise
+
+        # a database created from an older dump has no get_reviews_after, so the page
+        # is read from the start of every review instead. The stream is closed before
+        # returning, the page being all that is needed from it
+        with self.db.stream("get_all_reviews") as rows:
+            return tuple(
+                islice(
+                    (row for row in rows if row.get("review_id") > after_id), max_rows
+                )
+            )
+
+
 def review_module(state: State):
     """
     Top level menu to interact with reviews
@@ -31,69 +129,116 @@ def review_module(state: State):
 
     state.print_message_reset()
 
-    cur = state.cur
+    db = state.db
 
-    print_menu("Choose an action", ["View all reviews", "Create new review", "Go back"])
-    choice = get_num_input(1, 3, "Go to")
+    print_menu(
+        "Choose an action",
+        [
+            "View all reviews",
+            "Create new review",
+            "Best rated recipes",
+            "Trending recipes",
+            "Go back",
+        ],
+    )
+    choice = get_num_input(1, 5, "Go to")
 
     match choice:
         case 1:
-            # View all reviews
+            # View all reviews, one page at a time
+            pager = ReviewPager(db)
+
             try:
-                reviews = call_proc(cur, "get_all_reviews")
+                pager.first()
             except DatabaseError as e:
                 print(e)
                 print("Error occurred when trying to fetch all reviews")
-                review_module(state)
-                return
-
-            review_table_data = [
-                (
-                    row.get("review_id"),
-                    row.get("recipe_name"),
-                    str(row.get("rating")) + "/10",
-                    row.get("creator_name"),
+                return review_module
+
+            # Loop for moving between pages of reviews
+            while True:
+                clear_screen()
+
+                state.print_message_reset()
+
+                print(f"Reviews (page {pager.page_number})")
+
+                review_table_data = [
+                    (
+                        row.get("review_id"),
+                        row.get("recipe_name"),
+                        str(row.get("rating")) + "/10",
+                        row.get("creator_name"),
+                    )
+                    for row in pager.page
+                ]
+
+                print_table(
+                    ["ID", "Recipe Name", "Rating", "Creator Name"], review_table_data
                 )
-                for row in reviews
-            ]
 
-            review_ids = [row.get("review_id") for row in reviews]
+                print_menu(
+                    "Select an action",
+                    ["Open a review", "Next page", "Previous page", "Go back"],
+                )
+                choice = get_num_input(1, 4, "Go to")
 
-            print_table(
-                ["ID", "Recipe Name", "Rating", "Creator Name"], review_table_data
-            )
+                try:
+                    match choice:
+                        case 1:
+                            break
+                        case 2:
+                            if not pager.has_next:
+                                state.update_message("There are no more reviews")
+                            pager.next()
+                        case 3:
+                            if not pager.has_previous:
+                                state.update_message("This is the first page")
+                            pager.previous()
+                        case 4:
+                            return review_module
+                except DatabaseError as e:
+                    print(e)
+                    print("Error occurred when trying to fetch more reviews")
+                    return review_module
+
+            reviews = state.identities.register(Review(row) for row in pager.page)
 
             choice = num_input_list_neg_one(
-                review_ids, "Select a review ID or -1 to go back"
+                reviews, "Select a review ID or -1 to go back"
             )
 
             match choice:
                 case -1:
-                    review_module(state)
-                    return
+                    return review_module
                 case _:
-                    r_obj = Review(
-                        [row for row in reviews if row.get("review_id") == choice][0]
-                    )
-
-                    review_action(r_obj, state)
+                    return partial(review_action, reviews[choice])
 
         case 2:
             # Create a new review
-            recipe_ids = print_recipe_table(cur, state.user_id)
+            try:
+                recipes = state.identities.load(
+                    Recipe,
+                    *call_proc_tuples(db, "get_all_recipes_for_user", [state.user_id]),
+                )
+            except DatabaseError as e:
+                print(e)
+                print("Error retrieving user's recipes")
+                recipes = {}
+
+            print_table(["ID", "Name"], ((r.id, r.name) for r in recipes.values()))
 
             while True:
                 r_id = safe_num_input("Choose a recipe to review or -1 to cancel")
 
-                if r_id not in recipe_ids:
+                if r_id != -1 and r_id not in recipes:
                     print("Invalid ID, try again")
                     continue
 
                 break
 
             if r_id == -1:
-                review_module(state)
-                return
+                return review_module
 
             while True:
                 rating = safe_num_input("Enter a rating out of ten")
@@ -107,18 +252,73 @@ def review_module(state: State):
 
             try:
                 new_rev_id = call_proc(
-                    cur, "create_review", [r_id, rating, text, state.user_id]
-                )
+                    db, "create_review", [r_id, rating, text, state.user_id]
+                )[0].get("review_id")
             except DatabaseError as e:
-                print("Error creating review")
-            finally:
-                new_rev_id = new_rev_id[0].get("review_id")
-                state.update_message(f"Created new review with ID {new_rev_id}")
+                print(e)
+                state.update_message("Error creating review")
+                return review_module
+
+            ratings = session_ratings(state)
+            name = recipes[r_id].name
+            ratings.review_created(
+                new_rev_id, ratings.recipe_key(r_id, name), name, rating
+            )
+            save_ratings(state)
 
-            review_module(state)
+            state.update_message(f"Created new review with ID {new_rev_id}")
+
+            return review_module
         case 3:
+            # Show the recipes with the best ratings
+            return partial(leaderboard, False)
+        case 4:
+            # Show the recipes with the most good reviews lately
+            return partial(leaderboard, True)
+        case 5:
             # Go back the main menu
-            main_menu(state)
+            return main_menu
+
+
+def leaderboard(trending: bool, state: State):
+    """
+    Shows the best rated recipes across every user's reviews, or the ones trending
+    """
+    clear_screen()
+
+    try:
+        ratings = user_ratings(state)
+    except DatabaseError as e:
+        print(e)
+        state.update_message("Error occurred when trying to fetch all reviews")
+        return review_module
+
+    if trending:
+        print("Trending recipes\n")
+        if not ratings.can_trend:
+            print("Reviews in this database have no dates, so nothing is trending")
+        top = ratings.top_trending(LEADERBOARD_SIZE)
+    else:
+        print("Best rated recipes\n")
+        top = ratings.best_rated(LEADERBOARD_SIZE)
+
+    print_table(
+        ["Rank", "Recipe Name", "Score", "Average", "Reviews"],
+        (
+            (
+                rank,
+                ratings.names[key],
+                f"{score:.2f}",
+                f"{ratings.recipes[key].mean:.1f}/10",
+                ratings.recipes[key].count,
+            )
+            for rank, (key, score) in enumerate(top, start=1)
+        ),
+    )
+
+    print_menu("\nChoose an action", ["Go back"])
+    get_num_input(1, 1, "Go to")
+    return review_module
 
 
 def review_action(review: Review, state: State):
@@ -131,6 +331,12 @@ def review_action(review: Review, state: State):
 
     review.print_self()
 
+    try:
+        print(f"Recipe's rating: {user_ratings(state).review_stats(review.id)}")
+    except DatabaseError as e:
+        print(e)
+        print("Error occurred when trying to fetch the recipe's rating")
+
     # Only allow the user to edit or delete a review if they are the creator
     if review.creator_id == state.user_id:
         print_menu("\nSelect an action", ["Edit", "Delete", "Go back"])
@@ -161,10 +367,17 @@ def review_action(review: Review, state: State):
 
                             try:
                                 call_proc(
-                                    state.cur,
+                                    state.db,
                                     "update_review_rating",
                                     [review.id, new_rating],
                                 )
+                                state.identities.update(
+                                    Review, review.id, rating=new_rating
+                                )
+                                session_ratings(state).rating_updated(
+                                    review.id, new_rating
+                                )
+                                save_ratings(state)
                             except DatabaseError as e:
                                 print(e)
                                 print(
@@ -181,10 +394,13 @@ def review_action(review: Review, state: State):
 
                             try:
                                 call_proc(
-                                    state.cur,
+                                    state.db,
                                     "update_review_text",
                                     [review.id, new_text],
                                 )
+                                state.identities.update(
+                                    Review, review.id, review_text=new_text
+                                )
                             except DatabaseError as e:
                                 print(e)
                                 print(
@@ -199,20 +415,10 @@ def review_action(review: Review, state: State):
                             break
 
                 if not edited:
-                    review_action(review, state)
+                    return partial(review_action, review)
                 else:
-                    new_rev = Review(
-                        {
-                            "review_id": review.id,
-                            "recipe_name": review.recipe_name,
-                            "rating": new_rating or review.rating,
-                            "user_id": review.creator_id,
-                            "creator_name": review.creator_name,
-                            "review_text": new_text or review.review_text,
-                        }
-                    )
                     state.update_message(update_msg)
-                    review_action(new_rev, state)
+                    return partial(review_action, review)
             case 2:
                 # Delete this review
                 confirm = input(
@@ -220,7 +426,10 @@ def review_action(review: Review, state: State):
                 )
                 if confirm == "Y" or confirm == "y":
                     try:
-                        call_proc(state.cur, "delete_review", [review.id])
+                        call_proc(state.db, "delete_review", [review.id])
+                        state.identities.remove(Review, review.id)
+                        session_ratings(state).review_deleted(review.id)
+                        save_ratings(state)
                     except DatabaseError as e:
                         print(e)
                         print("Error occurred when trying to delete this review")
@@ -229,10 +438,10 @@ def review_action(review: Review, state: State):
                             f"Deleted review for '{review.recipe_name}'"
                         )
 
-                review_module(state)
+                return review_module
             case 3:
                 # Return to the top level review menu
-                review_module(state)
+                return review_module
 
     # Menu for a user who did not create this review
     else:
@@ -240,4 +449,4 @@ def review_action(review: Review, state: State):
         choice = get_num_input(1, 1, "Go to")
         match choice:
             case 1:
-                review_module(state)
+                return review_module
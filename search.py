@@ -0,0 +1,236 @@
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+from helpers import call_proc_grouped
+
+# Directory the search index of each user is saved in between sessions
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".recipemaster")
+
+# Bump when the saved format or the way text is tokenized changes, so old indexes are
+# rebuilt instead of read
+INDEX_VERSION = 2
+
+# How much a word counts towards a recipe's score depending on where it appears
+NAME_WEIGHT = 3
+CATEGORY_WEIGHT = 2
+INGREDIENT_WEIGHT = 2
+INSTRUCTIONS_WEIGHT = 1
+
+# BM25 parameters: how quickly repeated words stop adding to the score, and how much
+# longer recipes are penalized
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits text into lowercase words
+    """
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def recipe_signature(recipe, ingredient_names: list[str]) -> str:
+    """
+    Returns a fingerprint of everything a recipe is indexed by, used to tell whether an
+    indexed recipe has changed since it was indexed. Ingredient names are included, so
+    renaming or deleting an ingredient makes every recipe using it stale
+    """
+    text = "\x1f".join(
+        str(value)
+        for value in (
+            recipe.name,
+            recipe.instructions,
+            recipe.category_names,
+            *sorted(ingredient_names),
+        )
+    )
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class RecipeIndex:
+    """
+    An inverted index from words to the recipes containing them, ranking searches with
+    BM25. Recipes are added and removed one at a time, so keeping the index current only
+    costs work for the recipes that changed
+    """
+
+    def __init__(self):
+        # recipe ID -> {"sig": signature, "terms": {word: weighted count}, "len": length}
+        self.docs = {}
+        # word -> {recipe ID -> weighted count}
+        self.postings = defaultdict(dict)
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, recipe_id: int):
+        return recipe_id in self.docs
+
+    def add(self, recipe, ingredient_names: list[str]):
+        """
+        Indexes a recipe (replacing what was indexed for it before) along with the names
+        of its ingredients
+        """
+        self.discard(recipe.id)
+
+        terms = Counter()
+        for weight, texts in (
+            (NAME_WEIGHT, [recipe.name]),
+            (CATEGORY_WEIGHT, recipe.categories),
+            (INGREDIENT_WEIGHT, ingredient_names),
+            (INSTRUCTIONS_WEIGHT, [recipe.instructions]),
+        ):
+            for text in texts:
+                for token in tokenize(text):
+                    terms[token] += weight
+
+        self._insert(recipe.id, recipe_signature(recipe, ingredient_names), dict(terms))
+
+    def discard(self, recipe_id: int):
+        """
+        Removes a recipe from the index if it is in it
+        """
+        doc = self.docs.pop(recipe_id, None)
+        if doc is None:
+            return
+
+        for term in doc["terms"]:
+            postings = self.postings[term]
+            postings.pop(recipe_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_len -= doc["len"]
+
+    def is_current(self, recipe, ingredient_names: list[str]) -> bool:
+        """
+        Returns whether the recipe is indexed as it is now
+        """
+        doc = self.docs.get(recipe.id)
+        return doc is not None and doc["sig"] == recipe_signature(
+            recipe, ingredient_names
+        )
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[int, float]]:
+        """
+        Returns up to limit (recipe ID, score) pairs for the recipes that best match the
+        query, best first. Only the recipes containing a query word are looked at
+        """
+        if not self.docs:
+            return []
+
+        n = len(self.docs)
+        avg_len = self.total_len / n
+        scores = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for recipe_id, count in postings.items():
+                length = self.docs[recipe_id]["len"]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+                scores[recipe_id] += idf * count * (BM25_K1 + 1) / (count + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "docs": self.docs}, f)
+        # replace the old index in one step so a crash never leaves half of one
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RecipeIndex":
+        """
+        Reads a saved index, returning an empty one if there is none or it is unusable
+        """
+        index = cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return index
+
+        if saved.get("version") != INDEX_VERSION:
+            return index
+
+        for recipe_id, doc in saved["docs"].items():
+            # JSON object keys are always strings
+            index._insert(int(recipe_id), doc["sig"], doc["terms"])
+
+        return index
+
+    def _insert(self, recipe_id: int, sig: str, terms: dict[str, int]):
+        length = sum(terms.values())
+        self.docs[recipe_id] = {"sig": sig, "terms": terms, "len": length}
+        for term, count in terms.items():
+            self.postings[term][recipe_id] = count
+        self.total_len += length
+
+
+def index_path(db_key: str, user_id: int) -> str:
+    """
+    Returns where a user's search index is saved. User IDs are only unique within one
+    database, so the path names the database too (see config.database_key)
+    """
+    return os.path.join(INDEX_DIR, f"search-{db_key}-{user_id}.json")
+
+
+def sync_index(index: RecipeIndex, db, user_id: int, recipes: dict) -> int:
+    """
+    Brings the index up to date with a user's recipes (keyed by ID), reindexing only
+    the recipes that are new or changed, their ingredients included. The ingredients of
+    every recipe are read in one call. Returns how many recipes were added, reindexed
+    or removed
+    """
+    removed = [recipe_id for recipe_id in index.docs if recipe_id not in recipes]
+    for recipe_id in removed:
+        index.discard(recipe_id)
+
+    ingredients = call_proc_grouped(
+        db,
+        "get_recipe_ingredients_for_user",
+        [user_id],
+        "recipe_id",
+        "get_ingredients_for_recipe",
+    )
+    changed = 0
+    for recipe in recipes.values():
+        names = [row.get("name") for row in ingredients[recipe.id]]
+        if not index.is_current(recipe, names):
+            index.add(recipe, names)
+            changed += 1
+
+    return len(removed) + changed
+
+
+def user_index(state) -> RecipeIndex:
+    """
+    Returns the session's search index, loading the user's saved one the first time
+    """
+    if state.search_index is None:
+        state.search_index = RecipeIndex.load(index_path(state.db_key, state.user_id))
+    return state.search_index
+
+
+def forget_recipe(state, recipe_id: int):
+    """
+    Drops a recipe that was edited or deleted from the user's search index, so it is
+    reindexed (or left out) the next time the index is synced
+    """
+    index = user_index(state)
+    if recipe_id in index:
+        index.discard(recipe_id)
+        index.save(index_path(state.db_key, state.user_id))
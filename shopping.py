@@ -0,0 +1,68 @@
+from pool import Transaction
+from units import combine, parse_amount
+
+
+class ShoppingItem:
+    """
+    One ingredient on a shopping list, with the amounts every selected recipe needs of
+    it added together
+    """
+
+    __slots__ = ("ingredient_id", "name", "quantities", "other")
+
+    def __init__(self, ingredient_id: int, name: str):
+        self.ingredient_id = ingredient_id
+        self.name = name
+        # dimension -> total quantity
+        self.quantities = {}
+        # amounts that could not be added up, kept as they were written
+        self.other = []
+
+    def add(self, amount: str, servings: float):
+        parsed = parse_amount(amount, self.name or "")
+        if parsed is None:
+            if amount and amount not in self.other:
+                self.other.append(amount)
+            return
+
+        for total in combine([*self.quantities.values(), parsed.scaled(servings)]):
+            self.quantities[total.dimension] = total
+
+    @property
+    def amount(self) -> str:
+        parts = [str(quantity) for quantity in self.quantities.values()]
+        return " + ".join(parts + self.other)
+
+
+def build_shopping_list(db, servings: dict[int, float]) -> dict[int, ShoppingItem]:
+    """
+    Combines the ingredients of the recipes keyed in servings into one item per
+    ingredient, multiplying each recipe's amounts by its number of servings.
+    db can be the database or a Transaction; pass the Transaction the list is written
+    in so the items are read and written together
+    """
+    items = {}
+    for recipe_id, multiplier in servings.items():
+        for row in db.callproc("get_ingredients_for_recipe", [recipe_id]):
+            ingredient_id = row.get("ingredient_id")
+            item = items.get(ingredient_id)
+            if item is None:
+                item = items[ingredient_id] = ShoppingItem(
+                    ingredient_id, row.get("name")
+                )
+            item.add(row.get("amount"), multiplier)
+
+    return items
+
+
+def write_shopping_list(
+    tx: Transaction, user_id: int, name: str, items: dict[int, ShoppingItem]
+) -> int:
+    """
+    Creates a list holding every item, adding the items in one batch. Returns the
+    new list's ID. Lists store which ingredients are on them but not how much, so the
+    added up amounts are only for showing
+    """
+    list_id = tx.callproc("create_list", [name, user_id])[0].get("list_id")
+    tx.callproc_many("create_list_item", [[ing_id, list_id] for ing_id in items])
+    return list_id
@@ -1,22 +1,63 @@
-import pymysql
-from pymysql import cursors, DatabaseError
 import sys
+import threading
+import time
 from helpers import *
+from cache import CachedDatabase, ResultCache
+from identity_map import IdentityMap
+from prefetch import Prefetcher
 from getpass import getpass
+from concurrent.futures import Future
+from config import database_key, db_settings, is_embedded, open_database
+from metrics import instrument
+from profiling import screen_profiler
 
 
 class State:
     """
     A class that holds commonly used data across the whole program such as the database
-    cursor and information about the user as well as any messages that could be printed
-    by different areas of the program
+    connection pool, the objects loaded so far and information about the user as well as
+    any messages that could be printed by different areas of the program
     """
 
-    def __init__(self, cur: cursors.DictCursor, user_id: int, username: str):
-        self.cur = cur
+    def __init__(
+        self, db: CachedDatabase, user_id: int, username: str, db_key: str = ""
+    ):
+        self.db = db
         self.user_id = user_id
         self.username = username
+        # names the database in the paths of files saved for the user, from
+        # config.database_key
+        self.db_key = db_key
         self.message = ""
+        # every recipe, ingredient, category, list and review loaded this session
+        self.identities = IdentityMap()
+        # the user's recipe search index, loaded the first time they search
+        self.search_index = None
+        # the writes made as of the search index's last sync, None before the first
+        self.search_synced = None
+        # the ingredients of each of the user's recipes, loaded the first time it is needed
+        self.pantry_index = None
+        # the writes made as of the pantry index's last sync, None before the first
+        self.pantry_synced = None
+        # rating statistics of every reviewed recipe, built the first time one is shown
+        self.ratings = None
+        # reads the details of listed recipes in the background while the user chooses
+        self.prefetcher = Prefetcher(db)
+        # latency of every database call, recorded only when RECIPEMASTER_METRICS is set
+        self.metrics = None
+        # profiles each screen shown, only when RECIPEMASTER_PROFILE is set
+        self.profiler = screen_profiler()
+        # whether reads come from the offline copy because the server is unreachable
+        self.offline = False
+        # the offline copy being saved since logging in, a Future
+        self.offline_copy = None
+
+    @property
+    def written(self):
+        """
+        The number of calls to each procedure that wrote to the database this session
+        """
+        return self.db.written
 
     def update_message(self, m: str):
         self.message = m
@@ -34,37 +75,39 @@ class State:
 
 
 def main():
-    print("Please log in to the local MySQL server:")
-    username = input("Username: ")
-    password = getpass("Password: ")
-
-    try:
-        cnx = pymysql.connect(
-            host="localhost",
-            user=username,
-            password=password,
-            db="recipemaster",
-            charset="utf8mb4",
-        )
-    except pymysql.err.OperationalError as e:
-        print(e)
-        print("Could not connect... shutting down")
-        sys.exit()
-
-    cur = cnx.cursor(cursor=cursors.DictCursor)
+    settings = db_settings()
+    if not is_embedded(settings) and (
+        "user" not in settings or "password" not in settings
+    ):
+        print("Please log in to the local MySQL server:")
+        if "user" not in settings:
+            settings["user"] = input("Username: ")
+        if "password" not in settings:
+            settings["password"] = getpass("Password: ")
+
+    # load the database driver and open the first connection while the user logs in,
+    # so neither holds up the first prompt
+    connecting = connect_in_background(settings)
+    db_key = database_key(settings)
 
     print_menu("Log in or create a new user for RecipeMaster", ["Log in", "New user"])
     choice = get_num_input(1, 2, "Go to")
     match choice:
         case 1:
             # Logging into an already existing account
+            offline = False
             while True:
                 username = input("Username: ")
                 password = getpass("Password: ")
 
-                cur.execute("SELECT get_user_id(%s, %s)", [username, password])
-
-                user_id = cur.fetchone().get(f"get_user_id('{username}', '{password}')")
+                db = wait_for_connection(connecting, db_key)
+                if db is None:
+                    db, user_id = log_in_offline(db_key, username, password)
+                    offline = True
+                else:
+                    user_id = db.execute(
+                        "SELECT get_user_id(%s, %s) AS user_id", [username, password]
+                    )[0].get("user_id")
 
                 if user_id != -1:
                     new_user = False
@@ -77,29 +120,281 @@ def main():
                 username = input("Username: ")
                 password = getpass("Password: ")
 
+                db = wait_for_connection(connecting, db_key)
+                if db is None:
+                    print(
+                        "New users can only be created while connected, shutting down"
+                    )
+                    sys.exit()
+                # the driver is only imported once connecting has started
+                from pymysql import DatabaseError
+
                 try:
-                    user_id = call_proc(cur, "create_user", [username, password])
+                    user_id = call_proc(db, "create_user", [username, password])
                     user_id = user_id[0].get("user_id")
                 except DatabaseError as e:
                     if e.args[0] == DUPLICATE_CODE:
                         print("User already exists with that username, try again")
                     else:
                         print("Error creating new user, try again")
-                finally:
-                    new_user = True
-                    break
+                    continue
+
+                new_user = True
+                offline = False
+                break
 
     clear_screen()
 
-    state = State(cur, user_id, username)
+    # reads for the rest of the session go through a cache scoped to this user
+    state = State(
+        CachedDatabase(db, ResultCache(), user_id),
+        user_id,
+        username,
+        db_key,
+    )
+    state.metrics = getattr(db, "metrics", None)
+    state.offline = offline
+    if offline:
+        state.update_message(
+            "Working offline from the copy saved when you last logged in, changes to "
+            "lists are synced the next time you log in while connected"
+        )
+    else:
+        if not is_embedded(settings):
+            sync_offline_changes(state, db, password)
+        # start reading the user's catalog while the main menu is up
+        state.prefetcher.catalog(user_id)
     if new_user:
         state.update_message(f"Created new user with ID {user_id}")
 
     # Entering point for the rest of the application, once this function returns, the program ends
-    main_menu(state)
+    run_screens(state, main_menu)
+
+    state.prefetcher.close()
+    stats = state.db.cache.stats()
+    print(
+        f"Shutting down... ({stats['hits']} of {stats['hits'] + stats['misses']} "
+        "reads served from the cache)"
+    )
+    if not state.offline and not is_embedded(settings):
+        finish_offline_copy(state, db, password)
+    if state.metrics is not None:
+        dump_metrics(state)
+    if state.profiler is not None:
+        report_profile(state)
+    db.close()
+
+
+def connect_in_background(settings: dict[str, str]) -> Future:
+    """
+    Imports the database driver and opens the database on another thread, along with
+    the first connection of a MySQL connection pool. Returns a Future for the database
+    """
+    future = Future()
+
+    def connect():
+        try:
+            db = open_database(settings)
+            if not is_embedded(settings):
+                db.release(db.acquire())
+            db = instrument(db)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(db)
+
+    threading.Thread(target=connect, name="connect", daemon=True).start()
+    return future
+
+
+def wait_for_connection(connecting: Future, db_key: str):
+    """
+    Waits for the database being opened in the background and returns it. If the
+    server could not be reached, returns None when there is an offline copy of the
+    database named by db_key to work from instead, and otherwise shuts down
+    """
+    import sqlite3
+
+    from pymysql.err import OperationalError
+
+    try:
+        return connecting.result()
+    except (ValueError, sqlite3.Error) as e:
+        # bad settings, or an embedded database file that cannot be opened
+        print(e)
+    except (OperationalError, OSError) as e:
+        from offline import UNREACHABLE_CODES, has_snapshots
+
+        # a refused login or an unknown database is not fixed by working offline
+        unreachable = not isinstance(e, OperationalError) or (
+            e.args[0] in UNREACHABLE_CODES
+        )
+        if unreachable and has_snapshots(db_key):
+            return None
+        print(e)
+
+    print("Could not connect... shutting down")
+    sys.exit()
+
+
+def log_in_offline(db_key: str, username: str, password: str):
+    """
+    Checks the credentials against the user's offline copy, returning a database
+    serving it and the user's ID, or None and -1 if they do not match one
+    """
+    from offline import Journal, OfflineDatabase, Snapshot, journal_path, snapshot_path
+
+    snapshot = Snapshot.load(snapshot_path(db_key, username))
+    if snapshot is None or not snapshot.check_password(password):
+        return None, -1
+
+    db = OfflineDatabase(snapshot, Journal(journal_path(db_key, username)))
+    return instrument(db), snapshot.user_id
+
+
+def sync_offline_changes(state: State, db, password: str):
+    """
+    Replays the changes made while offline, if there are any, and brings the offline
+    copy up to date with them in the background
+    """
+    from offline import (
+        Journal,
+        changed_sections,
+        conflicts_path,
+        journal_path,
+        log_conflicts,
+        replay,
+    )
+    from pymysql import DatabaseError
+
+    journal = Journal(journal_path(state.db_key, state.username))
+    sections = ()
+    pending = journal.pending()
+    if pending:
+        try:
+            report = replay(db, journal, state.user_id)
+        except DatabaseError as e:
+            print(e)
+            state.update_message("Error syncing changes made offline, will retry")
+        else:
+            sections = changed_sections(entry["proc"] for entry in pending)
+            log_conflicts(
+                conflicts_path(state.db_key, state.username), report.conflicts
+            )
+            message = str(report)
+            if report.conflicts:
+                message += f" (see {conflicts_path(state.db_key, state.username)})"
+            state.update_message(message)
+
+    # reads straight from the database, so the copy is never served from the cache
+    state.offline_copy = save_offline_copy(state, db, password, sections)
+
+
+def save_offline_copy(state: State, db, password: str, sections=()) -> Future:
+    """
+    Brings the user's data to work offline from, if the server cannot be reached
+    later, up to date on another thread. Only the given sections are read again,
+    unless the copy has to be taken whole. Returns a Future for when it is saved
+    """
+    from offline import save_snapshot
+
+    future = Future()
+
+    def save():
+        try:
+            save_snapshot(
+                db, state.db_key, state.user_id, state.username, password, sections
+            )
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    threading.Thread(target=save, name="offline-copy", daemon=True).start()
+    return future
+
+
+def finish_offline_copy(state: State, db, password: str):
+    """
+    Saves what was changed this session to the offline copy, giving up after
+    SNAPSHOT_SAVE_TIMEOUT seconds. A copy left unfinished is taken whole the next time
+    the user logs in
+    """
+    from offline import SNAPSHOT_SAVE_TIMEOUT, changed_sections
+    from pymysql import DatabaseError
+
+    deadline = time.monotonic() + SNAPSHOT_SAVE_TIMEOUT
+    try:
+        if state.offline_copy is not None:
+            try:
+                state.offline_copy.result(SNAPSHOT_SAVE_TIMEOUT)
+            except (DatabaseError, OSError):
+                # the copy is taken whole below instead, if anything changed
+                pass
+
+        sections = changed_sections(state.db.written)
+        if sections:
+            save_offline_copy(state, db, password, sections).result(
+                max(0.0, deadline - time.monotonic())
+            )
+    except TimeoutError:
+        print("Could not save the offline copy in time, it is saved at the next login")
+    except (DatabaseError, OSError) as e:
+        print(e)
+        print("Could not save the offline copy")
+
+
+def run_screens(state: State, screen):
+    """
+    Shows screens one after another until one of them asks to exit. Each screen is a
+    function that takes the state and returns the next screen to show, or None to exit,
+    so navigating between menus never grows the call stack. When profiling, each screen
+    is run under the profiler
+    """
+    profiler = state.profiler
+    while screen is not None:
+        if profiler is None:
+            screen = screen(state)
+        else:
+            screen = profiler.run(screen, state)
+
+
+def report_profile(state: State):
+    """
+    Prints the time spent in each screen and the functions that took the most, and
+    saves every screen's profile
+    """
+    fields, rows = state.profiler.screen_report()
+    print_table(fields, rows, page_size=len(rows) or 1)
+    fields, rows = state.profiler.hot_functions()
+    print_table(fields, rows, page_size=len(rows) or 1)
+    print(f"Profiles saved to {state.profiler.save()}")
+
+
+def dump_metrics(state: State):
+    """
+    Prints the latency of every procedure called so far and saves it as JSON
+    """
+    fields, rows = state.metrics.report()
+    print_table(fields, rows, page_size=len(rows) or 1)
+    path = state.metrics.dump_json()
+    print(
+        f"{state.metrics.slow_calls} call(s) slower than "
+        f"{state.metrics.slow_threshold * 1000:.0f} ms logged to "
+        f"{state.metrics.slow_log_path}"
+    )
+    print(f"Metrics saved to {path}")
+
+
+def metrics_screen(state: State):
+    clear_screen()
+
+    print("Database calls this session\n")
+    dump_metrics(state)
 
-    print("Shutting down...")
-    cnx.close()
+    print_menu("\nChoose an action", ["Go back"])
+    get_num_input(1, 1, "Go to")
+    return main_menu
 
 
 def main_menu(state: State):
@@ -108,33 +403,37 @@ def main_menu(state: State):
     state.print_message_reset()
 
     print_menu(
-        f"Welcome to RecipeMaster, {state.username}! To get started, choose one of the options below",
+        f"Welcome to RecipeMaster, {state.username}{' (offline)' if state.offline else ''}! "
+        "To get started, choose one of the options below",
         ["Recipes", "Ingredients", "Lists", "Reviews", "Exit"],
     )
 
-    choice = get_num_input(1, 5, "Go to")
+    # 0 is a hidden entry showing the database metrics, when they are being recorded
+    choice = get_num_input(0 if state.metrics is not None else 1, 5, "Go to")
 
     match choice:
+        case 0:
+            return metrics_screen
         case 1:
             # Opens the recipe menu
             from recipe import recipe_module
 
-            recipe_module(state)
+            return recipe_module
         case 2:
             # Opens the ingredient menu
             from ingredient import ingredient_module
 
-            ingredient_module(state)
+            return ingredient_module
         case 3:
             # Opens the list menu
             from list import list_module
 
-            list_module(state)
+            return list_module
         case 4:
             # Opens the review menu
             from review import review_module
 
-            review_module(state)
+            return review_module
         case 5:
             # Exits the program
             return
@@ -0,0 +1,58 @@
+from cache import CachedDatabase, ResultCache, changed_sections
+
+
+class FakeDatabase:
+    """
+    Returns a new row on every read, counting the reads that reached it
+    """
+
+    def __init__(self):
+        self.reads = 0
+        # called in the middle of each read, standing in for another thread
+        self.during_read = None
+
+    def callproc(self, proc_name: str, args: list = []):
+        self.reads += 1
+        if self.during_read is not None:
+            self.during_read()
+        return ({"recipe_id": 1, "name": f"Soup {self.reads}"},)
+
+    def callproc_tuples(self, proc_name: str, args: list = []):
+        rows = self.callproc(proc_name, args)
+        return {"recipe_id": 0, "name": 1}, tuple(tuple(row.values()) for row in rows)
+
+
+def test_changing_rows_read_does_not_change_the_cache():
+    db = CachedDatabase(FakeDatabase(), ResultCache(), 1)
+
+    db.callproc("get_all_recipes_for_user", [1])[0]["name"] = "Changed"
+    db.callproc_tuples("get_all_recipes_for_user", [1])[0]["name"] = 5
+
+    assert db.callproc("get_all_recipes_for_user", [1])[0]["name"] == "Soup 1"
+    assert db.callproc_tuples("get_all_recipes_for_user", [1])[0]["name"] == 1
+    assert db.db.reads == 2
+
+
+def test_rows_read_while_the_cache_was_invalidated_are_not_cached():
+    fake = FakeDatabase()
+    db = CachedDatabase(fake, ResultCache(), 1)
+    fake.during_read = lambda: db.cache.invalidate(1)
+
+    db.callproc("get_all_recipes_for_user", [1])
+    fake.during_read = None
+    rows = db.callproc("get_all_recipes_for_user", [1])
+
+    assert rows[0]["name"] == "Soup 2"
+
+
+def test_writes_since_a_copy_give_the_sections_they_changed():
+    db = CachedDatabase(FakeDatabase(), ResultCache(), 1)
+    db.callproc("update_recipe", ["Soup", "", 0, 1])
+    seen = db.written.copy()
+
+    db.callproc("create_review", [1, 1, 5, ""])
+    assert changed_sections(db.written - seen) == set()
+
+    db.callproc("update_recipe", ["Stew", "", 0, 1])
+    db.callproc("create_list", ["Groceries", 1])
+    assert changed_sections(db.written - seen) == {"recipes", "lists"}
@@ -0,0 +1,242 @@
+import ast
+import glob
+import json
+import os
+import threading
+
+import pytest
+
+from embedded import PROCEDURES, CreateUser, SQLiteDatabase
+from helpers import NOT_FOUND_CODE
+from ingredient import Ingredient
+from list import List
+from pool import BATCH_PROCS
+from prefetch import CATALOG_PROCS, RECIPE_DETAIL_PROCS
+from recipe import Category, Recipe
+from review import Review
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Functions and methods taking a procedure's name and then its arguments, after the
+# database for the helpers
+PROC_CALLS = {
+    "callproc": 0,
+    "callproc_tuples": 0,
+    "callproc_many": 0,
+    "stream": 0,
+    "warm": 0,
+    "call_proc": 1,
+    "call_proc_tuples": 1,
+    "call_proc_grouped": 1,
+}
+
+# The procedures each model is built from, whose results must have its columns
+MODEL_PROCS = [
+    (Ingredient, "get_all_ingredients_for_user"),
+    (Recipe, "get_all_recipes_for_user"),
+    (Category, "get_all_categories_for_user"),
+    (List, "get_all_lists_for_user"),
+    (Review, "get_all_reviews"),
+    (Review, "get_reviews_after"),
+    (Review, "get_reviews_for_user"),
+]
+
+
+def arg_count(procedure) -> int:
+    # create_user is given the password, which it turns into a hash and salt
+    return 2 if isinstance(procedure, CreateUser) else len(procedure.params)
+
+
+def proc_call_sites():
+    """
+    Yields (where, procedure name, number of arguments or None if it cannot be told)
+    for every call in the app naming a procedure
+    """
+    for path in sorted(glob.glob(os.path.join(ROOT, "*.py"))):
+        if os.path.basename(path).startswith("test_"):
+            continue
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            func = node.func
+            name = getattr(func, "attr", None) or getattr(func, "id", "")
+            if name not in PROC_CALLS or len(node.args) <= PROC_CALLS[name]:
+                continue
+
+            proc, *rest = node.args[PROC_CALLS[name] :]
+            if not (isinstance(proc, ast.Constant) and isinstance(proc.value, str)):
+                continue
+
+            args = rest[0] if rest else None
+            if name == "callproc_many":
+                # the rows of arguments, written out or built by a comprehension
+                if isinstance(args, ast.ListComp):
+                    args = args.elt
+                elif isinstance(args, ast.List) and args.elts:
+                    args = args.elts[0]
+                else:
+                    args = None
+
+            where = f"{os.path.basename(path)}:{node.lineno}"
+            if args is None and name != "callproc_many":
+                yield where, proc.value, 0
+            elif isinstance(args, ast.List):
+                yield where, proc.value, len(args.elts)
+            else:
+                yield where, proc.value, None
+
+            if name == "call_proc_grouped":
+                # the fallback, called with one parent's ID at a time
+                yield where, node.args[4].value, 1
+
+
+@pytest.fixture
+def db():
+    db = SQLiteDatabase(":memory:")
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("where, proc_name, count", list(proc_call_sites()))
+def test_procedures_are_called_with_their_arguments(where, proc_name, count):
+    assert proc_name in PROCEDURES, f"{where} calls {proc_name}, which does not exist"
+    if count is not None:
+        assert count == arg_count(PROCEDURES[proc_name]), where
+
+
+@pytest.mark.parametrize("proc_name", CATALOG_PROCS + RECIPE_DETAIL_PROCS)
+def test_prefetched_procedures_take_one_id(proc_name):
+    # they are read ahead with just the user's or the recipe's ID
+    assert arg_count(PROCEDURES[proc_name]) == 1
+
+
+@pytest.mark.parametrize("model, proc_name", MODEL_PROCS)
+def test_results_have_the_columns_of_their_models(db, model, proc_name):
+    args = [0] * arg_count(PROCEDURES[proc_name])
+    columns, _ = db.callproc_tuples(proc_name, args)
+    assert set(model.COLUMNS.values()) <= set(columns)
+
+
+@pytest.mark.parametrize(
+    "proc_name, args, expected",
+    [
+        (
+            "get_reviews_after",
+            [0, 10],
+            "get_all_reviews",
+        ),
+        ("get_reviews_for_user", [0], "get_all_reviews"),
+    ],
+)
+def test_review_pages_have_the_columns_of_every_review(db, proc_name, args, expected):
+    assert list(db.callproc_tuples(proc_name, args)[0]) == list(
+        db.callproc_tuples(expected)[0]
+    )
+
+
+@pytest.mark.parametrize(
+    "proc_name, args, expected",
+    [
+        (
+            "get_review_ratings",
+            [0],
+            ["review_id", "recipe_id", "recipe_name", "rating", "date_created"],
+        ),
+        (
+            "get_recipe_ingredients_for_user",
+            [0],
+            ["recipe_id", "ingredient_id", "name", "amount"],
+        ),
+    ],
+)
+def test_optional_procedures_have_their_documented_columns(
+    db, proc_name, args, expected
+):
+    assert list(db.callproc_tuples(proc_name, args)[0]) == expected
+
+
+@pytest.mark.parametrize(
+    "proc_name, group_column, expected",
+    [
+        ("get_list_items_for_user", "list_id", "get_ingredients_for_list"),
+        ("get_recipe_categories_for_user", "recipe_id", "get_categories_for_recipe"),
+    ],
+)
+def test_grouped_procedures_have_the_columns_of_each_group(
+    db, proc_name, group_column, expected
+):
+    columns = list(db.callproc_tuples(proc_name, [0])[0])
+    assert columns == [group_column] + list(db.callproc_tuples(expected, [0])[0])
+
+
+@pytest.mark.parametrize("proc_name, batch_proc", list(BATCH_PROCS.items()))
+def test_batch_procedures_add_the_rows_of_each_call(db, proc_name, batch_proc):
+    user_id = db.callproc("create_user", ["cook", "secret"])[0]["user_id"]
+    recipe_id = db.callproc("create_recipe", ["Soup", "", 0, user_id])[0]["recipe_id"]
+    list_id = db.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    ids = [
+        db.callproc("create_ingredient", [name, user_id])[0]["ingredient_id"]
+        for name in ["Salt", "Leek"]
+    ]
+    if proc_name == "add_recipe_to_category":
+        ids = [
+            db.callproc("create_category", [name, user_id])[0]["category_id"]
+            for name in ["Soups", "Quick"]
+        ]
+    arg_rows = {
+        "add_ingredient_to_recipe": [[i, "1 tsp", recipe_id] for i in ids],
+        "add_recipe_to_category": [[recipe_id, i] for i in ids],
+        "create_list_item": [[i, list_id] for i in ids],
+    }[proc_name]
+
+    db.callproc(batch_proc, [json.dumps(arg_rows)])
+
+    read_proc, args = {
+        "add_ingredient_to_recipe": ("get_ingredients_for_recipe", [recipe_id]),
+        "add_recipe_to_category": ("get_categories_for_recipe", [recipe_id]),
+        "create_list_item": ("get_ingredients_for_list", [list_id]),
+    }[proc_name]
+    rows = db.callproc(read_proc, args)
+    id_column = (
+        "category_id" if proc_name == "add_recipe_to_category" else "ingredient_id"
+    )
+    assert sorted(row[id_column] for row in rows) == sorted(ids)
+
+
+def test_batches_fail_on_a_row_that_changes_nothing(db):
+    from pymysql.err import IntegrityError
+
+    user_id = db.callproc("create_user", ["cook", "secret"])[0]["user_id"]
+    list_id = db.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    salt = db.callproc("create_ingredient", ["Salt", user_id])[0]["ingredient_id"]
+    db.callproc("create_list_item", [salt, list_id])
+    item_id = db.callproc("get_ingredients_for_list", [list_id])[0]["item_id"]
+
+    with pytest.raises(IntegrityError) as error:
+        with db.transaction() as tx:
+            tx.callproc_many(
+                "toggle_item_status_in_list",
+                [[item_id, list_id, 1], [item_id + 12345, list_id, 1]],
+            )
+
+    assert error.value.args[0] == NOT_FOUND_CODE
+    rows = db.callproc("get_ingredients_for_list", [list_id])
+    assert [row["completed"] for row in rows] == [0]
+
+
+def test_in_memory_databases_are_shared_between_threads(db):
+    user_id = db.callproc("create_user", ["cook", "secret"])[0]["user_id"]
+    created = []
+    thread = threading.Thread(
+        target=lambda: created.append(
+            db.callproc("create_recipe", ["Soup", "", 0, user_id])[0]["recipe_id"]
+        )
+    )
+    thread.start()
+    thread.join()
+
+    recipes = db.callproc("get_all_recipes_for_user", [user_id])
+    assert [row["recipe_id"] for row in recipes] == created
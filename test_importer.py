@@ -0,0 +1,200 @@
+import io
+
+import pytest
+
+from embedded import SQLiteDatabase
+from exporter import RECIPE_FIELDS, CsvWriter, GroupedStream, iter_lists, iter_recipes
+from importer import (
+    RecipeImportError,
+    clean_records,
+    import_recipes,
+    read_csv,
+    read_jsonl,
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "recipes.db"))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def user_id(db):
+    return db.callproc("create_user", ["cook", "secret"])[0]["user_id"]
+
+
+def test_jsonl_records_are_cleaned():
+    lines = [
+        '{"name": " Bread ", "cooking_time": "30", '
+        '"ingredients": [{"name": "Flour", "amount": "2 cups"}, '
+        '{"name": "flour", "amount": "1 cup"}, {"name": " ", "amount": "1"}], '
+        '"categories": ["Baking", "baking", ""]}',
+        "",
+        '{"type": "review", "text": "skipped"}',
+    ]
+
+    assert list(clean_records(read_jsonl(lines))) == [
+        {
+            "name": "Bread",
+            "instructions": "",
+            "cooking_time": 30,
+            "ingredients": {"Flour": "2 cups"},
+            "categories": ["Baking"],
+            "line": 1,
+        }
+    ]
+
+
+def test_csv_records_are_cleaned():
+    f = io.StringIO(
+        "name,instructions,cooking_time,ingredients,categories\n"
+        'Soup,Boil,600,"water:1 l;salt:1 tsp",Dinner;Quick\n'
+    )
+
+    (record,) = clean_records(read_csv(f))
+    assert record["ingredients"] == {"water": "1 l", "salt": "1 tsp"}
+    assert record["categories"] == ["Dinner", "Quick"]
+
+
+def test_exported_csv_is_imported_unchanged(tmp_path):
+    record = {
+        "name": "Brine; strong",
+        "ingredients": [
+            {"name": "salt: coarse", "amount": "1;2 cups"},
+            {"name": "back\\slash", "amount": "a:b\\"},
+        ],
+        "categories": ["Pickles; ferments", "a:b"],
+    }
+    path = str(tmp_path / "recipes.csv")
+    writer = CsvWriter(path, RECIPE_FIELDS)
+    writer.write(record)
+    writer.close()
+
+    with open(path, encoding="utf-8", newline="") as f:
+        (imported,) = clean_records(read_csv(f))
+    assert imported["name"] == record["name"]
+    assert imported["ingredients"] == {
+        "salt: coarse": "1;2 cups",
+        "back\\slash": "a:b\\",
+    }
+    assert imported["categories"] == record["categories"]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        '["not", "a", "record"]',
+        '"Bread"',
+        '{"name": "Bread", "ingredients": ["flour"]}',
+        '{"name": "Bread", "ingredients": "flour"}',
+        '{"name": "Bread", "ingredients": [{"name": 5}]}',
+        '{"name": "Bread", "categories": [1]}',
+        '{"name": "Bread", "cooking_time": "soon"}',
+        '{"name": ""}',
+        "{not json",
+    ],
+)
+def test_invalid_records_raise_import_errors(line):
+    with pytest.raises(RecipeImportError, match="Line 1"):
+        list(clean_records(read_jsonl([line])))
+
+
+def test_records_that_are_not_objects_raise_import_errors():
+    with pytest.raises(RecipeImportError):
+        list(clean_records(["Bread"]))
+
+
+def test_names_differing_in_case_reuse_existing_rows(db, user_id):
+    flour_id = db.callproc("create_ingredient", ["Flour", user_id])[0]["ingredient_id"]
+    baking_id = db.callproc("create_category", ["Baking", user_id])[0]["category_id"]
+    records = [
+        {
+            "name": "Bread",
+            "ingredients": [{"name": "flour", "amount": "2 cups"}],
+            "categories": ["BAKING"],
+        },
+        {
+            "name": "Cake",
+            "ingredients": [
+                {"name": "FLOUR", "amount": "1 cup"},
+                {"name": "Sugar", "amount": "1 cup"},
+            ],
+        },
+        {"name": "Cookies", "ingredients": [{"name": "sugar", "amount": "1 tbsp"}]},
+    ]
+
+    report = import_recipes(db, user_id, clean_records(records), 2, lambda _: None)
+
+    assert report.recipes == 3
+    assert report.created_ingredients == 1
+    assert report.created_categories == 0
+
+    recipes = {
+        row["name"]: row["recipe_id"]
+        for row in db.callproc("get_all_recipes_for_user", [user_id])
+    }
+    bread = db.callproc("get_ingredients_for_recipe", [recipes["Bread"]])
+    assert [row["ingredient_id"] for row in bread] == [flour_id]
+    categories = db.callproc("get_categories_for_recipe", [recipes["Bread"]])
+    assert [row["category_id"] for row in categories] == [baking_id]
+    cookies = db.callproc("get_ingredients_for_recipe", [recipes["Cookies"]])
+    assert [row["name"] for row in cookies] == ["Sugar"]
+
+
+def test_duplicate_recipes_raise_import_errors_with_their_line(db, user_id):
+    db.callproc("create_recipe", ["Bread", "", 0, user_id])
+    lines = ['{"name": "Soup"}', '{"name": "Bread"}']
+
+    with pytest.raises(RecipeImportError, match="Line 2: a recipe named 'Bread'"):
+        import_recipes(db, user_id, clean_records(read_jsonl(lines)), 10, print)
+
+    # the chunk holding the duplicate is rolled back
+    names = [row["name"] for row in db.callproc("get_all_recipes_for_user", [user_id])]
+    assert names == ["Bread"]
+
+
+def test_exported_recipes_and_lists_have_their_own_rows(db, user_id):
+    records = [
+        {"name": "Bread", "ingredients": [{"name": "Flour", "amount": "2 cups"}]},
+        {"name": "Water"},
+        {"name": "Cake", "ingredients": [{"name": "Sugar", "amount": "1 cup"}]},
+    ]
+    import_recipes(db, user_id, clean_records(records), 10, lambda _: None)
+    sugar_id = db.callproc("get_all_ingredients_for_user", [user_id])[1][
+        "ingredient_id"
+    ]
+    db.callproc("create_list", ["Empty", user_id])
+    list_id = db.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    db.callproc("create_list_item", [sugar_id, list_id])
+
+    recipes = {r["name"]: r["ingredients"] for r in iter_recipes(db, user_id)}
+    lists = {r["name"]: r["items"] for r in iter_lists(db, user_id)}
+
+    assert recipes == {
+        "Bread": [{"name": "Flour", "amount": "2 cups"}],
+        "Water": [],
+        "Cake": [{"name": "Sugar", "amount": "1 cup"}],
+    }
+    assert lists == {"Empty": [], "Groceries": [{"name": "Sugar", "completed": False}]}
+
+
+class FallbackReads:
+    def __init__(self):
+        self.calls = []
+
+    def callproc(self, proc_name: str, args: list = []):
+        self.calls.append(args[0])
+        return ({"name": f"read {args[0]}"},)
+
+
+def test_grouped_rows_out_of_order_are_read_on_their_own():
+    db = FallbackReads()
+    rows = iter([{"recipe_id": 1, "name": "a"}, {"recipe_id": 3, "name": "b"}])
+    stream = GroupedStream(db, rows, "recipe_id", "get_ingredients_for_recipe")
+
+    assert stream.rows_for(3) == [{"recipe_id": 3, "name": "b"}]
+    assert stream.rows_for(1) == [{"name": "read 1"}]
+    assert stream.rows_for(4) == []
+    assert db.calls == [1]
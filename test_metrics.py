@@ -0,0 +1,61 @@
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from metrics import InstrumentedDatabase, ProcedureMetrics
+
+# Seconds each fake row takes to read, and the caller takes with each row
+ROW_DELAY = 0.01
+WORK_DELAY = 0.05
+
+
+class SlowStream:
+    """
+    A database streaming three rows, each taking ROW_DELAY to read
+    """
+
+    @contextmanager
+    def stream(self, proc_name: str, args: list = []):
+        def rows():
+            for i in range(3):
+                time.sleep(ROW_DELAY)
+                if proc_name == "broken" and i == 1:
+                    raise RuntimeError("lost connection")
+                yield {"id": i}
+
+        yield rows()
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    return ProcedureMetrics(slow_log_path=str(tmp_path / "slow.log"))
+
+
+def test_streams_are_timed_without_the_callers_work(metrics):
+    db = InstrumentedDatabase(SlowStream(), metrics)
+
+    with db.stream("get_all_reviews") as rows:
+        for _ in rows:
+            time.sleep(WORK_DELAY)
+
+    stats = metrics.snapshot()["get_all_reviews"]
+    assert stats["rows"] == 3
+    assert 3 * ROW_DELAY * 1000 <= stats["total_ms"] < 3 * WORK_DELAY * 1000
+    assert stats["errors"] == {}
+
+
+def test_only_the_streams_own_errors_are_recorded(metrics):
+    db = InstrumentedDatabase(SlowStream(), metrics)
+
+    with pytest.raises(ValueError):
+        with db.stream("get_all_reviews") as rows:
+            next(rows)
+            raise ValueError("the caller failed")
+    with pytest.raises(RuntimeError):
+        with db.stream("broken") as rows:
+            list(rows)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["get_all_reviews"]["errors"] == {}
+    assert snapshot["broken"]["errors"] == {"lost connection": 1}
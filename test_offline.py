@@ -0,0 +1,258 @@
+import os
+from concurrent.futures import Future
+
+import pymysql
+import pytest
+
+import offline as offline_module
+from embedded import SQLiteDatabase
+from offline import (
+    SNAPSHOT_SECTIONS,
+    Journal,
+    OfflineDatabase,
+    Snapshot,
+    changed_sections,
+    replay,
+    save_snapshot,
+    snapshot_path,
+)
+from source import wait_for_connection
+
+
+@pytest.fixture
+def server(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "server.db"))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def user_id(server):
+    return server.callproc("create_user", ["cook", "secret"])[0]["user_id"]
+
+
+@pytest.fixture
+def offline(server, user_id, tmp_path):
+    def go_offline() -> OfflineDatabase:
+        snapshot = Snapshot.take(server, user_id, "cook", "secret")
+        return OfflineDatabase(snapshot, Journal(str(tmp_path / "journal.jsonl")))
+
+    return go_offline
+
+
+def list_names(db, user_id: int) -> list[str]:
+    return [row["name"] for row in db.callproc("get_all_lists_for_user", [user_id])]
+
+
+def test_offline_writes_are_replayed_with_server_ids(server, user_id, offline):
+    flour = server.callproc("create_ingredient", ["Flour", user_id])[0]
+    db = offline()
+
+    list_id = db.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    item_id = db.callproc("create_list_item", [flour["ingredient_id"], list_id])[0][
+        "item_id"
+    ]
+    db.callproc("toggle_item_status_in_list", [item_id, list_id, 1])
+    assert list_id < 0 and item_id < 0
+    assert list_names(db, user_id) == ["Groceries"]
+
+    report = replay(server, db.journal, user_id, batch_size=2)
+
+    assert (report.applied, report.skipped, report.conflicts) == (3, 0, [])
+    (server_list,) = server.callproc("get_all_lists_for_user", [user_id])
+    (item,) = server.callproc("get_ingredients_for_list", [server_list["list_id"]])
+    assert item["name"] == "Flour"
+    assert item["completed"] == 1
+    assert Journal(db.journal.path).pending() == []
+
+
+def test_writes_the_server_already_has_are_skipped(server, user_id, offline):
+    db = offline()
+    db.callproc("create_list", ["Groceries", user_id])
+    server.callproc("create_list", ["Groceries", user_id])
+
+    report = replay(server, db.journal, user_id)
+
+    assert (report.applied, report.skipped, report.conflicts) == (0, 1, [])
+    assert list_names(server, user_id) == ["Groceries"]
+
+
+def test_rows_changed_on_the_server_are_conflicts(server, user_id, offline):
+    recipe_id = server.callproc("create_recipe", ["Soup", "Boil", 10, user_id])[0][
+        "recipe_id"
+    ]
+    list_id = server.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    db = offline()
+
+    db.callproc("update_recipe", ["Stew", "Simmer", 60, recipe_id])
+    db.callproc("update_list_name", [list_id, "Shopping"])
+    db.callproc("create_list", ["Party", user_id])
+    server.callproc("update_recipe", ["Broth", "Boil", 10, recipe_id])
+    server.callproc("delete_list", [list_id])
+
+    report = replay(server, db.journal, user_id)
+
+    assert report.applied == 1
+    assert [entry["proc"] for entry, _ in report.conflicts] == [
+        "update_recipe",
+        "update_list_name",
+    ]
+    assert "changed on the server" in report.conflicts[0][1]
+    assert "no longer exists" in report.conflicts[1][1]
+    (recipe,) = server.callproc("get_all_recipes_for_user", [user_id])
+    assert recipe["name"] == "Broth"
+    assert list_names(server, user_id) == ["Party"]
+
+
+def test_writes_the_server_rejects_are_conflicts(server, user_id, offline):
+    db = offline()
+    list_id = db.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    db.callproc("update_list_name", [list_id, "Shopping"])
+    db.callproc("create_list", ["Party", user_id])
+    server.callproc("create_list", ["Shopping", user_id])
+
+    report = replay(server, db.journal, user_id)
+
+    # the batch is retried a write at a time, so only the rename is lost
+    assert report.applied == 2
+    ((entry, reason),) = report.conflicts
+    assert entry["proc"] == "update_list_name"
+    assert "rejected" in reason
+    assert sorted(list_names(server, user_id)) == ["Groceries", "Party", "Shopping"]
+
+
+def test_journal_resumes_after_the_last_replayed_write(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path)
+    journal.append("delete_list", [1], {})
+    journal.append("delete_list", [2], {})
+    journal.mark_applied(1)
+    with open(path, "a", encoding="utf-8") as f:
+        # a line cut short by a crash
+        f.write('{"seq": 3, "proc": "del')
+
+    reopened = Journal(path)
+    assert [entry["args"] for entry in reopened.pending()] == [[2]]
+
+
+def test_ids_given_out_offline_carry_on_after_the_journal_is_emptied(
+    server, user_id, offline
+):
+    db = offline()
+    db.callproc("create_list", ["Groceries", user_id])
+    replay(server, db.journal, user_id)
+
+    journal = Journal(db.journal.path)
+    assert journal.pending() == []
+    assert journal.next_id() == -2
+
+
+class CountingDatabase:
+    """
+    Passes calls on to a database, noting the name of each procedure called
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.calls = []
+
+    def callproc(self, proc_name: str, args: list = []):
+        self.calls.append(proc_name)
+        return self.db.callproc(proc_name, args)
+
+
+def test_snapshots_read_every_recipe_and_list_at_once(server, user_id):
+    for name in ["Soup", "Bread", "Salad"]:
+        server.callproc("create_recipe", [name, "", 0, user_id])
+        server.callproc("create_list", [name, user_id])
+    counting = CountingDatabase(server)
+
+    snapshot = Snapshot.take(counting, user_id, "cook", "secret")
+
+    assert len(counting.calls) == 8
+    assert snapshot.check_password("secret")
+    recipes = snapshot.results[("get_all_recipes_for_user", (user_id,))]
+    for recipe in recipes:
+        key = ("get_categories_for_recipe", (recipe["recipe_id"],))
+        assert snapshot.results[key] == []
+
+
+def test_saving_reads_only_the_changed_sections(server, user_id, tmp_path, monkeypatch):
+    monkeypatch.setattr(offline_module, "OFFLINE_DIR", str(tmp_path / "offline"))
+    save_snapshot(server, "db", user_id, "cook", "secret")
+    flour = server.callproc("create_ingredient", ["Flour", user_id])[0]
+    list_id = server.callproc("create_list", ["Groceries", user_id])[0]["list_id"]
+    server.callproc("create_list_item", [flour["ingredient_id"], list_id])
+    counting = CountingDatabase(server)
+
+    save_snapshot(counting, "db", user_id, "cook", "secret")
+    assert counting.calls == []
+
+    save_snapshot(
+        counting, "db", user_id, "cook", "secret", changed_sections(["create_list"])
+    )
+    assert set(counting.calls) == {"get_all_lists_for_user", "get_list_items_for_user"}
+
+    snapshot = Snapshot.load(snapshot_path("db", "cook"))
+    (item,) = snapshot.results[("get_ingredients_for_list", (list_id,))]
+    assert item["name"] == "Flour" and "list_id" not in item
+    # only the user may read it, since it holds their password hash
+    assert os.stat(snapshot_path("db", "cook")).st_mode & 0o777 == 0o600
+
+
+def test_unknown_writes_change_every_section():
+    assert changed_sections(["create_review"]) == set()
+    assert changed_sections(["UPDATE recipes SET name = ''"]) == set(SNAPSHOT_SECTIONS)
+
+
+def test_a_snapshot_left_partly_saved_is_taken_whole(
+    server, user_id, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(offline_module, "OFFLINE_DIR", str(tmp_path / "offline"))
+    save_snapshot(server, "db", user_id, "cook", "secret")
+    open(offline_module.stale_path("db", "cook"), "w").close()
+    counting = CountingDatabase(server)
+
+    save_snapshot(counting, "db", user_id, "cook", "secret")
+
+    assert len(counting.calls) == 8
+    assert not os.path.exists(offline_module.stale_path("db", "cook"))
+
+
+@pytest.mark.parametrize(
+    "error, goes_offline",
+    [
+        (pymysql.err.OperationalError(2003, "Can't connect"), True),
+        (pymysql.err.OperationalError(2013, "Lost connection"), True),
+        (ConnectionRefusedError(), True),
+        (pymysql.err.OperationalError(1045, "Access denied"), False),
+        (pymysql.err.OperationalError(1049, "Unknown database"), False),
+    ],
+)
+def test_only_an_unreachable_server_is_worked_around_offline(
+    server, user_id, tmp_path, monkeypatch, error, goes_offline
+):
+    monkeypatch.setattr(offline_module, "OFFLINE_DIR", str(tmp_path / "offline"))
+    save_snapshot(server, "db", user_id, "cook", "secret")
+    connecting = Future()
+    connecting.set_exception(error)
+
+    if goes_offline:
+        assert wait_for_connection(connecting, "db") is None
+    else:
+        with pytest.raises(SystemExit):
+            wait_for_connection(connecting, "db")
+
+
+def test_offline_copies_are_kept_apart_for_each_database(
+    server, user_id, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(offline_module, "OFFLINE_DIR", str(tmp_path / "offline"))
+    save_snapshot(server, "db", user_id, "cook", "secret")
+
+    assert offline_module.has_snapshots("db")
+    assert not offline_module.has_snapshots("other")
+    assert Snapshot.load(snapshot_path("other", "cook")) is None
+    assert offline_module.journal_path("db", "cook") != (
+        offline_module.journal_path("other", "cook")
+    )
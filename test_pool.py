@@ -0,0 +1,157 @@
+import pymysql
+import pytest
+
+from helpers import MISSING_PROC_CODE
+from pool import SERVER_GONE_CODE, SERVER_LOST_CODE, ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.description = (("recipe_id",),)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def callproc(self, proc_name, args):
+        self.cnx.server.calls.append(proc_name)
+        if self.cnx.server.failures:
+            raise pymysql.err.OperationalError(self.cnx.server.failures.pop(0), "lost")
+
+    execute = callproc
+
+    def fetchall(self):
+        return ({"recipe_id": 1},)
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def begin(self):
+        self.server.calls.append("BEGIN")
+
+    def commit(self):
+        self.server.calls.append("COMMIT")
+
+    def rollback(self):
+        self.server.calls.append("ROLLBACK")
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """
+    Records the calls that reach it and fails the first ones with the given codes
+    """
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = []
+        self.connections = 0
+
+    def connect(self):
+        self.connections += 1
+        return FakeConnection(self)
+
+
+@pytest.mark.parametrize("code", [SERVER_GONE_CODE, SERVER_LOST_CODE])
+def test_read_is_retried_on_a_fresh_connection(code):
+    server = FakeServer(code)
+    pool = ConnectionPool(server.connect)
+
+    assert pool.callproc("get_all_recipes_for_user", [1]) == ({"recipe_id": 1},)
+    assert server.calls == ["get_all_recipes_for_user"] * 2
+    assert server.connections == 2
+
+
+def test_tuple_read_is_retried():
+    server = FakeServer(SERVER_LOST_CODE)
+    pool = ConnectionPool(server.connect)
+
+    columns, rows = pool.callproc_tuples("get_all_recipes_for_user", [1])
+    assert columns == {"recipe_id": 0}
+    assert len(server.calls) == 2
+
+
+@pytest.mark.parametrize(
+    "proc_name", ["create_recipe", "create_review", "create_list_item", "delete_list"]
+)
+def test_write_is_not_retried(proc_name):
+    server = FakeServer(SERVER_LOST_CODE)
+    pool = ConnectionPool(server.connect)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.callproc(proc_name, ["x", 1])
+    assert server.calls == [proc_name]
+
+
+def test_query_is_not_retried():
+    server = FakeServer(SERVER_GONE_CODE)
+    pool = ConnectionPool(server.connect)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.execute("SELECT get_user_id(%s, %s) AS user_id", ["a", "b"])
+    assert len(server.calls) == 1
+
+
+def test_read_is_retried_only_once():
+    server = FakeServer(SERVER_LOST_CODE, SERVER_LOST_CODE)
+    pool = ConnectionPool(server.connect)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.callproc("get_all_recipes_for_user", [1])
+    assert len(server.calls) == 2
+
+
+def test_other_errors_are_not_retried():
+    server = FakeServer(1054)
+    pool = ConnectionPool(server.connect)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.callproc("get_all_recipes_for_user", [1])
+    assert len(server.calls) == 1
+
+
+def test_batch_sends_every_row_in_one_call_inside_the_transaction():
+    server = FakeServer()
+    pool = ConnectionPool(server.connect)
+
+    with pool.transaction() as tx:
+        tx.callproc_many("create_list_item", [[1, 2], [1, 3], [1, 4]])
+    assert server.calls == ["BEGIN", "create_list_items", "COMMIT"]
+
+
+def test_batch_calls_each_row_without_a_batch_procedure():
+    server = FakeServer(MISSING_PROC_CODE)
+    pool = ConnectionPool(server.connect)
+
+    for _ in range(2):
+        with pool.transaction() as tx:
+            tx.callproc_many("create_list_item", [[1, 2], [1, 3]])
+            tx.callproc_many("remove_item_from_list", [[5, 2], [6, 2]])
+
+    once = ["create_list_item"] * 2 + ["remove_item_from_list"] * 2 + ["COMMIT"]
+    # the missing batch procedure is only tried the first time
+    assert server.calls == ["BEGIN", "create_list_items"] + once + ["BEGIN"] + once
+
+
+def test_failed_batch_stops_and_rolls_back():
+    server = FakeServer()
+    pool = ConnectionPool(server.connect)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.transaction() as tx:
+            server.failures.append(1452)
+            tx.callproc_many("remove_item_from_list", [[5, 2], [6, 2]])
+    assert server.calls == ["BEGIN", "remove_item_from_list", "ROLLBACK"]
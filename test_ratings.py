@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+
+import pytest
+
+from embedded import SQLiteDatabase
+import leaderboard
+from leaderboard import Leaderboard
+from ratings import RATING_SCALE, RatingAggregates, RatingStats
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "recipes.db"))
+    yield db
+    db.close()
+
+
+def create_recipe(db, user_id: int, name: str) -> int:
+    return db.callproc("create_recipe", [name, "", 0, user_id])[0]["recipe_id"]
+
+
+def create_review(db, user_id: int, recipe_id: int, rating: int) -> int:
+    return db.callproc("create_review", [recipe_id, rating, "", user_id])[0][
+        "review_id"
+    ]
+
+
+@pytest.fixture
+def users(db):
+    return [
+        db.callproc("create_user", [name, "secret"])[0]["user_id"]
+        for name in ("ann", "bob")
+    ]
+
+
+def test_recipes_with_the_same_name_have_their_own_ratings(db, users):
+    ann, bob = users
+    ann_soup = create_recipe(db, ann, "Soup")
+    bob_soup = create_recipe(db, bob, "Soup")
+    create_review(db, bob, ann_soup, 9)
+    create_review(db, ann, bob_soup, 3)
+
+    ratings = RatingAggregates()
+    ratings.rebuild(db)
+
+    assert ratings.stats(ann_soup, "Soup").mean == 9
+    assert ratings.stats(bob_soup, "Soup").mean == 3
+    assert [ratings.names[key] for key, _ in ratings.best_rated(2)] == ["Soup"] * 2
+
+
+def test_saved_ratings_only_read_new_reviews(db, users, tmp_path):
+    ann, bob = users
+    soup = create_recipe(db, ann, "Soup")
+    create_review(db, bob, soup, 8)
+    path = str(tmp_path / "ratings.json")
+
+    ratings = RatingAggregates()
+    ratings.rebuild(db)
+    ratings.save(path)
+    create_review(db, ann, soup, 4)
+
+    loaded = RatingAggregates.load(path)
+    assert not loaded.needs_rebuild
+    assert loaded.stats(soup, "Soup").count == 1
+    assert loaded.catch_up(db) == 1
+    assert loaded.stats(soup, "Soup").mean == 6
+    assert loaded.catch_up(db) == 0
+
+
+def test_review_changes_are_applied_in_place(db, users):
+    ann, bob = users
+    soup = create_recipe(db, ann, "Soup")
+    review_id = create_review(db, bob, soup, 8)
+    ratings = RatingAggregates()
+    ratings.rebuild(db)
+
+    ratings.rating_updated(review_id, 2)
+    assert ratings.review_stats(review_id).histogram[2] == 1
+
+    ratings.recipe_deleted(soup)
+    assert ratings.stats(soup, "Soup").count == 0
+    assert ratings.best_rated(1) == []
+
+
+def test_ratings_outside_the_scale_are_clamped():
+    stats = RatingStats()
+    stats.add(RATING_SCALE + 5)
+    stats.add(-1)
+    assert stats.histogram[RATING_SCALE] == 1
+    assert stats.histogram[0] == 1
+    assert stats.total == RATING_SCALE
+
+    stats.remove(RATING_SCALE + 5)
+    assert stats.histogram[RATING_SCALE] == 0
+
+
+def test_leaderboard_picks_the_best_after_changes():
+    board = Leaderboard()
+    for key, score in enumerate([3.0, 9.0, 1.0, 7.0]):
+        board.set(key, score)
+    assert board.top(2) == [(1, 9.0), (3, 7.0)]
+
+    board.set(1, 0.5)
+    board.discard(3)
+    assert board.top(2) == [(0, 3.0), (2, 1.0)]
+    assert len(board) == 3
+
+
+def test_leaderboard_only_rescans_when_one_of_the_best_falls(monkeypatch):
+    rescans = []
+    nlargest = leaderboard.heapq.nlargest
+    monkeypatch.setattr(
+        leaderboard.heapq,
+        "nlargest",
+        lambda *args, **kwargs: rescans.append(1) or nlargest(*args, **kwargs),
+    )
+    board = Leaderboard(size=2)
+    for key, score in enumerate([3.0, 9.0, 1.0, 7.0]):
+        board.set(key, score)
+    assert board.top(2) == [(1, 9.0), (3, 7.0)]
+
+    board.set(2, 8.0)
+    board.set(0, 2.0)
+    board.discard(0)
+    assert board.top(2) == [(1, 9.0), (2, 8.0)]
+    assert rescans == []
+
+    board.set(1, 0.5)
+    assert board.top(2) == [(2, 8.0), (3, 7.0)]
+    assert len(rescans) == 1
+
+    board.discard(3)
+    assert board.top(2) == [(2, 8.0), (1, 0.5)]
+    assert board.top(3) == [(2, 8.0), (1, 0.5)]
+
+
+class UndatedReviews:
+    """
+    A database whose reviews have no dates, like the reviews of an older MySQL dump
+    """
+
+    @contextmanager
+    def stream(self, proc_name: str, args: list = []):
+        yield iter(
+            [{"review_id": 1, "recipe_id": 7, "recipe_name": "Soup", "rating": 8}]
+        )
+
+
+def test_nothing_trends_when_reviews_have_no_dates(db, users):
+    ann, bob = users
+    soup = create_recipe(db, ann, "Soup")
+    create_review(db, bob, soup, 8)
+    ratings = RatingAggregates()
+    ratings.rebuild(db)
+    assert [key for key, _ in ratings.top_trending(1)] == [soup]
+
+    ratings.rebuild(UndatedReviews())
+    assert not ratings.can_trend
+    assert ratings.top_trending(1) == []
+    assert ratings.best_rated(1)[0][0] == 7
@@ -0,0 +1,78 @@
+import pytest
+
+from units import COUNT, Quantity, combine, parse_amount, singular
+
+
+@pytest.mark.parametrize(
+    "amount, expected",
+    [
+        ("2", Quantity(2.0, "", COUNT)),
+        ("1.5 cups", Quantity(1.5, "cup", "volume")),
+        ("1,5 l", Quantity(1.5, "l", "volume")),
+        ("1,000 g", Quantity(1000.0, "g", "mass")),
+        ("1,250.5 ml", Quantity(1250.5, "ml", "volume")),
+        ("1 1/2 tbsp", Quantity(1.5, "tbsp", "volume")),
+        ("1/4 tsp", Quantity(0.25, "tsp", "volume")),
+        ("1½ cups", Quantity(1.5, "cup", "volume")),
+        ("200 grams", Quantity(200.0, "g", "mass")),
+    ],
+)
+def test_amounts_are_parsed(amount, expected):
+    assert parse_amount(amount) == expected
+
+
+@pytest.mark.parametrize(
+    "amount, expected",
+    [
+        ("1-2 cups", Quantity(2.0, "cup", "volume")),
+        ("1 - 2 cups", Quantity(2.0, "cup", "volume")),
+        ("2 to 3 cloves", Quantity(3.0, "clove", "clove")),
+        ("½–1 tsp", Quantity(1.0, "tsp", "volume")),
+        ("10-12", Quantity(12.0, "", COUNT)),
+    ],
+)
+def test_ranges_use_the_upper_end(amount, expected):
+    assert parse_amount(amount) == expected
+
+
+@pytest.mark.parametrize("amount", ["", "a pinch", "to taste", "1/0 cup"])
+def test_amounts_without_a_number_are_not_parsed(amount):
+    assert parse_amount(amount) is None
+
+
+@pytest.mark.parametrize(
+    "word, expected",
+    [
+        ("glasses", "glass"),
+        ("glass", "glass"),
+        ("cloves", "clove"),
+        ("cherries", "cherry"),
+        ("pinches", "pinch"),
+        ("dashes", "dash"),
+        ("boxes", "box"),
+        ("leaves", "leaf"),
+        ("tomatoes", "tomato"),
+        ("slices", "slice"),
+    ],
+)
+def test_unit_words_are_made_singular(word, expected):
+    assert singular(word) == expected
+
+
+def test_counts_of_the_ingredient_itself_add_up_with_plain_counts():
+    assert parse_amount("2 large eggs", "Eggs") == Quantity(2.0, "", COUNT)
+    assert parse_amount("1 egg", "eggs") == Quantity(1.0, "", COUNT)
+
+    total = combine([parse_amount("2 large eggs", "eggs"), parse_amount("2", "eggs")])
+    assert total == [Quantity(4.0, "", COUNT)]
+
+
+def test_size_words_are_left_out_of_other_units():
+    assert parse_amount("2 large cloves", "garlic") == parse_amount("2 cloves")
+    assert parse_amount("3 bay leaves") == Quantity(3.0, "bay leaf", "bay leaf")
+
+
+def test_quantities_of_a_dimension_are_combined_in_the_first_unit():
+    (total,) = combine([parse_amount("1 cup"), parse_amount("236.5882365 ml")])
+    assert total.unit == "cup"
+    assert total.value == pytest.approx(2.0)
@@ -0,0 +1,282 @@
+import re
+from functools import lru_cache
+from itertools import zip_longest
+from typing import Iterable, NamedTuple
+
+# Number of distinct amount strings whose parsed form is remembered
+PARSE_CACHE_SIZE = 4096
+
+MASS = "mass"
+VOLUME = "volume"
+COUNT = "count"
+
+# unit -> (dimension, size in the dimension's base unit: grams or millilitres)
+UNITS = {
+    "mg": (MASS, 0.001),
+    "g": (MASS, 1.0),
+    "kg": (MASS, 1000.0),
+    "oz": (MASS, 28.349523125),
+    "lb": (MASS, 453.59237),
+    "ml": (VOLUME, 1.0),
+    "cl": (VOLUME, 10.0),
+    "dl": (VOLUME, 100.0),
+    "l": (VOLUME, 1000.0),
+    "tsp": (VOLUME, 4.92892159375),
+    "tbsp": (VOLUME, 14.78676478125),
+    "fl oz": (VOLUME, 29.5735295625),
+    "cup": (VOLUME, 236.5882365),
+    "pint": (VOLUME, 473.176473),
+    "quart": (VOLUME, 946.352946),
+    "gallon": (VOLUME, 3785.411784),
+    "": (COUNT, 1.0),
+}
+
+# Other ways of writing the units above
+UNIT_ALIASES = {
+    "milligram": "mg",
+    "milligrams": "mg",
+    "gram": "g",
+    "grams": "g",
+    "gr": "g",
+    "kilogram": "kg",
+    "kilograms": "kg",
+    "kilo": "kg",
+    "kilos": "kg",
+    "ounce": "oz",
+    "ounces": "oz",
+    "pound": "lb",
+    "pounds": "lb",
+    "lbs": "lb",
+    "millilitre": "ml",
+    "millilitres": "ml",
+    "milliliter": "ml",
+    "milliliters": "ml",
+    "litre": "l",
+    "litres": "l",
+    "liter": "l",
+    "liters": "l",
+    "teaspoon": "tsp",
+    "teaspoons": "tsp",
+    "tsps": "tsp",
+    "tablespoon": "tbsp",
+    "tablespoons": "tbsp",
+    "tbsps": "tbsp",
+    "tbs": "tbsp",
+    "fluid ounce": "fl oz",
+    "fluid ounces": "fl oz",
+    "cups": "cup",
+    "c": "cup",
+    "pints": "pint",
+    "pt": "pint",
+    "quarts": "quart",
+    "qt": "quart",
+    "gallons": "gallon",
+    "gal": "gallon",
+}
+
+# Plurals of unit words that dropping an "s" or "es" does not turn back into the word
+IRREGULAR_PLURALS = {
+    "leaves": "leaf",
+    "loaves": "loaf",
+    "halves": "half",
+    "potatoes": "potato",
+    "tomatoes": "tomato",
+}
+
+# Words describing the size of what is counted, left out so "2 large eggs" and "1 egg"
+# add up
+SIZE_WORDS = {"small", "medium", "large", "big", "extra", "jumbo", "whole"}
+
+VULGAR_FRACTIONS = {
+    "¼": 0.25,
+    "½": 0.5,
+    "¾": 0.75,
+    "⅓": 1 / 3,
+    "⅔": 2 / 3,
+    "⅛": 0.125,
+}
+
+# A number such as "2", "1.5", "1,5" or "1,000": a comma followed by exactly three
+# digits separates thousands, any other comma is a decimal point
+NUMBER = r"\d{1,3}(?:,\d{3})+(?![\d,])(?:\.\d+)?|\d+(?:[.,]\d+)?"
+THOUSANDS_PATTERN = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?")
+
+# A leading quantity such as "2", "1.5", "1,5", "1/2", "1 1/2" or "1½", then the unit
+AMOUNT_PATTERN = re.compile(
+    r"^\s*(?:(\d+)\s+(\d+)\s*/\s*(\d+)"
+    r"|(\d+)\s*/\s*(\d+)"
+    rf"|({NUMBER})?\s*([¼½¾⅓⅔⅛])"
+    rf"|({NUMBER}))"
+    r"\s*(.*?)\s*$"
+)
+
+# The lower end of a range like "1-2 cups" or "2 to 3 cloves", up to where the upper
+# end starts
+RANGE_PATTERN = re.compile(
+    r"^\s*[\d¼½¾⅓⅔⅛][\d\s.,/¼½¾⅓⅔⅛]*?\s*(?:-|–|—|\bto\b)\s*(?=[\d¼½¾⅓⅔⅛])"
+)
+
+
+class Quantity(NamedTuple):
+    """
+    An amount in canonical form: a number of a known unit (or of a unit word the parser
+    does not know, like "cloves"), and the dimension it measures
+    """
+
+    value: float
+    unit: str
+    dimension: str
+
+    @property
+    def base_value(self) -> float:
+        """
+        The value in grams for masses, millilitres for volumes and as is otherwise
+        """
+        size = UNITS.get(self.unit)
+        return self.value * size[1] if size else self.value
+
+    def to(self, unit: str) -> "Quantity":
+        """
+        Converts to another unit of the same dimension
+        """
+        dimension, size = UNITS[unit]
+        if dimension != self.dimension:
+            raise ValueError(f"Cannot convert {self.dimension} to {dimension}")
+        return Quantity(self.base_value / size, unit, dimension)
+
+    def scaled(self, factor: float) -> "Quantity":
+        return self._replace(value=self.value * factor)
+
+    def __str__(self):
+        value = f"{self.value:.2f}".rstrip("0").rstrip(".")
+        return f"{value} {self.unit}".rstrip()
+
+
+def parse_number(text: str) -> float:
+    if THOUSANDS_PATTERN.fullmatch(text):
+        return float(text.replace(",", ""))
+    return float(text.replace(",", "."))
+
+
+def singular(word: str) -> str:
+    """
+    Returns the singular of a unit word such as "cloves", "glasses" or "cherries"
+    """
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if len(word) <= 2 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "ches", "shes", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_amount(amount: str, ingredient: str = "") -> Quantity | None:
+    """
+    Turns an amount like "1 1/2 cups" or "200 g" into a Quantity, or returns None when
+    it does not start with a number, like "a pinch". For a range like "1-2 cups" the
+    upper end is used, since that is how much may be needed. An amount counting the
+    ingredient itself, like "2 large eggs" for eggs, is a plain count like "2". Results
+    are memoized since the same few amounts are written over and over
+    """
+    if not amount:
+        return None
+
+    in_range = RANGE_PATTERN.match(amount)
+    if in_range is not None:
+        amount = amount[in_range.end() :]
+
+    match = AMOUNT_PATTERN.match(amount)
+    if match is None:
+        return None
+
+    whole, num, den, frac_num, frac_den, vulgar_whole, vulgar, number, unit = (
+        match.groups()
+    )
+    if whole is not None:
+        if int(den) == 0:
+            return None
+        value = int(whole) + int(num) / int(den)
+    elif frac_num is not None:
+        if int(frac_den) == 0:
+            return None
+        value = int(frac_num) / int(frac_den)
+    elif vulgar is not None:
+        whole = parse_number(vulgar_whole) if vulgar_whole else 0.0
+        value = whole + VULGAR_FRACTIONS[vulgar]
+    else:
+        value = parse_number(number)
+
+    unit = unit.lower().rstrip(".")
+    unit = UNIT_ALIASES.get(unit, unit)
+    if unit in UNITS:
+        return Quantity(value, unit, UNITS[unit][0])
+
+    # a unit word that cannot be converted, only added to the same word
+    words = unit.split()
+    while words and words[0] in SIZE_WORDS:
+        words.pop(0)
+    unit = " ".join(words[:-1] + [singular(words[-1])]) if words else ""
+    if unit == "" or unit == singular(ingredient.lower().strip()):
+        return Quantity(value, "", COUNT)
+    return Quantity(value, unit, unit)
+
+
+def parse_amounts(
+    amounts: Iterable[str], ingredients: Iterable[str] = ()
+) -> list[Quantity | None]:
+    """
+    Parses many amounts at once, such as every amount in a recipe, each along with the
+    name of its ingredient when they are given
+    """
+    return [
+        parse_amount(amount, ingredient)
+        for amount, ingredient in zip_longest(amounts, ingredients, fillvalue="")
+    ]
+
+
+def combine(quantities: Iterable[Quantity]) -> list[Quantity]:
+    """
+    Adds up quantities of the same dimension, in the unit of the first one of each
+    dimension, so "1 cup" and "100 ml" become about "1.42 cup"
+    """
+    totals = {}
+    for quantity in quantities:
+        total = totals.get(quantity.dimension)
+        if total is None:
+            totals[quantity.dimension] = quantity
+        elif total.unit == quantity.unit:
+            totals[quantity.dimension] = total._replace(
+                value=total.value + quantity.value
+            )
+        else:
+            totals[quantity.dimension] = total._replace(
+                value=total.value + quantity.to(total.unit).value
+            )
+
+    return list(totals.values())
+
+
+def recipe_quantities(db, recipe_ids: Iterable[int]) -> dict[int, dict[int, Quantity]]:
+    """
+    Returns the parsed amount of every ingredient in each recipe, keyed by recipe ID and
+    then ingredient ID. Ingredients whose amount cannot be parsed are left out
+    """
+    quantities = {}
+    for recipe_id in recipe_ids:
+        rows = db.callproc("get_ingredients_for_recipe", [recipe_id])
+        parsed = parse_amounts(
+            (row.get("amount") for row in rows), (row.get("name") for row in rows)
+        )
+        quantities[recipe_id] = {
+            row.get("ingredient_id"): quantity
+            for row, quantity in zip(rows, parsed)
+            if quantity is not None
+        }
+
+    return quantities